@@ -0,0 +1,363 @@
+"""
+Reproducible benchmarks for generation, solving, serialization and websocket message handling.
+
+    python -m bench.run --out results.json
+    python -m bench.run --out new.json --compare results.json
+
+Results are written as JSON, every case has a `name`, its `params` and timing `stats` in seconds.
+The solver corpus is read from bench/corpus.json so that it does not change with the generator,
+`--regenerate-corpus` rebuilds it.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "corpus.json")
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        'n': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'median': statistics.median(ordered),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'min': ordered[0],
+        'max': ordered[-1],
+    }
+
+
+def quiet(function: Callable, *args, **kwargs):
+    # Keep the game's log records out of the benchmark output
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return function(*args, **kwargs)
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def bench_generation(sizes: List[int], runs: int, seed: int, stars_per_unit: int = 1) -> List[Dict]:
+    from game.puzzle_pool import generate_unique_grid
+
+    results = []
+    for size in sizes:
+        random.seed(seed + size)
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            quiet(generate_unique_grid, size, stars_per_unit=stars_per_unit)
+            samples.append(time.perf_counter() - start)
+        params = {'size': size, 'runs': runs, 'seed': seed}
+        if stars_per_unit != 1:
+            # One star cases keep the params of earlier results, to compare with them
+            params['stars_per_unit'] = stars_per_unit
+        results.append({'name': 'generation', 'params': params, 'stats': summarize(samples)})
+    return results
+
+
+def build_corpus(sizes: List[int], per_size: int, seed: int) -> List[Dict]:
+    """
+    Unique grids from the generator, plus a copy of each with one cell moved to a
+    neighbouring region, which often breaks uniqueness.
+    """
+    from game.puzzle_pool import generate_unique_grid
+
+    corpus = []
+    for size in sizes:
+        random.seed(seed + size)
+        for i in range(per_size):
+            grid = quiet(generate_unique_grid, size)
+            regions = bytearray(grid.board.regions)
+            corpus.append({'name': f"{size}x{size}-{i}", 'size': size, 'regions': regions.hex()})
+
+            for _ in range(100):
+                index = random.randrange(size * size)
+                y, x = divmod(index, size)
+                neighbors = [ny * size + nx for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)) if 0 <= ny < size and 0 <= nx < size]
+                other = random.choice(neighbors)
+                if regions[other] != regions[index] and not grid.board.stars >> index & 1:
+                    regions[index] = regions[other]
+                    corpus.append({'name': f"{size}x{size}-{i}-perturbed", 'size': size, 'regions': regions.hex()})
+                    break
+    return corpus
+
+
+def bench_solver(corpus: List[Dict], repeats: int) -> List[Dict]:
+    from game import deduction, placements, solver
+    from game.board import Board
+
+    results = []
+    placements_skipped = False
+    for entry in corpus:
+        size = entry['size']
+        board = Board(size, size, regions=bytearray.fromhex(entry['regions']))
+        regions = list(board.region_masks().values())
+        for limit in (2, None):
+            stats: Dict[str, int] = {}
+            count = solver.count_solutions(size, size, regions, limit=limit, stats=stats)
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                solver.count_solutions(size, size, regions, limit=limit)
+                samples.append(time.perf_counter() - start)
+            results.append({
+                'name': 'solver',
+                'params': {'grid': entry['name'], 'size': size, 'limit': limit},
+                'solutions': count,
+                'nodes': stats['nodes'],
+                'stats': summarize(samples),
+            })
+
+        if placements.available(size):
+            placements.placement_table(size)
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                count = placements.count_solutions(size, board.regions)
+                samples.append(time.perf_counter() - start)
+            results.append({
+                'name': 'placements',
+                'params': {'grid': entry['name'], 'size': size, 'limit': None},
+                'solutions': count,
+                'stats': summarize(samples),
+            })
+        elif size <= placements.MAX_TABLE_SIZE and not placements_skipped:
+            # Results compared with a run that had NumPy would otherwise just lack the case
+            print("Skipping the placements case, NumPy is not installed (pip install -r bench/requirements.txt)", file=sys.stderr)
+            placements_skipped = True
+
+        trace: Dict[str, int] = dict.fromkeys(deduction.RULES, 0)
+        count = len(deduction.find_solutions(size, size, regions, limit=2, trace=trace))
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            deduction.find_solutions(size, size, regions, limit=2)
+            samples.append(time.perf_counter() - start)
+        results.append({
+            'name': 'deduction',
+            'params': {'grid': entry['name'], 'size': size, 'limit': 2},
+            'solutions': count,
+            'rules': trace,
+            'stats': summarize(samples),
+        })
+    return results
+
+
+def bench_serialization(sizes: List[int], repeats: int, seed: int) -> List[Dict]:
+    from game.game_session import GameSession
+    from game.puzzle_pool import generate_unique_grid
+    from model.grid_model import GridFormat
+
+    results = []
+    for size in sizes:
+        random.seed(seed + size)
+        session = GameSession("bench", quiet(generate_unique_grid, size))
+        for format in GridFormat:
+            samples = []
+            payload = b""
+            for _ in range(repeats):
+                start = time.perf_counter()
+                payload = session.to_dto(format).model_dump_json().encode()
+                samples.append(time.perf_counter() - start)
+            results.append({
+                'name': 'to_dto',
+                'params': {'size': size, 'format': format.value},
+                'bytes': len(payload),
+                'stats': summarize(samples),
+            })
+    return results
+
+
+def bench_update_grid(sizes: List[int], repeats: int, seed: int) -> List[Dict]:
+    """
+    Decoding and handling of a verbose update_grid message, straight through GameSession.handle_message.
+    """
+    import asyncio
+    from game import codec
+    from game.game_session import GameSession
+    from game.puzzle_pool import generate_unique_grid
+
+    class Socket():
+        async def send_json(self, message: Dict):
+            pass
+
+        async def close(self, code: int = 1000, reason: Optional[str] = None):
+            pass
+
+    async def run(size: int) -> List[float]:
+        grid = quiet(generate_unique_grid, size)
+        session = GameSession("bench", grid)
+        socket = Socket()
+        session.connect(socket)
+        rng = random.Random(seed + size)
+        raw = json.dumps({'action': 'update_grid', 'grid': {
+            'width': size,
+            'height': size,
+            'cells': [[{
+                'content': rng.choice(('star', 'cross', 'empty')),
+                'regionColor': grid.board.color(x, y),
+                'x': x,
+                'y': y,
+            } for x in range(size)] for y in range(size)],
+        }})
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await session.handle_message(socket, codec.loads(raw))
+            samples.append(time.perf_counter() - start)
+        session.close()
+        return samples
+
+    results = []
+    for size in sizes:
+        random.seed(seed + size)
+        results.append({'name': 'update_grid', 'params': {'size': size}, 'stats': summarize(asyncio.run(run(size)))})
+    return results
+
+
+def bench_websocket(players: int, moves: int, seed: int) -> List[Dict]:
+    """
+    Runs `players` simulated players, two per game, against /ws/{game_id} through the in-process
+    test client. Each player sends random moves and every 10th message is a get_grid round trip.
+    """
+    from fastapi.testclient import TestClient
+    import main
+
+    size = 10
+    rtts: List[float] = []
+    lock = threading.Lock()
+    errors: List[str] = []
+
+    def play(client: TestClient, game_id: str, player: int):
+        rng = random.Random(seed * 1000 + player)
+        own_rtts = []
+        try:
+            with client.websocket_connect(f"/ws/{game_id}") as websocket:
+                for i in range(moves):
+                    if i % 10 == 9:
+                        start = time.perf_counter()
+                        websocket.send_json({'action': 'get_grid'})
+                        while websocket.receive_json()['action'] != 'grid':
+                            pass
+                        own_rtts.append(time.perf_counter() - start)
+                    else:
+                        websocket.send_json({
+                            'action': 'move',
+                            'x': rng.randrange(size),
+                            'y': rng.randrange(size),
+                            'content': rng.choice(('star', 'cross', 'empty')),
+                        })
+        except Exception as e:
+            errors.append(repr(e))
+        with lock:
+            rtts.extend(own_rtts)
+
+    logging.disable(logging.CRITICAL)
+    with contextlib.redirect_stdout(io.StringIO()), TestClient(main.app) as client:
+        random.seed(seed)
+        game_ids = [client.get("/create-game").json()['game_id'] for _ in range((players + 1) // 2)]
+        threads = [threading.Thread(target=play, args=(client, game_ids[i // 2], i)) for i in range(players)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    logging.disable(logging.NOTSET)
+
+    return [{
+        'name': 'websocket',
+        'params': {'players': players, 'moves': moves, 'seed': seed},
+        'messages_per_second': players * moves / elapsed,
+        'errors': len(errors),
+        'stats': summarize(rtts) if rtts else None,
+    }]
+
+
+def compare(results: List[Dict], baseline: List[Dict]):
+    """
+    Prints the median change of every case found in both runs.
+    """
+    def key(result: Dict) -> str:
+        return f"{result['name']} {json.dumps(result['params'], sort_keys=True)}"
+
+    previous = {key(result): result for result in baseline}
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not result.get('stats') or not old.get('stats'):
+            continue
+        ratio = result['stats']['median'] / old['stats']['median'] if old['stats']['median'] else float('inf')
+        print(f"{key(result):<70} {old['stats']['median'] * 1000:10.3f}ms -> {result['stats']['median'] * 1000:10.3f}ms  x{ratio:.2f}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument("--out", help="write the results to this JSON file instead of stdout")
+    parser.add_argument("--compare", help="previous results to compare medians with")
+    parser.add_argument("--only", nargs="+", choices=["generation", "solver", "serialization", "update_grid", "websocket"])
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--quick", action="store_true", help="fewer runs, for a smoke test")
+    parser.add_argument("--regenerate-corpus", action="store_true")
+    args = parser.parse_args(argv)
+
+    runs = 3 if args.quick else 20
+    selected = set(args.only or ["generation", "solver", "serialization", "update_grid", "websocket"])
+
+    if args.regenerate_corpus or not os.path.exists(CORPUS_PATH):
+        with open(CORPUS_PATH, "w") as file:
+            json.dump(build_corpus([6, 8, 10, 12, 14], per_size=3, seed=args.seed), file, indent=1)
+    with open(CORPUS_PATH) as file:
+        corpus = json.load(file)
+
+    results: List[Dict] = []
+    if "generation" in selected:
+        results += bench_generation(list(range(6, 15)), runs, args.seed)
+        results += bench_generation([10, 12, 14], max(1, runs // 4), args.seed, stars_per_unit=2)
+    if "solver" in selected:
+        results += bench_solver(corpus, runs)
+    if "serialization" in selected:
+        results += bench_serialization([6, 10, 14], runs * 10, args.seed)
+    if "update_grid" in selected:
+        results += bench_update_grid([6, 10, 14], runs * 10, args.seed)
+    if "websocket" in selected:
+        results += bench_websocket(players=4 if args.quick else 32, moves=50 if args.quick else 200, seed=args.seed)
+
+    output = {
+        'meta': {
+            'python': sys.version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'timestamp': time.time(),
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(output, file, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file)['results'])
+
+
+if __name__ == "__main__":
+    main()
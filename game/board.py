@@ -0,0 +1,95 @@
+from typing import Dict, List, Optional
+
+# Region id of the cells that do not belong to any region yet
+NO_REGION = 0xFF
+
+
+class Board():
+    """
+    Compact storage of a grid: one region id byte per cell (index y * width + x),
+    the stars as a bitmask over the same indexes and a palette mapping region ids to colors.
+    Every row, column and region holds `stars_per_unit` stars.
+    """
+    width: int
+    height: int
+    palette: List[str]
+    regions: bytearray
+    stars: int
+    stars_per_unit: int
+
+    def __init__(self, width: int, height: int, palette: List[str] = None, regions: bytearray = None, stars: int = 0, stars_per_unit: int = 1):
+        self.width = width
+        self.height = height
+        self.palette = palette if palette is not None else []
+        self.regions = regions if regions is not None else bytearray(width * height)
+        self.stars = stars
+        self.stars_per_unit = stars_per_unit
+
+    def copy(self) -> "Board":
+        """
+        Copies the cells, the palette is shared since region ids never change color.
+        """
+        return Board(self.width, self.height, self.palette, bytearray(self.regions), self.stars, self.stars_per_unit)
+
+    def index(self, x: int, y: int) -> int:
+        return y * self.width + x
+
+    def is_star(self, x: int, y: int) -> bool:
+        return bool(self.stars >> (y * self.width + x) & 1)
+
+    def set_star(self, x: int, y: int, is_star: bool = True):
+        bit = 1 << (y * self.width + x)
+        self.stars = self.stars | bit if is_star else self.stars & ~bit
+
+    def region(self, x: int, y: int) -> int:
+        return self.regions[y * self.width + x]
+
+    def set_region(self, x: int, y: int, region: int):
+        self.regions[y * self.width + x] = region
+
+    def color(self, x: int, y: int) -> Optional[str]:
+        region = self.regions[y * self.width + x]
+        return None if region == NO_REGION else self.palette[region]
+
+    def region_id(self, color: Optional[str]) -> int:
+        """
+        Returns the region id of a color, adding it to the palette if needed.
+        """
+        if color is None:
+            return NO_REGION
+        try:
+            return self.palette.index(color)
+        except ValueError:
+            if len(self.palette) >= NO_REGION:
+                raise ValueError("Too many regions for a board")
+            self.palette.append(color)
+            return len(self.palette) - 1
+
+    def region_masks(self) -> Dict[int, int]:
+        """
+        Returns the cell bitmask of every region on the board.
+        """
+        masks: Dict[int, int] = {}
+        for index, region in enumerate(self.regions):
+            masks[region] = masks.get(region, 0) | (1 << index)
+        return masks
+
+    def count(self, region: int) -> int:
+        return self.regions.count(region)
+
+    def is_connected(self, mask: int) -> bool:
+        """
+        Returns True if the cells of the bitmask form a single orthogonally connected piece.
+        """
+        if not mask:
+            return False
+        width = self.width
+        left_edge = sum(1 << (y * width) for y in range(self.height))
+        right_edge = left_edge << (width - 1)
+        seen = mask & -mask
+        while True:
+            grown = seen | ((seen << 1) & ~left_edge) | ((seen >> 1) & ~right_edge) | (seen << width) | (seen >> width)
+            grown &= mask
+            if grown == seen:
+                return seen == mask
+            seen = grown
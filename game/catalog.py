@@ -0,0 +1,155 @@
+"""
+Binary catalog of pre-generated puzzles.
+
+Layout (little endian):
+  header   magic (8 bytes) | section count (u32)
+  sections size (u16) | difficulty (u16) | record size (u32) | record count (u32) | offset (u64)
+  records  difficulty (u8) | region id per cell (size * size bytes) | star bitmask (ceil(size * size / 8) bytes)
+
+Difficulty is the level from game.deduction, or UNGRADED, every section holds the puzzles of one size and one level.
+Only puzzles with one star per unit are stored, the deductions do not grade the others.
+
+Records have a fixed size within a section, so a puzzle is read straight from the memory-mapped file.
+Colors are not stored, a palette is drawn when the puzzle is served.
+
+Build a catalog with:
+    python -m game.catalog puzzles.cat --sizes 8 10 --count 1000
+"""
+import argparse
+import mmap
+import random
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from game.deduction import DIFFICULTY_NAMES
+from game.grid import Grid
+
+MAGIC = b"SBCAT1\0\0"
+HEADER = struct.Struct("<8sI")
+SECTION = struct.Struct("<HHIIQ")
+# Difficulty of the puzzles stored without a level, never served for a requested one
+UNGRADED = 0xFF
+
+
+def record_size(size: int) -> int:
+    return 1 + size * size + (size * size + 7) // 8
+
+
+def encode_record(grid: Grid, difficulty: Optional[int] = None) -> bytes:
+    """
+    Encodes a square grid, region ids are renumbered in order of appearance.
+    The difficulty defaults to the grid's own, ungraded grids are stored as UNGRADED.
+    """
+    if difficulty is None:
+        difficulty = grid.difficulty if grid.difficulty is not None else UNGRADED
+    size = grid.width
+    ids: Dict[int, int] = {}
+    regions = bytes(ids.setdefault(region, len(ids)) for region in grid.board.regions)
+    stars = grid.board.stars.to_bytes((size * size + 7) // 8, "little")
+    return bytes([difficulty]) + regions + stars
+
+
+def write_catalog(path: str, records: Dict[Tuple[int, int], List[bytes]]):
+    """
+    Writes the records grouped by (size, difficulty).
+    """
+    sections = sorted(records.items())
+    offset = HEADER.size + SECTION.size * len(sections)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(sections)))
+        for (size, difficulty), section_records in sections:
+            file.write(SECTION.pack(size, difficulty, record_size(size), len(section_records), offset))
+            offset += record_size(size) * len(section_records)
+        for _, section_records in sections:
+            for record in section_records:
+                file.write(record)
+
+
+class PuzzleCatalog():
+    """
+    Read-only view over a memory-mapped catalog file.
+    """
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a puzzle catalog")
+        # (size, difficulty) -> (record size, record count, offset)
+        self._sections: Dict[Tuple[int, int], Tuple[int, int, int]] = {}
+        for i in range(count):
+            size, difficulty, size_of_record, records, offset = SECTION.unpack_from(self._mmap, HEADER.size + i * SECTION.size)
+            if records:
+                self._sections[(size, difficulty)] = (size_of_record, records, offset)
+
+    def has(self, size: int, difficulty: Optional[int] = None) -> bool:
+        return self.count(size, difficulty) > 0
+
+    def count(self, size: int, difficulty: Optional[int] = None) -> int:
+        return sum(records for (s, d), (_, records, _) in self._sections.items() if s == size and difficulty in (None, d))
+
+    def get(self, size: int, difficulty: Optional[int] = None, index: Optional[int] = None) -> Optional[Grid]:
+        """
+        Returns the puzzle at `index` among those matching size and difficulty, a random one by default.
+        """
+        sections = [(key, value) for key, value in sorted(self._sections.items()) if key[0] == size and difficulty in (None, key[1])]
+        total = sum(records for _, (_, records, _) in sections)
+        if not total:
+            return None
+        index = random.randrange(total) if index is None else index % total
+
+        for _, (size_of_record, records, offset) in sections:
+            if index < records:
+                return self._decode(size, offset + index * size_of_record)
+            index -= records
+
+    def _decode(self, size: int, position: int) -> Grid:
+        cells = size * size
+        regions = bytearray(self._mmap[position + 1:position + 1 + cells])
+        stars = int.from_bytes(self._mmap[position + 1 + cells:position + record_size(size)], "little")
+
+        palette = Grid()
+        palette.generate_random_colors(nb_colors=max(regions) + 1)
+        grid = Grid.from_compact((size, size, tuple(palette.colors), regions, stars, 1))
+        difficulty = self._mmap[position]
+        grid.difficulty = difficulty if difficulty != UNGRADED else None
+        return grid
+
+    def close(self):
+        self._mmap.close()
+
+
+def _generate_record(size: int) -> bytes:
+    from game.puzzle_pool import generate_unique_grid
+    return encode_record(generate_unique_grid(size))
+
+
+def build(path: str, sizes: List[int], count: int, workers: Optional[int] = None):
+    # Only the batch command needs worker processes, keep them out of the server's imports
+    from concurrent.futures import ProcessPoolExecutor
+    records: Dict[Tuple[int, int], List[bytes]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for size in sizes:
+            start = time.time()
+            for record in executor.map(_generate_record, [size] * count, chunksize=16):
+                records.setdefault((size, record[0]), []).append(record)
+            levels = ", ".join(f"{len(records.get((size, level), []))} {name}" for level, name in enumerate(DIFFICULTY_NAMES))
+            if (size, UNGRADED) in records:
+                levels += f", {len(records[(size, UNGRADED)])} ungraded"
+            print(f"Generated {count} puzzles of size {size} in {time.time() - start:.1f}s ({levels})")
+    write_catalog(path, records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a binary catalog of unique puzzles.")
+    parser.add_argument("path")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    build(args.path, args.sizes, args.count, args.workers)
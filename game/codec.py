@@ -0,0 +1,23 @@
+"""
+JSON decoding of the websocket messages, and encoding of the move log. orjson is optional, it parses
+several times faster than the standard library and is used whenever it is installed.
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, separators=(",", ":"))
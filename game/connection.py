@@ -0,0 +1,112 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from fastapi import WebSocket
+from game.player_board import PlayerBoard
+from model.grid_model import GridFormat
+
+
+class Connection():
+    """
+    A client connected to a game session: its websocket, its board and its outbound queue.
+
+    Messages are queued and written by a dedicated task, so a slow client never blocks the session.
+    The queue holds at most `max_queue` messages:
+      - a message sent with a `coalesce_key` replaces the pending message with the same key (latest state wins)
+      - when the queue is full the oldest non critical message is dropped
+      - if only critical messages are pending the client is too slow to play, its socket is closed
+
+    `last_seen` is the time.monotonic() of the last message received, the heartbeat closes connections
+    that stay silent for too long.
+    """
+    websocket: WebSocket
+    player: PlayerBoard
+    format: GridFormat
+    player_id: str
+    max_queue: int
+    dropped: int
+    last_seen: float
+
+    def __init__(self, websocket: WebSocket, player: PlayerBoard, format: GridFormat = GridFormat.VERBOSE, max_queue: int = 32, player_id: Optional[str] = None):
+        self.websocket = websocket
+        self.player = player
+        self.format = format
+        self.player_id = player_id if player_id is not None else uuid.uuid4().hex
+        self.max_queue = max_queue
+        self.dropped = 0
+        self.last_seen = time.monotonic()
+        self._queue: "OrderedDict[Hashable, Tuple[Dict, bool]]" = OrderedDict()
+        self._ids = itertools.count()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._writer = asyncio.create_task(self._write())
+
+    def send(self, message: Dict, coalesce_key: Optional[Hashable] = None, critical: bool = False) -> bool:
+        """
+        Queues a message without waiting, returns False if the connection is closed or got closed for being too slow.
+        """
+        if self._closed:
+            return False
+
+        if coalesce_key is not None and coalesce_key in self._queue:
+            _, was_critical = self._queue[coalesce_key]
+            self._queue[coalesce_key] = (message, critical or was_critical)
+            return True
+
+        if len(self._queue) >= self.max_queue:
+            droppable = next((key for key, (_, is_critical) in self._queue.items() if not is_critical), None)
+            if droppable is None:
+                self.close(code=1008, reason="Client too slow")
+                return False
+            del self._queue[droppable]
+            self.dropped += 1
+
+        key = coalesce_key if coalesce_key is not None else ("message", next(self._ids))
+        self._queue[key] = (message, critical)
+        self._ready.set()
+        return True
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def seen(self):
+        self.last_seen = time.monotonic()
+
+    def idle_for(self) -> float:
+        return time.monotonic() - self.last_seen
+
+    def close(self, code: int = 1000, reason: Optional[str] = None):
+        """
+        Stops the writer and closes the socket in the background.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.clear()
+        self._writer.cancel()
+        asyncio.create_task(self._close_socket(code, reason))
+
+    async def _close_socket(self, code: int, reason: Optional[str]):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            # Already closed by the client
+            pass
+
+    async def _write(self):
+        while True:
+            await self._ready.wait()
+            while self._queue:
+                _, (message, _) = self._queue.popitem(last=False)
+                try:
+                    await self.websocket.send_json(message)
+                except Exception:
+                    self._closed = True
+                    self._queue.clear()
+                    return
+            self._ready.clear()
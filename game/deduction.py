@@ -0,0 +1,207 @@
+import itertools
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from game import solver
+
+# Deduction rules from the easiest to the hardest, with the difficulty level they stand for.
+# A grid is as hard as the hardest rule needed to solve it, 'guess' meaning logic alone was not enough.
+RULES = ('single', 'neighbours', 'confinement', 'blocking', 'pigeonhole', 'guess')
+LEVELS = {'single': 0, 'neighbours': 0, 'confinement': 1, 'blocking': 2, 'pigeonhole': 3, 'guess': 4}
+# Weight of each application of a rule in the finer grained score
+WEIGHTS = {'single': 1, 'neighbours': 1, 'confinement': 3, 'blocking': 5, 'pigeonhole': 8, 'guess': 20}
+DIFFICULTY_NAMES = ('easy', 'medium', 'hard', 'expert', 'extreme')
+
+
+class Contradiction(Exception):
+    pass
+
+
+class Grade():
+    """
+    Rules used to solve a grid, `rules` counts how many times each one made progress.
+    """
+    solutions: int
+    rules: Dict[str, int]
+
+    def __init__(self, solutions: int, rules: Dict[str, int]):
+        self.solutions = solutions
+        self.rules = rules
+
+    @property
+    def difficulty(self) -> int:
+        return max((LEVELS[rule] for rule, count in self.rules.items() if count), default=0)
+
+    @property
+    def score(self) -> int:
+        return sum(WEIGHTS[rule] * count for rule, count in self.rules.items())
+
+    def __repr__(self) -> str:
+        return f"Grade(solutions={self.solutions}, difficulty={DIFFICULTY_NAMES[self.difficulty]}, score={self.score}, rules={self.rules})"
+
+
+class Deducer():
+    """
+    Solves a grid the way a player would: deductions first, branching only when they run out.
+
+    The state is a bitmask of the cells that can still hold a star and a bitmask of the stars.
+    Units are the rows, the columns and the regions, each needs exactly one star.
+    """
+    width: int
+    height: int
+    regions: Tuple[int, ...]
+
+    def __init__(self, width: int, height: int, regions: Sequence[int]):
+        if not width == height == len(regions):
+            raise ValueError("The deductions need as many regions as rows and columns")
+        self.width = width
+        self.height = height
+        self.regions = tuple(regions)
+        self.rows = tuple(((1 << width) - 1) << (y * width) for y in range(height))
+        self.cols = tuple(sum(1 << (y * width + x) for y in range(height)) for x in range(width))
+        self.units = self.rows + self.cols + self.regions
+        self._kill = solver.blocking_masks(width, height)
+        self._neighbours = tuple(kill & ~self.rows[i // width] & ~self.cols[i % width] for i, kill in enumerate(self._kill))
+        self._region_of = [0] * (width * height)
+        for region in self.regions:
+            cells = region
+            while cells:
+                low = cells & -cells
+                self._region_of[low.bit_length() - 1] = region
+                cells ^= low
+        # Cells that a star on each cell rules out, its own region included
+        self._cover = tuple(kill | region for kill, region in zip(self._kill, self._region_of))
+
+    def place(self, candidates: int, stars: int, bit: int, trace: Dict[str, int]) -> Tuple[int, int]:
+        index = bit.bit_length() - 1
+        if candidates & self._neighbours[index] & ~bit:
+            trace['neighbours'] += 1
+        return candidates & ~self._cover[index], stars | bit
+
+    def propagate(self, candidates: int, stars: int, trace: Dict[str, int]) -> Tuple[int, int]:
+        """
+        Applies the rules until none makes progress, easiest rules first.
+        Raises Contradiction when a unit is left without any possible star.
+        """
+        while True:
+            progress = False
+            for unit in self.units:
+                if unit & stars:
+                    continue
+                avail = unit & candidates
+                if not avail:
+                    raise Contradiction()
+                if not avail & (avail - 1):
+                    candidates, stars = self.place(candidates, stars, avail, trace)
+                    trace['single'] += 1
+                    progress = True
+            if progress:
+                continue
+
+            for rule in (self._confinement, self._blocking, self._pigeonhole):
+                reduced = rule(candidates, stars)
+                if reduced != candidates:
+                    trace[rule.__name__[1:]] += 1
+                    candidates = reduced
+                    break
+            else:
+                return candidates, stars
+
+    def _open(self, units: Tuple[int, ...], candidates: int, stars: int) -> List[int]:
+        return [unit & candidates for unit in units if not unit & stars]
+
+    def _confinement(self, candidates: int, stars: int) -> int:
+        # A region whose candidates all lie in one line takes that line's star, and the other
+        # way around: a line whose candidates all lie in one region takes that region's star
+        for lines in (self.rows, self.cols):
+            open_lines = self._open(lines, candidates, stars)
+            for avail in self._open(self.regions, candidates, stars):
+                for line in open_lines:
+                    if not avail & ~line:
+                        candidates &= ~(line & ~avail)
+                    elif not line & ~avail:
+                        candidates &= ~(self._region_of[line.bit_length() - 1] & ~line)
+        return candidates
+
+    def _blocking(self, candidates: int, stars: int) -> int:
+        # A star on a cell that would leave a unit without candidates is impossible.
+        # The cells doing so to a unit are those that see every one of its candidates.
+        for unit in self.units:
+            if unit & stars:
+                continue
+            avail = unit & candidates
+            seeing = candidates & ~unit
+            while avail and seeing:
+                low = avail & -avail
+                seeing &= self._cover[low.bit_length() - 1]
+                avail ^= low
+            candidates &= ~seeing
+        return candidates
+
+    def _pigeonhole(self, candidates: int, stars: int) -> int:
+        # k regions confined to k lines take all the stars of those lines, and k lines
+        # confined to k regions take all the stars of those regions
+        open_regions = self._open(self.regions, candidates, stars)
+        for lines in (self.rows, self.cols):
+            open_lines = self._open(lines, candidates, stars)
+            for groups, others in ((open_regions, open_lines), (open_lines, open_regions)):
+                # Which of the other units each group touches, as a bitmask over `others`
+                spans = [sum(1 << j for j, other in enumerate(others) if group & other) for group in groups]
+                for k in range(2, len(groups) // 2 + 1):
+                    members = [i for i, span in enumerate(spans) if span.bit_count() <= k]
+                    for combination in itertools.combinations(members, k):
+                        span = 0
+                        for i in combination:
+                            span |= spans[i]
+                        if span.bit_count() != k:
+                            continue
+                        inside = sum(groups[i] for i in combination)
+                        outside = sum(others[j] for j in range(len(others)) if span >> j & 1) & ~inside
+                        if outside:
+                            return candidates & ~outside
+        return candidates
+
+    def solve(self, limit: Optional[int] = None, trace: Optional[Dict[str, int]] = None) -> List[int]:
+        """
+        Returns the star layouts as cell bitmasks, stopping after `limit` layouts.
+        Every rule that made progress is counted in `trace`.
+        """
+        trace = trace if trace is not None else dict.fromkeys(RULES, 0)
+        found: List[int] = []
+
+        def search(candidates: int, stars: int):
+            try:
+                candidates, stars = self.propagate(candidates, stars, trace)
+            except Contradiction:
+                return
+            open_units = self._open(self.units, candidates, stars)
+            if not open_units:
+                found.append(stars)
+                return
+
+            # Guess in the unit with the fewest candidates
+            avail = min(open_units, key=int.bit_count)
+            trace['guess'] += 1
+            while avail:
+                low = avail & -avail
+                search(*self.place(candidates, stars, low, trace))
+                if limit is not None and len(found) >= limit:
+                    return
+                candidates &= ~low
+                avail ^= low
+
+        if limit is None or limit > 0:
+            search((1 << (self.width * self.height)) - 1, 0)
+        return found
+
+
+def find_solutions(width: int, height: int, regions: Sequence[int], limit: Optional[int] = None, trace: Optional[Dict[str, int]] = None) -> List[int]:
+    return Deducer(width, height, regions).solve(limit=limit, trace=trace)
+
+
+def grade(width: int, height: int, regions: Sequence[int]) -> Grade:
+    """
+    Solves the grid far enough to know whether it is unique and records the rules it took.
+    """
+    trace = dict.fromkeys(RULES, 0)
+    solutions = find_solutions(width, height, regions, limit=2, trace=trace)
+    return Grade(len(solutions), trace)
@@ -1,8 +1,63 @@
+from datetime import date
+
+from fastapi.concurrency import run_in_threadpool
+
+from game.catalog import PuzzleCatalog
+from game.generation_executor import GenerationExecutor
 from game.grid import Grid
+from game.puzzle_pool import PuzzlePool, generate_unique_grid
+from game.puzzles import Puzzle, PuzzleCache, daily_seed, materialize
 
 class GameService():
 
-    def create_game(self) -> Grid:
-        from game.generator import Generator
-        generator = Generator(size=10)  # Assuming a default size of 10x10
-        return generator.grid
\ No newline at end of file
+    def __init__(self, puzzle_pool: PuzzlePool = None, executor: GenerationExecutor = None, catalog: PuzzleCatalog = None, puzzle_cache: PuzzleCache = None):
+        self.puzzle_pool = puzzle_pool
+        self.executor = executor
+        self.catalog = catalog
+        self.puzzle_cache = puzzle_cache
+
+    async def create_game_async(self, size: int = 10, timeout: float = None, difficulty: int = None, stars_per_unit: int = 1) -> Grid:
+        """
+        Takes a grid from the catalog or the pool, falling back to a generation in the executor's worker processes.
+        The pool does not sort its grids by difficulty, a requested difficulty skips it.
+        The catalog and the pool only hold grids with one star per unit.
+        """
+        if stars_per_unit == 1 and self.catalog is not None and self.catalog.has(size, difficulty):
+            return self.catalog.get(size, difficulty)
+        if self.puzzle_pool is not None and difficulty is None and stars_per_unit == 1:
+            grid = self.puzzle_pool.take(size)
+            if grid is not None:
+                return grid
+        if self.executor is not None:
+            return await self.executor.generate(size, timeout=timeout, difficulty=difficulty, stars_per_unit=stars_per_unit)
+        return await run_in_threadpool(generate_unique_grid, size, difficulty=difficulty, stars_per_unit=stars_per_unit)
+
+    async def get_puzzle_async(self, puzzle: Puzzle) -> Grid:
+        """
+        The grid of a shared puzzle id, from the cache or generated again in the executor's worker processes.
+        Raises ValueError for invalid puzzles and for puzzles that cannot be generated in time.
+        """
+        if self.puzzle_cache is not None:
+            return await self.puzzle_cache.get_async(puzzle)
+        if self.executor is not None:
+            return await self.executor.materialize(puzzle)
+        return await run_in_threadpool(materialize, puzzle)
+
+    async def daily_game_async(self, day: date, size: int = 10, stars_per_unit: int = 1, timeout: float = None) -> Grid:
+        """
+        The daily challenge: the first unique grid generated from the seed of the day, the same on every server.
+        """
+        puzzle = self.puzzle_cache.daily(day, size, stars_per_unit) if self.puzzle_cache is not None else None
+        if puzzle is not None:
+            return await self.get_puzzle_async(puzzle)
+        seed = daily_seed(day, size, stars_per_unit)
+        if self.executor is not None:
+            grid = await self.executor.generate(size, timeout=timeout, stars_per_unit=stars_per_unit, seed=seed)
+        else:
+            grid = await run_in_threadpool(generate_unique_grid, size, stars_per_unit=stars_per_unit, seed=seed)
+        puzzle = Puzzle.of(grid)
+        # A grid kept at the deadline has no seed, it is served but not remembered as the daily puzzle
+        if self.puzzle_cache is not None and puzzle is not None:
+            self.puzzle_cache.put(puzzle, grid)
+            self.puzzle_cache.set_daily(day, puzzle)
+        return grid
@@ -1,28 +1,277 @@
-from typing import Dict
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple, Union
 
+import base64
+import binascii
+import hashlib
+import hmac
+import itertools
 import json
+import secrets
+import sys
+import time
+from game.connection import Connection
 from game.grid import Grid
+from game.player_board import CONTENT_CODES, PlayerBoard
+from game.move_log import MoveLog
+from game.puzzles import Puzzle, PuzzleCache
+from game.session_backend import SessionBackend
 from fastapi import WebSocket
-from model.game_session_model import GameSessionModel
-from model.grid_model import GridCellContent, GridCellModel, GridModel
+from fastapi.concurrency import run_in_threadpool
+from model.game_session_model import CompactGameSessionModel, GameSessionModel, PackedGameSessionModel
+from model.grid_model import GridCellContent, GridFormat, GridUpdateCellPayload, grid_update_adapter
+from pydantic import ValidationError
+
+# Connections a session accepts: the players, plus room for reconnections racing their dead sockets
+MAX_CONNECTIONS = 8
+# Seconds the board of a disconnected player is kept for them to reconnect
+RECONNECT_TTL = 120.0
+
+
+def new_token() -> str:
+    """
+    Secret a player proves their player id with, player ids themselves are shown to the other players.
+    """
+    return secrets.token_urlsafe(16)
+
+
+def hash_token(token: str) -> str:
+    # Sessions, the backend and the move log only keep hashes of the tokens
+    return hashlib.sha256(token.encode()).hexdigest()
+
 
 class GameSession:
-    def __init__(self, game_id: str, grid: Grid):
+    """
+    A game between the players connected to it.
+
+    With a `puzzle_cache`, a generated grid is only referenced by its puzzle (see game.puzzles): the
+    session holds the grid while players are connected and reads it from the cache otherwise, so idle
+    sessions cost a few bytes and their grid is generated again if the cache dropped it.
+
+    A player who drops keeps their board for `reconnect_ttl` seconds, connecting again with their
+    player id and the secret token they got when joining gives it back.
+
+    With a shared `backend` the players may be connected to different workers: the events sent to the
+    other players are published to the backend, and the winner is claimed there.
+
+    With a `move_log` every action received is logged, the session can be rebuilt from it with `replay`.
+    """
+    def __init__(self, game_id: str, grid: Grid, puzzle_cache: Optional[PuzzleCache] = None, max_connections: int = MAX_CONNECTIONS, reconnect_ttl: float = RECONNECT_TTL, backend: Optional[SessionBackend] = None, move_log: Optional[MoveLog] = None):
         self.game_id = game_id
-        self.grid = grid
-        self.connections: list[WebSocket] = []
+        self.backend = backend
+        self.move_log = move_log
+        self.max_connections = max_connections
+        self.reconnect_ttl = reconnect_ttl
+        self.puzzle: Optional[Puzzle] = None
+        self.puzzle_cache: Optional[PuzzleCache] = None
+        self._grid: Optional[Grid] = grid
+        # Fingerprint of the solution: a player's star bitmask must be this one to win
+        self.solution_stars = grid.board.stars
+        self.connections: Dict[WebSocket, Connection] = {}
+        # Boards of the players who dropped, by player id, with the time.monotonic() they left at
+        self._departed: "OrderedDict[str, Tuple[PlayerBoard, float]]" = OrderedDict()
+        # Hash of the token of every player id, connected, departed or reserved
+        self._tokens: Dict[str, str] = {}
+        # Player ids handed out by the matchmaking, and the time.time() the game starts at
+        self._reserved: Set[str] = set()
+        self.starts_at: Optional[float] = None
+        self.winner: Optional[str] = None
+        self.last_active = time.monotonic()
+        if puzzle_cache is not None:
+            self.cache_grid(puzzle_cache)
+
+    def cache_grid(self, puzzle_cache: PuzzleCache):
+        """
+        Hands the grid over to `puzzle_cache`, the session only holds it while players are connected.
+        Grids without a puzzle id stay on the session.
+        """
+        self.puzzle = Puzzle.of(self._grid)
+        self.puzzle_cache = puzzle_cache
+        if self.puzzle is not None:
+            puzzle_cache.put(self.puzzle, self._grid)
+            self._release()
+
+    @property
+    def grid(self) -> Grid:
+        if self._grid is not None:
+            return self._grid
+        return self.puzzle_cache.get(self.puzzle)
+
+    @property
+    def puzzle_id(self) -> Optional[str]:
+        return self.puzzle.id if self.puzzle is not None else None
+
+    async def load(self):
+        """
+        Makes sure the grid is at hand before a player connects, generating it again if needed (see PuzzleCache.get_async).
+        Raises ValueError when the grid cannot be generated in time.
+        """
+        if self._grid is None:
+            self._grid = await self.puzzle_cache.get_async(self.puzzle)
+
+    def _release(self):
+        # Nobody plays anymore, the cache alone keeps the grid
+        if self.puzzle is not None and not self.connections:
+            self._grid = None
 
-    def to_dto(self) -> GameSessionModel:
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def memory_estimate(self) -> int:
+        """
+        Rough size in bytes of the session's grid, when it holds one, and player boards.
+        """
+        size = 0
+        if self._grid is not None:
+            board = self._grid.board
+            size += sys.getsizeof(board.regions) + sys.getsizeof(board.stars) + sum(sys.getsizeof(color) for color in board.palette)
+        players = [connection.player for connection in self.connections.values()] + [player for player, _ in self._departed.values()]
+        for player in players:
+            size += sys.getsizeof(player.contents) + sys.getsizeof(player.region_stars) + sys.getsizeof(player.row_stars) + sys.getsizeof(player.col_stars)
+        return size
+
+    def to_dto(self, format: GridFormat = GridFormat.VERBOSE) -> Union[GameSessionModel, CompactGameSessionModel, PackedGameSessionModel]:
+        grid = self.grid
+        if format == GridFormat.COMPACT:
+            return CompactGameSessionModel(game_id=self.game_id, grid=grid.to_compact_dto(), difficulty=grid.difficulty, stars_per_unit=grid.stars_per_unit, puzzle_id=self.puzzle_id)
+        if format == GridFormat.PACKED:
+            return PackedGameSessionModel(game_id=self.game_id, grid=grid.to_packed_dto(), difficulty=grid.difficulty, stars_per_unit=grid.stars_per_unit, puzzle_id=self.puzzle_id)
         return GameSessionModel(
             game_id=self.game_id,
-            grid=self.grid.to_dto()
+            grid=grid.to_dto(),
+            difficulty=grid.difficulty,
+            stars_per_unit=grid.stars_per_unit,
+            puzzle_id=self.puzzle_id
         )
 
-    def connect(self, websocket: WebSocket):
-        self.connections.append(websocket)
+    def reserve(self, tokens: Dict[str, str], starts_at: Optional[float] = None):
+        """
+        Lets players join with ids given to them beforehand, `tokens` maps them to the hash of their token.
+        Their moves are held until `starts_at`.
+        """
+        self._tokens.update(tokens)
+        self._reserved.update(tokens)
+        self.starts_at = starts_at
+        if self.move_log is not None:
+            self.move_log.append(self.game_id, None, {'action': 'reserved', 'tokens': dict(tokens), 'starts_at': starts_at})
+
+    @property
+    def reserved(self) -> Dict[str, str]:
+        """
+        The reserved player ids nobody joined with yet, with the hashes of their tokens.
+        """
+        return {player_id: self._tokens[player_id] for player_id in self._reserved}
+
+    def connect(self, websocket: WebSocket, format: GridFormat = GridFormat.VERBOSE, player_id: Optional[str] = None, token: Optional[str] = None) -> Optional[Connection]:
+        """
+        Adds a player, or gives a returning `player_id` its board back when `token` is theirs. A player id
+        still connected is taken over, its old socket is most likely dead. Reserved ids are kept, any other
+        id, or an id without its token, joins as a new player with a new id.
+        Returns None when the session already has `max_connections` connections.
+        """
+        self._prune_departed()
+        if player_id is not None and not self._owns(player_id, token):
+            player_id = None
+        player: Optional[PlayerBoard] = None
+        if player_id is not None:
+            stale = next((connection for connection in self.connections.values() if connection.player_id == player_id), None)
+            if stale is not None:
+                del self.connections[stale.websocket]
+                stale.close(code=1001, reason="Reconnected")
+                player = stale.player
+            elif player_id in self._departed:
+                player, _ = self._departed.pop(player_id)
+        if player is None:
+            if len(self.connections) >= self.max_connections:
+                return None
+            if player_id not in self._reserved:
+                player_id = None
+            self._reserved.discard(player_id)
+
+        self._grid = self.grid
+        connection = Connection(websocket, player if player is not None else PlayerBoard(self._grid), format, player_id=player_id)
+        self.connections[websocket] = connection
+        self.touch()
+        if player_id is None:
+            token = new_token()
+            self._tokens[connection.player_id] = hash_token(token)
+            if self.move_log is not None:
+                self.move_log.append(self.game_id, connection.player_id, {'action': 'connected', 'token': self._tokens[connection.player_id]})
+
+        message = {
+            'game_id': self.game_id,
+            'action': 'connected',
+            'player_id': connection.player_id,
+            # Only ever sent to its owner
+            'token': token,
+            'resumed': player is not None,
+        }
+        if self.starts_at is not None:
+            message['starts_at'] = self.starts_at
+        if player is not None:
+            # Content codes row by row, as in a compact update_grid
+            message['contents'] = base64.b64encode(player.contents).decode()
+        connection.send(message, critical=True)
+        return connection
+
+    def _owns(self, player_id: str, token: Optional[str]) -> bool:
+        known = self._tokens.get(player_id)
+        return known is not None and token is not None and hmac.compare_digest(known, hash_token(token))
 
-    def disconnect(self, websocket: WebSocket):
-        self.connections.remove(websocket)
+    def disconnect(self, websocket: WebSocket, keep: bool = True):
+        """
+        Removes a connection. Unless the game is over or `keep` is False, the player's board is kept for a reconnection.
+        """
+        connection = self.connections.pop(websocket, None)
+        if connection is not None:
+            connection.close()
+            if keep and self.winner is None:
+                self._departed[connection.player_id] = (connection.player, time.monotonic())
+                self._prune_departed()
+            else:
+                self._tokens.pop(connection.player_id, None)
+        self._release()
+
+    def _prune_departed(self):
+        # Oldest first, the boards kept are bounded in time and in number
+        now = time.monotonic()
+        while self._departed:
+            player_id, (_, left_at) = next(iter(self._departed.items()))
+            if now - left_at <= self.reconnect_ttl and len(self._departed) <= self.max_connections:
+                break
+            del self._departed[player_id]
+            self._tokens.pop(player_id, None)
+
+    def close(self, code: int = 1000, reason: str = None):
+        """
+        Closes every connection of the session.
+        """
+        for connection in self.connections.values():
+            connection.close(code=code, reason=reason)
+        self.connections.clear()
+        self._departed.clear()
+        self._tokens.clear()
+        self._release()
+
+    def broadcast(self, message: Dict, exclude: Connection = None, coalesce_key: str = None, critical: bool = False, publish: bool = True):
+        """
+        Queues a message for every connection but `exclude`, without waiting for any of them.
+        The message is also published to the connections on the other workers unless `publish` is False.
+        """
+        for connection in list(self.connections.values()):
+            if connection is not exclude:
+                connection.send(message, coalesce_key=coalesce_key, critical=critical)
+        if publish and self.backend is not None:
+            self.backend.publish(self.game_id, {'message': message, 'coalesce_key': coalesce_key, 'critical': critical}, coalesce_key)
+
+    def deliver(self, event: Dict):
+        """
+        Relays an event published by another worker's copy of the session to the connections of this one.
+        """
+        message = event['message']
+        if message.get('action') == 'game_over' and self.winner is None:
+            self.winner = message.get('winner')
+        self.broadcast(message, coalesce_key=event.get('coalesce_key'), critical=event.get('critical', False), publish=False)
 
     async def handle_message(self, websocket: WebSocket, data: Dict):
         # Handle incoming messages from the client
@@ -30,38 +279,163 @@ class GameSession:
         if 'action' not in data:
             await websocket.close(code=1008, reason="Invalid message format")
             return
-        
+
+        connection = self.connections.get(websocket)
+        if connection is None:
+            # Disconnected or evicted while the message was in flight
+            return
+
+        self.touch()
+        connection.seen()
         action = data['action']
         game_id = data.get('game_id', self.game_id)
+        player = connection.player
+
+        if action == 'pong':
+            # Heartbeat answer, receiving it is all that matters
+            return
+
+        if action in ('move', 'update_grid') and self.starts_at is not None and time.time() < self.starts_at:
+            # Matched players start together, earlier moves are dropped
+            return
+
+        if self.move_log is not None and action != 'ping':
+            self.move_log.append(self.game_id, connection.player_id, data)
+
+        if action == 'ping':
+            connection.send({'game_id': game_id, 'action': 'pong'}, coalesce_key='pong')
+
+        elif action == 'move':
+            # Single cell update: {"action": "move", "x": 0, "y": 0, "content": "star"}
+            try:
+                player.set(int(data['x']), int(data['y']), GridCellContent(data['content']))
+            except (KeyError, TypeError, ValueError):
+                await websocket.close(code=1008, reason="Invalid move")
+                return
+
+            await self._report_progress(connection, game_id, player.is_solved())
+
+        elif action == 'get_grid':
+            # Sends the puzzle in the format negotiated when connecting
+            connection.send({
+                'game_id': game_id,
+                'action': 'grid',
+                'grid': self.to_dto(connection.format).grid.model_dump(mode='json')
+            })
+
+        elif action == 'update_grid':
+            # Full grid resync, replaces the player's board
 
-        if action == 'update_grid':
-            
             if 'grid' not in data:
                 await websocket.close(code=1008, reason="Grid data not provided")
                 return
-            
+
             grid_data = data['grid']
-            
-            grid_model = GridModel(
-                width=grid_data['width'],
-                height=grid_data['height'],
-                cells=[
-                    [GridCellModel(
-                        content=GridCellContent(cell['content']),
-                        region_color=cell['regionColor'],
-                        x=cell['x'],
-                        y=cell['y']
-                    ) for cell in row] for row in grid_data['cells']
-                ]
-            )
-            is_over = self.grid.check_game_over(grid_model=grid_model)
-            if is_over:
-                await websocket.send_json({
-                    'game_id': game_id,
-                    'action': 'game_over',
-                    'message': 'Game over! You won!'
-                })
+
+            if 'contents' in grid_data:
+                # Compact resync: content codes row by row (0 empty, 1 star, 2 cross),
+                # as a list or as base64 encoded bytes
+                try:
+                    contents = grid_data['contents']
+                    contents = base64.b64decode(contents, validate=True) if isinstance(contents, str) else bytes(contents)
+                    player.load_contents(contents)
+                except (TypeError, ValueError, IndexError, binascii.Error):
+                    await websocket.close(code=1008, reason="Invalid grid contents")
+                    return
+                await self._report_progress(connection, game_id, player.is_solved())
                 return
 
+            # Verbose resync: the cells are reduced to content codes, the star bitmask they give is compared
+            # with the solution and the region colors are only checked when it matches
+            try:
+                grid_data = grid_update_adapter.validate_python(grid_data)
+            except ValidationError:
+                await websocket.close(code=1008, reason="Invalid grid")
+                return
+            if grid_data['width'] != self.grid.width or grid_data['height'] != self.grid.height:
+                await self._report_progress(connection, game_id, False)
+                return
+            cells = grid_data['cells']
+            if len(cells) != self.grid.height or any(len(row) != self.grid.width for row in cells):
+                await websocket.close(code=1008, reason="Invalid grid")
+                return
+
+            player.load_contents(bytes(CONTENT_CODES[cell['content']] for row in cells for cell in row))
+            is_over = player.stars == self.solution_stars and self._colors_match(cells)
+            await self._report_progress(connection, game_id, is_over)
+
         elif action == 'end_game':
-            self.disconnect(websocket)
\ No newline at end of file
+            self.disconnect(websocket, keep=False)
+
+    def replay(self, player_id: str, data: Dict):
+        """
+        Applies a logged action to the board of a player, kept as if they had just dropped so that they
+        can reconnect to it with their token. Invalid actions are skipped, they did not change the board
+        when received either.
+        """
+        action = data.get('action')
+        if action == 'connected':
+            self._tokens[player_id] = data['token']
+            return
+        if action == 'end_game':
+            self._departed.pop(player_id, None)
+            self._tokens.pop(player_id, None)
+            return
+        if action not in ('move', 'update_grid'):
+            return
+        if player_id in self._departed:
+            player, _ = self._departed[player_id]
+        else:
+            player = PlayerBoard(self.grid)
+        self._departed[player_id] = (player, time.monotonic())
+
+        try:
+            if action == 'move':
+                player.set(int(data['x']), int(data['y']), GridCellContent(data['content']))
+            elif 'contents' in data['grid']:
+                contents = data['grid']['contents']
+                player.load_contents(base64.b64decode(contents, validate=True) if isinstance(contents, str) else bytes(contents))
+            else:
+                grid_data = grid_update_adapter.validate_python(data['grid'])
+                cells = grid_data['cells']
+                if (grid_data['width'], grid_data['height'], len(cells)) == (self.grid.width, self.grid.height, self.grid.height) and all(len(row) == self.grid.width for row in cells):
+                    player.load_contents(bytes(CONTENT_CODES[cell['content']] for row in cells for cell in row))
+        except (KeyError, TypeError, ValueError, IndexError, binascii.Error, ValidationError):
+            pass
+
+    def _colors_match(self, cells: List[List[GridUpdateCellPayload]]) -> bool:
+        board = self.grid.board
+        colors = (board.palette[region] for region in board.regions)
+        return all(cell['regionColor'] == color for cell, color in zip(itertools.chain.from_iterable(cells), colors))
+
+    async def _report_progress(self, connection: Connection, game_id: str, is_over: bool):
+        # Only the latest progress of a player matters, pending updates are coalesced
+        self.broadcast({
+            'game_id': game_id,
+            'action': 'opponent_progress',
+            'player_id': connection.player_id,
+            'stars': connection.player.star_count
+        }, exclude=connection, coalesce_key=f"progress:{connection.player_id}")
+
+        if not is_over or self.winner is not None:
+            return
+        if self.backend is not None and self.backend.shared:
+            # The claim goes through the database, in a thread to keep the event loop going
+            if not await run_in_threadpool(self.backend.claim_win, self.game_id, connection.player_id):
+                # Won first on another worker, its game_over event is on its way
+                return
+
+        self.winner = connection.player_id
+        if self.move_log is not None:
+            self.move_log.append(self.game_id, connection.player_id, {'action': 'won'})
+        connection.send({
+            'game_id': game_id,
+            'action': 'game_over',
+            'message': 'Game over! You won!'
+        }, critical=True)
+        self.broadcast({
+            'game_id': game_id,
+            'action': 'game_over',
+            'winner': connection.player_id,
+            'message': 'Game over! Your opponent won!'
+        }, exclude=connection, critical=True)
@@ -0,0 +1,166 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from game import metrics
+from game.grid import Grid
+from game.puzzle_pool import GenerationTimeout, generate_unique_grid
+from game.puzzles import Puzzle, materialize
+
+
+def _generate_compact(size: int, deadline: float, difficulty: Optional[int] = None, stars_per_unit: int = 1, seed: Optional[int] = None) -> Tuple[Tuple[int, int, Tuple[str, ...], bytes, int, int], Optional[int], Optional[int], Dict[str, float]]:
+    # Metrics recorded in the worker process are lost, the stats travel back with the grid
+    stats: Dict[str, float] = {}
+    grid = generate_unique_grid(size, deadline=deadline, stats=stats, difficulty=difficulty, stars_per_unit=stars_per_unit, seed=seed)
+    return grid.to_compact(), grid.difficulty, grid.seed, stats
+
+
+def _materialize_compact(puzzle: Puzzle, deadline: float) -> Tuple[Tuple[int, int, Tuple[str, ...], bytes, int, int], Optional[int], Optional[int]]:
+    grid = materialize(puzzle, deadline)
+    return grid.to_compact(), grid.difficulty, grid.seed
+
+
+def _from_result(compact: Tuple[int, int, Tuple[str, ...], bytes, int, int], difficulty: Optional[int], seed: Optional[int]) -> Grid:
+    grid = Grid.from_compact(compact)
+    grid.difficulty = difficulty
+    grid.seed = seed
+    return grid
+
+
+class GenerationExecutor():
+    """
+    Runs grid generations in worker processes so that they run in parallel and never hold the server's GIL.
+
+    Every job gets a deadline that the generator checks cooperatively. A job still running `grace`
+    seconds after its deadline is considered stuck: the worker processes are killed and replaced, and
+    the jobs that were running or queued next to it are submitted again to the new workers.
+    """
+    timeout: float
+    grace: float
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: float = 10.0, grace: float = 2.0):
+        self.timeout = timeout
+        self.grace = grace
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # spawn: forking a server that runs threads can deadlock the children
+        return ProcessPoolExecutor(max_workers=self._max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, size: int, timeout: Optional[float] = None, difficulty: Optional[int] = None, stars_per_unit: int = 1, seed: Optional[int] = None) -> Future:
+        """
+        Schedules a generation, the future resolves to the compact form of the grid (see Grid.to_compact),
+        its difficulty, its seed and the generation stats.
+        """
+        deadline = time.time() + (timeout if timeout is not None else self.timeout)
+        return self._submit(_generate_compact, size, deadline, difficulty, stars_per_unit, seed)
+
+    def _submit(self, job: Callable, *args: Any) -> Future:
+        with self._lock:
+            try:
+                return self._executor.submit(job, *args)
+            except BrokenProcessPool:
+                # A worker died (killed, out of memory...), start over with fresh processes
+                self._executor = self._new_executor()
+                return self._executor.submit(job, *args)
+
+    def generate_sync(self, size: int, timeout: Optional[float] = None, difficulty: Optional[int] = None, stars_per_unit: int = 1, seed: Optional[int] = None) -> Grid:
+        """
+        Blocking variant of `generate`, for threads such as the puzzle pool workers.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        deadline = time.time() + timeout
+        future = self.submit(size, timeout, difficulty, stars_per_unit, seed)
+        try:
+            try:
+                compact, grid_difficulty, grid_seed, stats = future.result(timeout=timeout + self.grace)
+            except BrokenProcessPool:
+                future = self.submit(size, self._remaining(deadline), difficulty, stars_per_unit, seed)
+                compact, grid_difficulty, grid_seed, stats = future.result(timeout=self._remaining(deadline) + self.grace)
+        except GenerationTimeout as e:
+            metrics.record_timeout(size, e.stats, stars_per_unit)
+            raise
+        except TimeoutError:
+            self._abandon(future)
+            metrics.generations.inc(str(size), str(stars_per_unit), "timeout")
+            raise
+        metrics.record_generation(size, stats['seconds'], stats, stars_per_unit)
+        return _from_result(compact, grid_difficulty, grid_seed)
+
+    async def generate(self, size: int, timeout: Optional[float] = None, difficulty: Optional[int] = None, stars_per_unit: int = 1, seed: Optional[int] = None) -> Grid:
+        """
+        Generates a grid in a worker process. Cancelling the awaiting task cancels the job if it has not started,
+        a running job stops at its deadline at the latest. A `seed` makes the generation deterministic.
+
+        A job whose worker processes were replaced, because another job got stuck or a worker died, runs
+        once more on the new workers within the same deadline. BrokenProcessPool is raised if that fails too.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            compact, grid_difficulty, grid_seed, stats = await self._run(lambda remaining: self.submit(size, remaining, difficulty, stars_per_unit, seed), timeout)
+        except GenerationTimeout as e:
+            # No grid by the deadline, the worker's stats come with the error
+            metrics.record_timeout(size, e.stats, stars_per_unit)
+            raise
+        except TimeoutError:
+            metrics.generations.inc(str(size), str(stars_per_unit), "timeout")
+            raise TimeoutError("Grid generation deadline exceeded")
+        metrics.record_generation(size, stats['seconds'], stats, stars_per_unit)
+        return _from_result(compact, grid_difficulty, grid_seed)
+
+    async def materialize(self, puzzle: Puzzle, timeout: Optional[float] = None) -> Grid:
+        """
+        Generates the grid of a puzzle id again (see game.puzzles.materialize) in a worker process.
+        Raises ValueError for invalid ids, and for ids whose grid is not generated within `timeout`.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            compact, difficulty, seed = await self._run(lambda remaining: self._submit(_materialize_compact, puzzle, time.time() + remaining), timeout)
+        except TimeoutError:
+            raise ValueError(f"Puzzle {puzzle.id} cannot be generated in time")
+        return _from_result(compact, difficulty, seed)
+
+    async def _run(self, submit: Callable[[float], Future], timeout: float) -> Any:
+        # `submit` schedules the job with the seconds left before its deadline. A job broken by the
+        # replacement of the workers runs once more, a job stuck past its grace period is abandoned.
+        deadline = time.time() + timeout
+        future = submit(timeout)
+        try:
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout + self.grace)
+            except BrokenProcessPool:
+                future = submit(self._remaining(deadline))
+                return await asyncio.wait_for(asyncio.wrap_future(future), self._remaining(deadline) + self.grace)
+        except GenerationTimeout:
+            raise
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            raise
+
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        # A retry past the deadline still runs, the generator returns its best grid straight away
+        return max(0.0, deadline - time.time())
+
+    def _abandon(self, future: Future):
+        if future.cancel() or future.done():
+            return
+        # The job ignored its deadline, replace the workers rather than letting it hold a process forever.
+        # The other jobs of the old workers fail with BrokenProcessPool rather than being cancelled, and run again.
+        with self._lock:
+            executor = self._executor
+            self._executor = self._new_executor()
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self):
+        with self._lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,17 +1,59 @@
-from game.grid import Grid
+import logging
+import random
+import time
+from typing import Optional
 
+from game.grid import MAX_STALLED_STEPS, Grid, LayoutNotFound
 
-class Generator():
-
-    def __init__(self, size: int):
-        self.grid = self._generate_grid(size, size)
-
-    def _generate_grid(self, width: int, height: int):
+logger = logging.getLogger(__name__)
 
-        grid = Grid(width=width, height=height)
 
-        grid.new_generate()
-
-        print(f"Count solutions: {Grid().count_solutions(grid.cells)}")
-
-        return grid
\ No newline at end of file
+class Generator():
+    """
+    Time-budgeted generation. Every attempt draws a new star layout from its own seed and grows its regions,
+    an attempt whose growth stalls (see Grid.new_generate) is dropped for a new layout.
+
+    The grid is a valid unique puzzle at every growth step, so once `deadline` (a time.time() timestamp)
+    passes the best attempt so far, the one with the smallest base region, is kept rather than nothing.
+    `complete` tells whether the grid reached its target. A grid kept at the deadline has no seed: its
+    seed would grow it further, it cannot be generated again.
+    TimeoutError is only raised when the deadline passes before any layout could be placed.
+    """
+    grid: Grid
+    complete: bool
+    attempts: int
+
+    def __init__(self, size: int, deadline: Optional[float] = None, stars_per_unit: int = 1, seed: Optional[int] = None, max_stalled_steps: int = MAX_STALLED_STEPS):
+        self.attempts = 0
+        self.grid, self.complete = self._generate_grid(size, size, deadline, stars_per_unit, seed, max_stalled_steps)
+
+    def _generate_grid(self, width: int, height: int, deadline: Optional[float], stars_per_unit: int, seed: Optional[int], max_stalled_steps: int):
+        seeds = random.Random(seed)
+        best: Optional[Grid] = None
+        while True:
+            self.attempts += 1
+            grid = Grid(width=width, height=height, stars_per_unit=stars_per_unit, seed=seeds.getrandbits(64))
+            try:
+                complete = grid.new_generate(deadline=deadline, max_stalled_steps=max_stalled_steps)
+            except LayoutNotFound as e:
+                logger.debug("Star layout not found, restarting", extra={'size': width, 'error': str(e)})
+                complete = False
+            else:
+                if complete:
+                    break
+                if best is None or grid.board.count(0) < best.board.count(0):
+                    best = grid
+
+            if deadline is not None and time.time() > deadline:
+                if best is None:
+                    raise TimeoutError("Grid generation deadline exceeded")
+                logger.info("Generation deadline reached, keeping the best grid so far", extra={'size': width, 'attempts': self.attempts, 'base_cells': best.board.count(0)})
+                grid = best
+                grid.seed = None
+                break
+
+        if logger.isEnabledFor(logging.DEBUG):
+            # Only solve again when someone reads the result
+            logger.debug("Grid generated", extra={'size': width, 'complete': complete, 'solutions': Grid().count_solutions(grid.board, limit=2)})
+
+        return grid, complete
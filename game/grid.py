@@ -1,21 +1,59 @@
-from turtle import width
-from typing import List, Tuple
-from model.grid_model import GridCellContent, GridCellModel, GridModel
+from typing import Dict, List, Optional, Tuple
+from game import deduction, solver
+from game.board import NO_REGION, Board
+from game.uniqueness import UniquenessState
+from model.grid_model import CompactGridModel, GridCellModel, GridModel, PackedGridModel
+import base64
+import itertools
+import logging
 import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Search nodes a uniqueness check may take while growing the regions. The few candidates costing
+# more are turned down, which keeps the generation time bounded on large grids with several stars per unit.
+SEARCH_NODE_LIMIT = 1000
+# Growth steps in a row that grow nothing before a star layout is given up for a new one. Grids that
+# get generated see about 10 at most, the layouts going past that rarely reach their target.
+MAX_STALLED_STEPS = 12
+
+
+class LayoutNotFound(Exception):
+    """
+    Raised when the stars of a generation cannot be placed, the generation has to start over with other draws.
+    """
 
 
 class GridCell():
-    is_occupied: bool
-    region_color: str
+    """
+    View over one cell of a Board, reads and writes go straight to the board.
+    """
+    board: Board
     x: int
     y: int
 
-    def __init__(self, x: int, y: int, is_occupied: bool = False, region_color: str = None):
-        self.is_occupied = is_occupied
-        self.region_color = region_color
+    def __init__(self, board: Board, x: int, y: int):
+        self.board = board
         self.x = x
         self.y = y
 
+    @property
+    def is_occupied(self) -> bool:
+        return self.board.is_star(self.x, self.y)
+
+    @is_occupied.setter
+    def is_occupied(self, is_occupied: bool):
+        self.board.set_star(self.x, self.y, is_occupied)
+
+    @property
+    def region_color(self) -> Optional[str]:
+        return self.board.color(self.x, self.y)
+
+    @region_color.setter
+    def region_color(self, region_color: Optional[str]):
+        self.board.set_region(self.x, self.y, self.board.region_id(region_color))
+
     def to_dto(self) -> GridCellModel:
         if self.region_color is None:
             raise ValueError("Region color is not set")
@@ -28,106 +66,285 @@ class GridCell():
 
 class Grid():
     colors: List[str]
-    cells: List[List[GridCell]]
+    board: Board
     width: int
     height: int
     base_colors_min_count: int
+    # Every draw of the generation comes from `random`, seeded with `seed`: the seed, the size and
+    # the stars per unit are enough to build the same grid again (None when the grid was not generated)
+    seed: Optional[int]
+    random: random.Random
+    # Level of the hardest deduction needed to solve the grid (see game.deduction), None until graded
+    difficulty: Optional[int]
     
-    def __init__(self, width: int = 0, height: int = 0):
+    def __init__(self, width: int = 0, height: int = 0, stars_per_unit: int = 1, seed: Optional[int] = None):
         self.width = width
         self.height = height
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.difficulty = None
         self.colors = []
         self.generate_random_colors(nb_colors=min(self.width, self.height))
-        self.init_grid()
+        self.init_grid(stars_per_unit)
 
-    def init_grid(self):
-        self.cells = [[GridCell(x, y, region_color=self.colors[0], is_occupied=False) for x in range(self.width)] for y in range(self.height)]
+    def init_grid(self, stars_per_unit: int = 1):
+        # Every cell starts in the region of the first color (id 0)
+        self.board = Board(self.width, self.height, palette=self.colors, stars_per_unit=stars_per_unit)
 
-    def new_generate(self):
+    @property
+    def stars_per_unit(self) -> int:
+        return self.board.stars_per_unit
 
-        positions = [(x, y) for x in range(self.width) for y in range(self.height)]
-        random.shuffle(positions)
+    @property
+    def cells(self) -> List[List[GridCell]]:
+        return [[GridCell(self.board, x, y) for x in range(self.width)] for y in range(self.height)]
 
-        zones_extremities = []
+    def new_generate(self, deadline: Optional[float] = None, max_stalled_steps: Optional[int] = None) -> bool:
+        """
+        Places the stars then grows their regions until the base region is down to `base_colors_min_count` cells.
+        Every step keeps a unique solution, so the grid is a valid puzzle whenever the growth stops.
 
-        for i in range(self.width):
-            available_y = [y for y in range(self.height) if self.is_valid_star_position(i, y)]
-            y = random.choice(available_y) if available_y else None
-            if y is not None:
-                color = self.colors[(y * self.width + i) % len(self.colors)]
-                self.cells[y][i] = GridCell(i, y, is_occupied=True, region_color=color)
-                if color != self.colors[0]:
+        Returns False if the growth stopped early: no region can grow anymore, `max_stalled_steps` steps in
+        a row grew nothing, or `deadline` (a time.time() timestamp) passed. Raises LayoutNotFound when the
+        stars cannot be placed.
+        """
+        if self.stars_per_unit == 1:
+            zones_extremities = []
+
+            for i in range(self.width):
+                available_y = [y for y in range(self.height) if self.is_valid_star_position(i, y)]
+                if not available_y:
+                    # Every column and every region needs its star, the layout is a dead end
+                    raise LayoutNotFound(f"No valid star position left in column {i}")
+                y = self.random.choice(available_y)
+                # One region per star, the star of column 0 starts in the base region
+                region = i
+                self.board.set_star(i, y)
+                self.board.set_region(i, y, region)
+                if region != 0:
                     zones_extremities.append((y, i))
+        else:
+            zones_extremities = self.place_star_groups()
 
+        self.base_colors_min_count = self.random.randint(1, int(self.width * self.height / 2))
 
-        self.base_colors_min_count = random.randint(1, int(self.width * self.height / 2))
+        logger.debug("Growing regions", extra={'size': self.width, 'base_colors_min_count': self.base_colors_min_count})
 
-        print(f"Base color min count: {self.base_colors_min_count}")
-
-        number_base_color_grid = Grid().get_color_min_count(self.cells, self.colors[0])
+        number_base_color_grid = self.board.count(0)
+        uniqueness = UniquenessState(self.board, max_nodes=SEARCH_NODE_LIMIT)
+        stalled_steps = 0
         while number_base_color_grid > self.base_colors_min_count:
-            cells = self.copy_cells()
+            if deadline is not None and time.time() > deadline:
+                return False
+            if not zones_extremities or (max_stalled_steps is not None and stalled_steps >= max_stalled_steps):
+                logger.debug("Growth stalled", extra={'size': self.width, 'base_cells': number_base_color_grid, 'stalled_steps': stalled_steps})
+                return False
 
-            random.shuffle(zones_extremities)
+            # Process a random extremity
+            index = self.random.randrange(len(zones_extremities))
+            y, x = zones_extremities[index]
+            valid_cells = Grid().get_valid_connected_cells(self.board, y, x, 0, uniqueness=uniqueness)
+            if not valid_cells:
+                # Regions only grow, so an extremity without valid cells never gets one back
+                zones_extremities[index] = zones_extremities[-1]
+                zones_extremities.pop()
+                if self._touches_base(y, x):
+                    # Cells were turned down rather than all taken already
+                    stalled_steps += 1
+                continue
 
-            selected_extremity = zones_extremities[0]
+            new_y, new_x = self.random.choice(valid_cells)
+            region = self.board.region(x, y)
 
-            if selected_extremity is None:
-                raise Exception("No more extremities to process, but grid is still not valid")
+            uniqueness.recolor(new_y, new_x, region)
+            self.board.set_region(new_x, new_y, region)
+            zones_extremities.append((new_y, new_x))
+            number_base_color_grid -= 1
+            stalled_steps = 0
+        return True
 
-            # Process the selected extremity
-            y, x = selected_extremity
-            valid_cells = Grid().get_valid_connected_cells(cells, y, x, self.colors[0])
-            if not valid_cells or len(valid_cells) == 0:
-                continue
+    def _touches_base(self, y: int, x: int) -> bool:
+        # Whether a cell has a neighbour in the base region that could still join another region
+        for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+            if 0 <= ny < self.height and 0 <= nx < self.width and self.board.region(nx, ny) == 0 and not self.board.is_star(nx, ny):
+                return True
+        return False
 
-            new_y, new_x = random.choice(valid_cells)
-    
-            cells[new_y][new_x].region_color = cells[y][x].region_color
+    def place_star_groups(self, attempts: int = 20) -> List[Tuple[int, int]]:
+        """
+        Starting point of the generation with several stars per unit. The stars of a random layout are
+        linked `stars_per_unit` at a time through the few cells between them into the cores of the regions,
+        the first core stays in the base region with every other cell. Tight cores leave each region little
+        choice but its own stars, so the layout starts with a unique solution.
+        Returns the core cells outside the base region, as (y, x), for the regions to grow from.
+        """
+        if self.width != self.height:
+            raise ValueError("Several stars per unit need a square grid")
+        full = (1 << (self.width * self.height)) - 1
+        for _ in range(attempts):
+            stars = self._random_star_layout()
+            cores = self._link_stars(stars)
+            if cores is None:
+                continue
+            self.random.shuffle(cores)
+            base = full & ~sum(cores[1:])
+            if not self.board.is_connected(base):
+                continue
 
-            new_colored_cell_valid_connected_cells = Grid().get_valid_connected_cells(cells, new_y, new_x, self.colors[0])
+            self.board.stars = stars
+            self.board.regions = bytearray(self.width * self.height)
+            zones_extremities = []
+            for region, core in enumerate(cores[1:], start=1):
+                while core:
+                    low = core & -core
+                    y, x = divmod(low.bit_length() - 1, self.width)
+                    self.board.set_region(x, y, region)
+                    zones_extremities.append((y, x))
+                    core ^= low
+            if self.count_solutions(self.board, limit=2) == 1:
+                return zones_extremities
+        raise LayoutNotFound(f"No star layout could be split into regions after {attempts} attempts")
+
+    def _random_star_layout(self, attempts: int = 100) -> int:
+        """
+        Random layout with `stars_per_unit` stars per row and column and no two stars touching, built row by row.
+        """
+        size, per_unit = self.width, self.stars_per_unit
+        kill = solver.neighbour_masks(size, size)
+        row_options = [columns for columns in itertools.combinations(range(size), per_unit) if all(b - a > 1 for a, b in zip(columns, columns[1:]))]
+
+        for _ in range(attempts):
+            budget = [size * 50]
+
+            def place(y: int, stars: int, col_counts: List[int]) -> Optional[int]:
+                if y == size:
+                    return stars
+                options = row_options[:]
+                self.random.shuffle(options)
+                for columns in options:
+                    budget[0] -= 1
+                    if budget[0] < 0:
+                        return None
+                    if any(col_counts[x] >= per_unit or stars & kill[y * size + x] for x in columns):
+                        continue
+                    # The columns still short of stars must fit in the rows left
+                    for x in columns:
+                        col_counts[x] += 1
+                    if all(per_unit - count <= size - 1 - y for count in col_counts):
+                        layout = place(y + 1, stars | sum(1 << (y * size + x) for x in columns), col_counts)
+                        if layout is not None:
+                            return layout
+                    for x in columns:
+                        col_counts[x] -= 1
+                return None
+
+            layout = place(0, 0, [0] * size)
+            if layout is not None:
+                return layout
+        raise LayoutNotFound("No star layout found")
+
+    def _link_stars(self, stars: int, budget: int = 10000) -> Optional[List[int]]:
+        """
+        Splits the stars into chains of `stars_per_unit`, two stars of a chain being linked by the cells
+        of an orthogonal path between them. Only close stars are linked and the shortest paths are tried
+        first: a region made of such a tight chain has little room for stars anywhere else.
+        Returns the cell bitmask of every chain, or None if the stars cannot be split.
+        """
+        size, per_unit = self.width, self.stars_per_unit
+        cells = [cell for cell in range(size * size) if stars >> cell & 1]
+        # star -> (other star, cells of a path between them)
+        links: Dict[int, List[Tuple[int, int]]] = {cell: [] for cell in cells}
+        for a, b in itertools.combinations(cells, 2):
+            (ay, ax), (by, bx) = divmod(a, size), divmod(b, size)
+            if max(abs(by - ay), abs(bx - ax)) < 2 or abs(by - ay) + abs(bx - ax) > 4:
+                continue
+            # Along the row first then the column, or the other way around
+            for cy, cx in {(ay, bx), (by, ax)}:
+                path = self._segment(ay, ax, cy, cx) | self._segment(cy, cx, by, bx)
+                path &= ~(1 << a | 1 << b)
+                if path and not path & stars:
+                    links[a].append((b, path))
+                    links[b].append((a, path))
+
+        free = set(cells)
+        used = [0]
+        chains: List[int] = []
+        steps = [budget]
+
+        def extend(ends: Tuple[int, int], length: int, chain: int) -> bool:
+            if length == per_unit:
+                chains.append(chain)
+                if split():
+                    return True
+                chains.pop()
+                return False
+            options = [(end, other, path) for end in set(ends) for other, path in links[end] if other in free and not path & used[0]]
+            # Shortest paths first, they leave the region the least room
+            self.random.shuffle(options)
+            options.sort(key=lambda option: option[2].bit_count())
+            for end, other, path in options:
+                steps[0] -= 1
+                if steps[0] < 0:
+                    return False
+                free.discard(other)
+                used[0] |= path
+                next_ends = (other, ends[1]) if end == ends[0] else (ends[0], other)
+                if extend(next_ends, length + 1, chain | path | 1 << other):
+                    return True
+                free.add(other)
+                used[0] &= ~path
+            return False
 
-            if new_colored_cell_valid_connected_cells is not None and len(new_colored_cell_valid_connected_cells) > 0:
-                zones_extremities.append((new_y, new_x))
+        def split() -> bool:
+            if not free:
+                return True
+            # The star with the fewest links left first
+            star = min(free, key=lambda cell: (sum(other in free for other, _ in links[cell]), self.random.random()))
+            free.discard(star)
+            if extend((star, star), 1, 1 << star):
+                return True
+            free.add(star)
+            return False
 
-            number_base_color_grid = Grid().get_color_min_count(cells, self.colors[0])
-            valid_cells = Grid().get_valid_connected_cells(cells, y, x, self.colors[0])
+        return chains if split() else None
 
-            extremity_cells_to_remove = []
-            for extremity_cell in zones_extremities:
-                extremity_cell_valid_cells = Grid().get_valid_connected_cells(cells, *extremity_cell, self.colors[0])
-                if len(extremity_cell_valid_cells) == 0:
-                    extremity_cells_to_remove.append(extremity_cell)
-            zones_extremities = [cell for cell in zones_extremities if cell not in extremity_cells_to_remove]
-            self.cells = cells
-        
-        print(f"Count solutions: {Grid().count_solutions(self.cells)}")
-    
+    def _segment(self, y0: int, x0: int, y1: int, x1: int) -> int:
+        # Cells of the rectangle between two cells, a straight segment when they share a line
+        mask = 0
+        for y in range(min(y0, y1), max(y0, y1) + 1):
+            for x in range(min(x0, x1), max(x0, x1) + 1):
+                mask |= 1 << (y * self.width + x)
+        return mask
 
-    def get_valid_connected_cells(cls, cells: List[List[GridCell]], y: int, x: int, base_color: str) -> List[Tuple[int, int]]:
-        if cells[y][x].region_color is None:
+    def get_valid_connected_cells(cls, board: Board, y: int, x: int, base_region: int, uniqueness: UniquenessState = None) -> List[Tuple[int, int]]:
+        """
+        Returns the base region cells next to (x, y) that can join its region while keeping a unique solution
+        and the base region connected.
+        `board` is left untouched, pass the grid's `UniquenessState` to reuse its cached verdicts.
+        """
+        region = board.region(x, y)
+        if region == NO_REGION:
             return []
 
+        if uniqueness is None:
+            uniqueness = UniquenessState(board)
+
         valid_cells = set()
         directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
 
         for dy, dx in directions:
             ny, nx = y + dy, x + dx
-            if 0 <= ny < len(cells) and 0 <= nx < len(cells[0]):
-                if cells[ny][nx].region_color == base_color and not cells[ny][nx].is_occupied:
-                    new_test_cells = cells.copy()
-                    new_test_cells[ny][nx].region_color = cells[y][x].region_color
-                    if Grid().count_solutions(new_test_cells) == 1:
+            if 0 <= ny < board.height and 0 <= nx < board.width:
+                if board.region(nx, ny) == base_region and not board.is_star(nx, ny):
+                    # The base region is a region too, it must stay in one piece
+                    if not board.is_connected(uniqueness.regions[base_region] & ~(1 << (ny * board.width + nx))):
+                        continue
+                    if uniqueness.can_recolor(ny, nx, region):
                         valid_cells.add((ny, nx))
         return list(valid_cells)
 
-    def get_color_min_count(cls, cells: List[List[GridCell]], base_color: str) -> int:
-        count = 0
-        for row in cells:
-            for cell in row:
-                if cell.region_color == base_color:
-                    count += 1
-        return count
+    def get_color_min_count(cls, board: Board, base_region: int) -> int:
+        return board.count(base_region)
 
     def generate(self):
         # Créer une liste de toutes les positions possibles
@@ -135,17 +352,17 @@ class Grid():
         while self.get_star_count() < min(self.width, self.height):
             self.init_grid()
             positions = [(x, y) for x in range(self.width) for y in range(self.height)]
-            random.shuffle(positions)
+            self.random.shuffle(positions)
 
             star_positions = []
 
             first_star = True
-            first_star_color = self.colors[0]
+            first_star_region = 0
 
             for x, y in positions:
                 if self.is_valid_star_position(x, y):
-                    color = self.colors[(y * self.width + x) % len(self.colors)]
-                    self.cells[y][x] = GridCell(x, y, is_occupied=True, region_color=color)
+                    self.board.set_star(x, y)
+                    self.board.set_region(x, y, (y * self.width + x) % len(self.colors))
                     if not first_star:
                         star_positions.append((y, x))
                     else:
@@ -154,65 +371,62 @@ class Grid():
             for star_pos in star_positions:
                 random_range = 0.9
                 current_position = (star_pos[0], star_pos[1])
-                r = random.random()
+                r = self.random.random()
                 while r < random_range:
                     directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-                    random.shuffle(directions)
+                    self.random.shuffle(directions)
                     for direction in directions:
-                        test_grid = self.copy_cells()
+                        test_board = self.copy_board()
                         y, x = current_position[0] - direction[0], current_position[1] - direction[1]
                         if 0 <= y < self.height and 0 <= x < self.width:
-                            if not test_grid[y][x].is_occupied and test_grid[y][x].region_color == first_star_color and test_grid[y][x].region_color != test_grid[current_position[0]][current_position[1]].region_color:
-                                test_grid[y][x].region_color = test_grid[current_position[0]][current_position[1]].region_color
-                                if Grid().check_adjacency(test_grid) and Grid().count_solutions(test_grid) == 1:
-                                    self.cells[y][x].region_color = test_grid[y][x].region_color
+                            current_region = test_board.region(current_position[1], current_position[0])
+                            if not test_board.is_star(x, y) and test_board.region(x, y) == first_star_region and test_board.region(x, y) != current_region:
+                                test_board.set_region(x, y, current_region)
+                                if Grid().check_adjacency(test_board) and Grid().count_solutions(test_board, limit=2) == 1:
+                                    self.board.set_region(x, y, current_region)
                                     current_position = (y, x)
                                     random_range = random_range - 0.05
                                     break
                                 else:
-                                    if self.cells[y][x].region_color == test_grid[y][x].region_color:
-                                        print(f"AYO")
+                                    if self.board.region(x, y) == test_board.region(x, y):
+                                        logger.warning("Rejected cell kept the tested region", extra={'x': x, 'y': y})
                     random_range = random_range - 0.02
 
-        print(f"Count solutions: {Grid().count_solutions(self.cells)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Grid generated", extra={'size': self.width, 'solutions': Grid().count_solutions(self.board, limit=2)})
 
-    def check_adjacency(cls, cells: List[List[GridCell]]) -> bool:
+    def check_adjacency(cls, board: Board) -> bool:
         """
         Check if the grid has valid adjacency colors.
         """
-
-        colors_dict = {}
-
-        for y in range(len(cells)):
-            for x in range(len(cells[y])):
-                neighbor_cells_colors = set()
-                if y-1 >= 0:
-                    neighbor_cells_colors.add(cells[y-1][x].region_color)
-                if y+1  < len(cells):
-                    neighbor_cells_colors.add(cells[y+1][x].region_color)
-                if x-1 >= 0:
-                    neighbor_cells_colors.add(cells[y][x-1].region_color)
-                if x+1 < len(cells[y]):
-                    neighbor_cells_colors.add(cells[y][x+1].region_color)
-                if cells[y][x].region_color not in colors_dict:
-                    colors_dict[cells[y][x].region_color] = {
-                        'count': 1,
-                    }
-                else:
-                    colors_dict[cells[y][x].region_color]['count'] += 1
-                if cells[y][x].region_color not in list(neighbor_cells_colors):
-                    colors_dict[cells[y][x].region_color]['no_neighbor'] = True
-
-        for color, data in colors_dict.items():
-            if data['count'] > 1 and 'no_neighbor' in data:
+        width, height, regions = board.width, board.height, board.regions
+
+        counts = {}
+        no_neighbor = set()
+
+        for y in range(height):
+            for x in range(width):
+                index = y * width + x
+                region = regions[index]
+                counts[region] = counts.get(region, 0) + 1
+                if not (
+                    (y > 0 and regions[index - width] == region)
+                    or (y + 1 < height and regions[index + width] == region)
+                    or (x > 0 and regions[index - 1] == region)
+                    or (x + 1 < width and regions[index + 1] == region)
+                ):
+                    no_neighbor.add(region)
+
+        for region in no_neighbor:
+            if counts[region] > 1:
                 return False
         return True
 
-    def copy_cells(self) -> List[List[GridCell]]:
+    def copy_board(self) -> Board:
         """
-        Returns a deep copy of the cells.
+        Returns a copy of the board, a single buffer copy.
         """
-        return [[GridCell(cell.x, cell.y, cell.is_occupied, cell.region_color) for cell in row] for row in self.cells]
+        return self.board.copy()
         
 
     def generate_random_colors(self, nb_colors: int):
@@ -221,9 +435,9 @@ class Grid():
         # to avoid confusion for players
         self.colors = []
         for _ in range(nb_colors):
-            color = "#{:06x}".format(random.randint(0, 0xFFFFFF))
+            color = "#{:06x}".format(self.random.randint(0, 0xFFFFFF))
             while color in self.colors or self.is_too_similar(color):
-                color = "#{:06x}".format(random.randint(0, 0xFFFFFF))
+                color = "#{:06x}".format(self.random.randint(0, 0xFFFFFF))
             self.colors.append(color)
 
     def is_valid_star_position(self, x: int, y: int) -> bool:
@@ -232,24 +446,8 @@ class Grid():
         # if any(cell.is_occupied for cell in current_color_cells):
         #     return False
 
-        # Check adjacency cells (including diagonals) to ensure no other stars are present
-        for dx in [-1, 0, 1]:
-            for dy in [-1, 0, 1]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < self.width and 0 <= ny < self.height:
-                    if self.cells[ny][nx].is_occupied:
-                        return False
-        
-        # Check row and column for existing stars
-        for i in range(self.width):
-            if self.cells[y][i].is_occupied:
-                return False
-            
-        for i in range(self.height):
-            if self.cells[i][x].is_occupied:
-                return False
-        
-        return True
+        # Check adjacency cells (including diagonals), row and column to ensure no other stars are present
+        return not self.board.stars & solver.blocking_masks(self.width, self.height)[y * self.width + x]
 
 
     def is_too_similar(self, color: str) -> bool:
@@ -274,7 +472,7 @@ class Grid():
                     adgacent_colors = self.get_adgacent_colors(x, y)
                     if len(adgacent_colors) == 0:
                         continue
-                    self.cells[y][x].region_color = random.choice(adgacent_colors)
+                    self.cells[y][x].region_color = self.random.choice(adgacent_colors)
 
     def get_adgacent_colors(self, x: int, y: int) -> List[str]:
         # Get colors of adjacent cells (not diagonals)
@@ -298,88 +496,74 @@ class Grid():
             grid_str += row_str + "\n"
         return grid_str
 
+    def to_compact(self) -> Tuple[int, int, Tuple[str, ...], bytes, int, int]:
+        """
+        Returns a small picklable form of the grid: its size, the palette,
+        the region id bytes, the star bitmask of its board and the stars per unit.
+        """
+        return self.width, self.height, tuple(self.board.palette), bytes(self.board.regions), self.board.stars, self.stars_per_unit
+
+    @classmethod
+    def from_compact(cls, compact: Tuple[int, int, Tuple[str, ...], bytes, int, int]) -> "Grid":
+        width, height, colors, regions, stars, stars_per_unit = compact
+        grid = cls()
+        grid.width = width
+        grid.height = height
+        grid.colors = list(colors)
+        grid.board = Board(width, height, palette=grid.colors, regions=bytearray(regions), stars=stars, stars_per_unit=stars_per_unit)
+        return grid
+
     def to_dto(self) -> GridModel:
+        palette, regions, width = self.board.palette, self.board.regions, self.width
+        if NO_REGION in regions:
+            raise ValueError("Region color is not set")
         return GridModel(
             width=self.width,
             height=self.height,
-            cells=[[cell.to_dto() for cell in row] for row in self.cells]
+            cells=[
+                [GridCellModel(x=x, y=y, region_color=palette[regions[y * width + x]]) for x in range(width)]
+                for y in range(self.height)
+            ]
         )
     
-    def check_game_over(self, grid_model: GridModel) -> bool:
-        if self.height != grid_model.height or self.width != grid_model.width:
-            return False        
-        
-        for y in range(self.height):
-            for x in range(self.width):
-                cell = self.cells[y][x]
-                grid_cell = grid_model.cells[y][x]
-                if (cell.region_color != grid_cell.region_color) or (cell.is_occupied and (grid_cell.content != GridCellContent.STAR)) or (not cell.is_occupied and grid_cell.content == GridCellContent.STAR):
-                    print(f"Game not over: cell mismatch at ({x}, {y}), cell content should be {'star' if cell.is_occupied else 'empty'}, but got {grid_cell.content}")
-                    return False
-        print("Game over: all cells match")
-        return True
+    def to_compact_dto(self) -> CompactGridModel:
+        return CompactGridModel(
+            width=self.width,
+            height=self.height,
+            palette=self.board.palette,
+            regions=list(self.board.regions)
+        )
 
-    def count_solutions(cls, cells: List[List[GridCell]]) -> int:
+    def to_packed_dto(self) -> PackedGridModel:
+        return PackedGridModel(
+            width=self.width,
+            height=self.height,
+            palette=self.board.palette,
+            regions=base64.b64encode(self.board.regions).decode("ascii")
+        )
+
+    def count_solutions(cls, board: Board, limit: int = None) -> int:
         """
         Compte le nombre de solutions valides pour cette grille,
-        en plaçant une étoile par région.
+        en plaçant `board.stars_per_unit` étoiles par région. La recherche s'arrête dès que
+        `limit` solutions ont été trouvées (limit=2 suffit pour tester l'unicité).
         """
-
-        # Obtenir les régions (dictionnaire: couleur -> liste de positions)
-        regions = {}
-        for y in range(len(cells)):
-            for x in range(len(cells[y])):
-                cell = cells[y][x]
-                if cell.region_color not in regions:
-                    regions[cell.region_color] = []
-                regions[cell.region_color].append((x, y))
-
-        # Variables pour le backtracking
-        used_rows = set()
-        used_cols = set()
-        stars = set()  # positions déjà utilisées
-        solutions = [0]  # compteur modifiable dans la fonction récursive
-
-        def is_valid(x, y):
-            # Vérifie l'adjacence
-            for dx in [-1, 0, 1]:
-                for dy in [-1, 0, 1]:
-                    if (x + dx, y + dy) in stars:
-                        return False
-            return True
-
-        def backtrack(region_index=0):
-            if region_index == len(regions):
-                solutions[0] += 1
-                return
-
-            region_colors = list(regions.keys())
-            region = regions[region_colors[region_index]]
-
-            for x, y in region:
-                if y in used_rows or x in used_cols:
-                    continue
-                if not is_valid(x, y):
-                    continue
-
-                # Place une étoile
-                stars.add((x, y))
-                used_rows.add(y)
-                used_cols.add(x)
-
-                backtrack(region_index + 1)
-
-                # Retire l'étoile (backtrack)
-                stars.remove((x, y))
-                used_rows.remove(y)
-                used_cols.remove(x)
-
-        backtrack()
-        return solutions[0]
+        return solver.count_solutions(board.width, board.height, list(board.region_masks().values()), limit=limit, stars_per_unit=board.stars_per_unit)
     
 
+    def grade(self) -> deduction.Grade:
+        """
+        Solves the grid with deductions and stores the resulting difficulty.
+        The deductions only know grids with one star per unit, the others raise ValueError.
+        """
+        if self.stars_per_unit != 1:
+            raise ValueError("Only grids with one star per unit are graded")
+        grade = deduction.grade(self.width, self.height, list(self.board.region_masks().values()))
+        self.difficulty = grade.difficulty
+        return grade
+
     def get_star_count(self) -> int:
         """
         Retourne le nombre d'étoiles dans la grille.
         """
-        return sum(1 for row in self.cells for cell in row if cell.is_occupied)
\ No newline at end of file
+        return self.board.stars.bit_count()
\ No newline at end of file
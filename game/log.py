@@ -0,0 +1,35 @@
+import logging
+from typing import Union
+
+# Attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    Formats records as `key=value` pairs, including the fields given with `extra=`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields.update({key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES})
+        line = " ".join(f"{key}={value!r}" if isinstance(value, str) and " " in value else f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level: Union[int, str] = logging.INFO):
+    """
+    Sends every log record to stderr as one key=value line.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(KeyValueFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
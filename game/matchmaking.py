@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from game.game_session import GameSession, hash_token, new_token
+from game.grid import Grid
+
+logger = logging.getLogger(__name__)
+
+
+class Match(NamedTuple):
+    game_id: str
+    puzzle_id: Optional[str]
+    player_ids: Tuple[str, str]
+    # time.time() at which both players may start playing
+    starts_at: float
+
+
+class Ticket():
+    """
+    A player waiting for an opponent. `match` resolves once they are paired. The player joins the game with
+    their `player_id` and their secret `token`.
+    """
+    player_id: str
+    token: str
+    size: int
+    stars_per_unit: int
+    bucket: int
+    joined: float
+
+    def __init__(self, size: int, stars_per_unit: int, bucket: int):
+        self.player_id = uuid.uuid4().hex
+        self.token = new_token()
+        self.size = size
+        self.stars_per_unit = stars_per_unit
+        self.bucket = bucket
+        self.joined = time.monotonic()
+        self.match: "asyncio.Future[Match]" = asyncio.get_running_loop().create_future()
+
+
+class Matchmaker():
+    """
+    Pairs waiting players by grid size, stars per unit and skill bucket (`skill // bucket_width`).
+
+    Players wait in insertion ordered dicts, one per bucket, so joining and leaving are O(1). Every
+    `interval` seconds a round pairs the players of each bucket in order of arrival; a player left alone
+    for `widen_after` seconds is paired with the one left alone in the next bucket. All the pairs of a
+    round and size share one puzzle, from `get_grid`, and each pair plays it in its own session, from
+    `open_session` which reserves the session for the pair. Both players are told to start at the same time, `countdown` seconds later.
+    Rounds never wait for the puzzles: the pairs of each size are started in a background task.
+    """
+    bucket_width: int
+    widen_after: float
+    countdown: float
+    matches: int
+
+    def __init__(self, get_grid: Callable[[int, int], Awaitable[Grid]], open_session: Callable[[Grid, Dict[str, str], float], Awaitable[GameSession]],
+                 bucket_width: int = 200, widen_after: float = 10.0, countdown: float = 3.0):
+        self.bucket_width = bucket_width
+        self.widen_after = widen_after
+        self.countdown = countdown
+        self.matches = 0
+        self._get_grid = get_grid
+        self._open_session = open_session
+        # (size, stars per unit) -> bucket -> waiting tickets by player id
+        self._waiting: Dict[Tuple[int, int], Dict[int, "OrderedDict[str, Ticket]"]] = {}
+        # Pairs being given a puzzle and a session, referenced until done
+        self._starting: Set["asyncio.Task[None]"] = set()
+
+    def __len__(self) -> int:
+        return sum(len(tickets) for buckets in self._waiting.values() for tickets in buckets.values())
+
+    def join(self, size: int, stars_per_unit: int = 1, skill: int = 0) -> Ticket:
+        ticket = Ticket(size, stars_per_unit, max(0, skill) // self.bucket_width)
+        buckets = self._waiting.setdefault((size, stars_per_unit), {})
+        buckets.setdefault(ticket.bucket, OrderedDict())[ticket.player_id] = ticket
+        return ticket
+
+    def leave(self, ticket: Ticket):
+        """
+        Takes a player out of the queue, does nothing once they are matched.
+        """
+        buckets = self._waiting.get((ticket.size, ticket.stars_per_unit), {})
+        tickets = buckets.get(ticket.bucket)
+        if tickets is not None and tickets.pop(ticket.player_id, None) is not None and not tickets:
+            del buckets[ticket.bucket]
+        if not ticket.match.done():
+            ticket.match.cancel()
+
+    async def run(self, interval: float = 0.1):
+        """
+        Pairs the waiting players every `interval` seconds, runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.pair()
+            except Exception as e:
+                logger.warning("Matchmaking round failed", extra={'error': repr(e)})
+
+    def pair(self) -> List["asyncio.Task[None]"]:
+        """
+        One matchmaking round. The pairs of each size get their puzzle and sessions in a background task,
+        returned, so that a slow generation holds neither the next rounds nor the other sizes.
+        """
+        tasks = []
+        for (size, stars_per_unit), buckets in list(self._waiting.items()):
+            pairs = self._take_pairs(buckets)
+            if not buckets:
+                del self._waiting[(size, stars_per_unit)]
+            if pairs:
+                task = asyncio.create_task(self._start(size, stars_per_unit, pairs))
+                self._starting.add(task)
+                task.add_done_callback(self._starting.discard)
+                tasks.append(task)
+        return tasks
+
+    def _take_pairs(self, buckets: Dict[int, "OrderedDict[str, Ticket]"]) -> List[Tuple[Ticket, Ticket]]:
+        pairs = []
+        now = time.monotonic()
+        alone: Optional[Ticket] = None
+        for bucket in sorted(buckets):
+            tickets = buckets[bucket]
+            # Someone waiting too long in the bucket below takes the longest waiting player of this one
+            if alone is not None and alone.bucket == bucket - 1 and tickets:
+                first = next(iter(tickets.values()))
+                if now - alone.joined > self.widen_after or now - first.joined > self.widen_after:
+                    del tickets[first.player_id]
+                    del buckets[alone.bucket][alone.player_id]
+                    if not buckets[alone.bucket]:
+                        del buckets[alone.bucket]
+                    pairs.append((alone, first))
+            while len(tickets) >= 2:
+                _, a = tickets.popitem(last=False)
+                _, b = tickets.popitem(last=False)
+                pairs.append((a, b))
+            alone = next(iter(tickets.values()), None)
+            if not tickets:
+                del buckets[bucket]
+        return pairs
+
+    def _requeue(self, ticket: Ticket):
+        # Back in the queue with their waiting time, unless they left
+        if not ticket.match.done():
+            buckets = self._waiting.setdefault((ticket.size, ticket.stars_per_unit), {})
+            buckets.setdefault(ticket.bucket, OrderedDict())[ticket.player_id] = ticket
+
+    async def _start(self, size: int, stars_per_unit: int, pairs: List[Tuple[Ticket, Ticket]]):
+        try:
+            grid = await self._get_grid(size, stars_per_unit)
+        except Exception as e:
+            logger.warning("No puzzle for a matchmaking round", extra={'size': size, 'stars_per_unit': stars_per_unit, 'error': repr(e)})
+            for pair in pairs:
+                for ticket in pair:
+                    self._requeue(ticket)
+            return
+
+        starts_at = time.time() + self.countdown
+        for a, b in pairs:
+            if not a.match.done() and not b.match.done():
+                try:
+                    session = await self._open_session(grid, {a.player_id: hash_token(a.token), b.player_id: hash_token(b.token)}, starts_at)
+                except Exception as e:
+                    logger.warning("No session for a matched pair", extra={'size': size, 'error': repr(e)})
+                    self._requeue(a)
+                    self._requeue(b)
+                    continue
+            if a.match.done() or b.match.done():
+                # One of them left while the puzzle was fetched or the session opened, the other one waits for someone else
+                self._requeue(a)
+                self._requeue(b)
+                continue
+            match = Match(session.game_id, session.puzzle_id, (a.player_id, b.player_id), starts_at)
+            a.match.set_result(match)
+            b.match.set_result(match)
+            self.matches += 1
+        logger.info("Players matched", extra={'size': size, 'stars_per_unit': stars_per_unit, 'pairs': len(pairs)})
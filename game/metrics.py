@@ -0,0 +1,164 @@
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    name: str
+    help: str
+    type: str
+    label_names: Tuple[str, ...]
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        pass
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.label_names, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """
+    Gauge read from a callback when the metrics are collected.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self._read = read
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {self._read()}"]
+
+
+class CallbackCounter(Gauge):
+    """
+    Counter read from a callback, for totals kept by the objects they count.
+    """
+    type = "counter"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(buckets)
+        # labels -> (count per bucket, sum, count)
+        self._values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for labels, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Registry():
+    """
+    Metrics of the process, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+create_game_seconds = registry.register(Histogram("create_game_seconds", "Time to get the grid of a new game by source: new, puzzle (shared id) or daily", label_names=("source",)))
+generation_seconds = registry.register(Histogram("generation_seconds", "Time to generate one unique grid", label_names=("size", "stars")))
+solver_calls_per_puzzle = registry.register(Histogram("solver_calls_per_puzzle", "Solver runs needed to generate one grid", label_names=("size", "stars"), buckets=COUNT_BUCKETS))
+solver_nodes = registry.register(Counter("solver_nodes_total", "Search nodes explored by the solver during generation", label_names=("size", "stars")))
+generations = registry.register(Counter("generations_total", "Generated grids by outcome", label_names=("size", "stars", "outcome")))
+ws_message_seconds = registry.register(Histogram("ws_message_seconds", "Time to handle one websocket message", label_names=("action",)))
+ws_disconnects = registry.register(Counter("ws_disconnects_total", "Websocket connections removed from their session by reason", label_names=("reason",)))
+
+
+def record_generation(size: int, seconds: float, stats: Dict[str, int], stars_per_unit: int = 1):
+    """
+    Records a successful generation with the solver stats collected while it ran.
+    Grids kept at the deadline (stats['partial']) count as "partial" rather than "success".
+    """
+    labels = (str(size), str(stars_per_unit))
+    generation_seconds.observe(seconds, *labels)
+    solver_calls_per_puzzle.observe(stats.get('calls', 0), *labels)
+    solver_nodes.inc(*labels, amount=stats.get('nodes', 0))
+    _record_attempts(labels, stats)
+    generations.inc(*labels, "partial" if stats.get('partial') else "success")
+
+
+def record_timeout(size: int, stats: Dict[str, int], stars_per_unit: int = 1):
+    """
+    Records a generation that produced no grid before its deadline.
+    """
+    labels = (str(size), str(stars_per_unit))
+    solver_nodes.inc(*labels, amount=stats.get('nodes', 0))
+    _record_attempts(labels, stats)
+    generations.inc(*labels, "timeout")
+
+
+def _record_attempts(labels: Tuple[str, ...], stats: Dict[str, int]):
+    # Attempts that raised, and unique grids thrown away for their difficulty
+    if stats.get('failures'):
+        generations.inc(*labels, "failure", amount=stats['failures'])
+    if stats.get('off_target'):
+        generations.inc(*labels, "off_target", amount=stats['off_target'])
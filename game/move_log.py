@@ -0,0 +1,298 @@
+"""
+Append-only log of what happens in the game sessions, to replay the matches in progress or to recover
+the sessions after a restart (see SessionStore.restore).
+
+An entry is (server time.time(), game id, player id, event). The events are the actions players send
+to GameSession.handle_message, as received, plus the session's own: "created" with the grid,
+"connected" and "reserved" with the hashes of the players' tokens, and "won".
+
+`append` only puts the entry in a deque, the websocket path never waits for I/O. A writer thread
+flushes the entries in batches every `interval` seconds, or sooner once `batch_size` are pending.
+A batch that fails to be written stays pending and is written with the next one.
+
+Only the games still in progress are needed after a restart: `read(active_since)` skips the games won or
+idle since then, and `compact` drops them from the log so that it does not grow with every game played.
+
+    FileMoveLog     JSON lines appended to a file, which the worker processes of a host may share
+    SqliteMoveLog   rows of a SQLite table, in WAL mode
+
+Pick one with open_move_log("file:/var/log/star-battle/moves.jsonl") or open_move_log("sqlite:moves.db").
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, IO, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where a file log is only safe for a single server process
+    fcntl = None
+
+from game import codec
+from game.grid import Grid
+
+logger = logging.getLogger(__name__)
+
+Entry = Tuple[float, str, Optional[str], Dict]
+
+
+def grid_event(grid: Grid) -> Dict:
+    """
+    The "created" event of a session, everything needed to build its grid again.
+    """
+    width, height, palette, regions, stars, stars_per_unit = grid.to_compact()
+    return {
+        'action': 'created',
+        'width': width,
+        'height': height,
+        'stars_per_unit': stars_per_unit,
+        'palette': list(palette),
+        'regions': bytes(regions).hex(),
+        'stars': f"{stars:x}",
+        'difficulty': grid.difficulty,
+        'seed': f"{grid.seed:x}" if grid.seed is not None else None,
+    }
+
+
+def grid_from_event(event: Dict) -> Grid:
+    grid = Grid.from_compact((event['width'], event['height'], tuple(event['palette']), bytearray.fromhex(event['regions']), int(event['stars'], 16), event['stars_per_unit']))
+    grid.difficulty = event.get('difficulty')
+    grid.seed = int(event['seed'], 16) if event.get('seed') is not None else None
+    return grid
+
+
+class MoveLog(ABC):
+    """
+    Buffered, batch-written event log. Subclasses store the batches (`_write`) and read them back (`read`).
+    """
+    interval: float
+    batch_size: int
+    written: int
+
+    def __init__(self, interval: float = 0.5, batch_size: int = 1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.written = 0
+        self._pending: Deque[Entry] = deque()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._writer = threading.Thread(target=self._run, name="move-log", daemon=True)
+
+    def start(self):
+        self._writer.start()
+
+    def stop(self):
+        """
+        Writes what is pending and stops the writer thread.
+        """
+        self._stopped = True
+        self._wake.set()
+        if self._writer.is_alive():
+            self._writer.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("Move log entries lost at shutdown", extra={'error': repr(e), 'pending': len(self._pending)})
+
+    def append(self, game_id: str, player_id: Optional[str], event: Dict):
+        self._pending.append((time.time(), game_id, player_id, event))
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        # deque.popleft is thread safe, entries appended meanwhile wait for the next batch
+        batch: List[Entry] = []
+        for _ in range(len(self._pending)):
+            batch.append(self._pending.popleft())
+        if batch:
+            try:
+                self._write(batch)
+            except Exception:
+                # Back in front of the entries appended meanwhile, in order, for the next flush
+                self._pending.extendleft(reversed(batch))
+                raise
+            self.written += len(batch)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Move log flush failed, retrying with the next batch", extra={'error': repr(e), 'pending': len(self._pending)})
+
+    @abstractmethod
+    def _write(self, batch: List[Entry]):
+        pass
+
+    @abstractmethod
+    def read(self, active_since: Optional[float] = None) -> Iterator[Entry]:
+        """
+        Every entry written, in order. With `active_since` (a time.time() timestamp), only the entries of
+        the games not won and with an entry at or after it.
+        """
+
+    @abstractmethod
+    def compact(self, active_since: float) -> int:
+        """
+        Drops the entries of the games won or without an entry since `active_since`, returns how many were dropped.
+        """
+
+    def close(self):
+        pass
+
+
+def _live_games(entries: Iterator[Entry], active_since: float) -> Set[str]:
+    last_entry: Dict[str, float] = {}
+    won: Set[str] = set()
+    for timestamp, game_id, _, event in entries:
+        last_entry[game_id] = max(timestamp, last_entry.get(game_id, timestamp))
+        if event.get('action') == 'won':
+            won.add(game_id)
+    return {game_id for game_id, timestamp in last_entry.items() if timestamp >= active_since and game_id not in won}
+
+
+class FileMoveLog(MoveLog):
+    """
+    Appends and compactions hold an exclusive lock on `<path>.lock`, across threads and processes: the
+    workers of a server may share the file, a compaction never loses the lines another worker appends.
+    Reads take no lock, they see the file as it was when opened.
+    """
+    path: str
+
+    def __init__(self, path: str, interval: float = 0.5, batch_size: int = 1000):
+        super().__init__(interval, batch_size)
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                # Released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, batch: List[Entry]):
+        lines = "".join(codec.dumps([timestamp, game_id, player_id, event]) + "\n" for timestamp, game_id, player_id, event in batch)
+        # Opened under the lock, after a compaction this is the new file
+        with self._locked(), open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+    def read(self, active_since: Optional[float] = None) -> Iterator[Entry]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as file:
+            if active_since is None:
+                yield from _decode(file)
+                return
+            # A first pass finds the live games, only their entries are given to the caller
+            live = _live_games(_decode(file), active_since)
+            file.seek(0)
+            for entry in _decode(file):
+                if entry[1] in live:
+                    yield entry
+
+    def compact(self, active_since: float) -> int:
+        kept = dropped = 0
+        with self._locked():
+            if not os.path.exists(self.path):
+                return 0
+            with open(self.path, encoding="utf-8") as file, open(self.path + ".compact", "w", encoding="utf-8") as compacted:
+                live = _live_games(_decode(file), active_since)
+                file.seek(0)
+                for timestamp, game_id, player_id, event in _decode(file):
+                    if game_id in live:
+                        compacted.write(codec.dumps([timestamp, game_id, player_id, event]) + "\n")
+                        kept += 1
+                    else:
+                        dropped += 1
+            os.replace(self.path + ".compact", self.path)
+        logger.info("Move log compacted", extra={'path': self.path, 'kept': kept, 'dropped': dropped})
+        return dropped
+
+
+def _decode(file: IO[str]) -> Iterator[Entry]:
+    for line in file:
+        try:
+            timestamp, game_id, player_id, event = codec.loads(line)
+        except ValueError:
+            # A line cut short by a crash, or still being appended
+            continue
+        yield timestamp, game_id, player_id, event
+
+
+# Games not won and with an entry since the parameter
+_LIVE_GAMES = "SELECT game_id FROM moves GROUP BY game_id HAVING MAX(created) >= ? AND SUM(action IS 'won') = 0"
+
+
+class SqliteMoveLog(MoveLog):
+    path: str
+
+    def __init__(self, path: str, interval: float = 0.5, batch_size: int = 1000):
+        super().__init__(interval, batch_size)
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS moves (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created REAL NOT NULL,
+                game_id TEXT NOT NULL,
+                player_id TEXT,
+                action TEXT,
+                event TEXT NOT NULL
+            )
+        """)
+        if "action" not in [column[1] for column in self._db.execute("PRAGMA table_info(moves)")]:
+            # Logs written before the action column, their games only count as live until compacted by age
+            self._db.execute("ALTER TABLE moves ADD COLUMN action TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS moves_game_id ON moves (game_id)")
+
+    def _write(self, batch: List[Entry]):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO moves (created, game_id, player_id, action, event) VALUES (?, ?, ?, ?, ?)",
+                [(timestamp, game_id, player_id, event.get('action'), codec.dumps(event)) for timestamp, game_id, player_id, event in batch],
+            )
+
+    def read(self, active_since: Optional[float] = None) -> Iterator[Entry]:
+        with self._lock:
+            if active_since is None:
+                rows = self._db.execute("SELECT created, game_id, player_id, event FROM moves ORDER BY id").fetchall()
+            else:
+                rows = self._db.execute(
+                    f"SELECT created, game_id, player_id, event FROM moves WHERE game_id IN ({_LIVE_GAMES}) ORDER BY id", (active_since,)
+                ).fetchall()
+        for timestamp, game_id, player_id, event in rows:
+            yield timestamp, game_id, player_id, codec.loads(event)
+
+    def compact(self, active_since: float) -> int:
+        with self._lock, self._db:
+            dropped = self._db.execute(f"DELETE FROM moves WHERE game_id NOT IN ({_LIVE_GAMES})", (active_since,)).rowcount
+        logger.info("Move log compacted", extra={'path': self.path, 'dropped': dropped})
+        return dropped
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_move_log(url: str) -> MoveLog:
+    """
+    "file:<path>" or "sqlite:<path>".
+    """
+    if url.startswith("file:"):
+        return FileMoveLog(url[len("file:"):])
+    if url.startswith("sqlite:"):
+        return SqliteMoveLog(url[len("sqlite:"):])
+    raise ValueError(f"Unknown move log {url!r}")
@@ -0,0 +1,127 @@
+"""
+Precomputed star placements for square boards with one star per row and column.
+
+A placement is the column of the star in every row. Stars only touch diagonally between
+consecutive rows, so the valid placements are the permutations without two consecutive
+entries differing by 1. They only depend on the size: the table is built once per size
+and every region map is checked against all of them at once with NumPy.
+
+The table grows quickly (479306 placements for 10x10, 3.9 million for 11x11), sizes above
+MAX_TABLE_SIZE are left to the backtracking solver. NumPy is optional, `available` tells
+whether the tables can be used.
+"""
+from functools import lru_cache
+from typing import Optional, Sequence
+
+MAX_TABLE_SIZE = 10
+
+
+def available(size: int) -> bool:
+    if size > MAX_TABLE_SIZE:
+        return False
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=None)
+def placement_table(size: int):
+    """
+    Returns the valid placements as a (count, size) uint8 array of star columns, row by row.
+    """
+    import numpy as np
+
+    columns = np.arange(size, dtype=np.int16)
+    prefixes = columns[:, None].astype(np.uint8)
+    used = (1 << columns).astype(np.uint16)
+    for _ in range(1, size):
+        last = prefixes[:, -1].astype(np.int16)
+        next_prefixes, next_used = [], []
+        for x in range(size):
+            keep = ((used >> x) & 1 == 0) & (np.abs(last - x) != 1)
+            next_prefixes.append(np.column_stack((prefixes[keep], np.full(int(keep.sum()), x, dtype=np.uint8))))
+            next_used.append(used[keep] | (1 << x))
+        prefixes = np.concatenate(next_prefixes)
+        used = np.concatenate(next_used)
+    prefixes.setflags(write=False)
+    return prefixes
+
+
+@lru_cache(maxsize=None)
+def _cell_table(size: int):
+    # Cell index (y * size + x) of every star of every placement
+    import numpy as np
+
+    cells = placement_table(size).astype(np.intp) + np.arange(size, dtype=np.intp) * size
+    cells.setflags(write=False)
+    return cells
+
+
+@lru_cache(maxsize=None)
+def _bit_tables(size: int):
+    # Popcount of every region set, and the region id of every single-region set
+    import numpy as np
+
+    popcount = np.array([bin(i).count("1") for i in range(1 << size)], dtype=np.uint8)
+    region_of_bit = np.zeros(1 << size, dtype=np.intp)
+    region_of_bit[1 << np.arange(size)] = np.arange(size)
+    return popcount, region_of_bit
+
+
+def _region_bits(size: int, regions: Sequence[int]):
+    """
+    One bit per region for every star of every placement, as a (count, size) uint16 array.
+    `regions` holds the region id of every cell, the ids must be 0 to size - 1.
+    """
+    import numpy as np
+
+    ids = np.frombuffer(bytes(regions), dtype=np.uint8)
+    if ids.size != size * size or ids.max() >= size:
+        raise ValueError(f"Expected {size * size} region ids between 0 and {size - 1}")
+    return np.left_shift(np.uint16(1), ids[_cell_table(size)].astype(np.uint16))
+
+
+def count_solutions(size: int, regions: Sequence[int], limit: Optional[int] = None) -> int:
+    """
+    Counts the placements that give every region exactly one star, capped to `limit` like solver.count_solutions.
+    """
+    import numpy as np
+
+    bits = _region_bits(size, regions)
+    count = int(np.count_nonzero(np.bitwise_or.reduce(bits, axis=1) == (1 << size) - 1))
+    return count if limit is None else min(count, limit)
+
+
+def recolor_counts(size: int, regions: Sequence[int]):
+    """
+    Returns a (size * size, size) array with the number of solutions left after moving
+    each cell into each region, for every recolouring at once.
+
+    Solutions not using the cell are unaffected. Among the placements through the cell,
+    the valid ones after recolouring into R are those whose other stars cover every region but R.
+    """
+    import numpy as np
+
+    bits = _region_bits(size, regions)
+    cells = _cell_table(size)
+    popcount, region_of_bit = _bit_tables(size)
+    full = (1 << size) - 1
+
+    # Regions covered by the other stars of the placement, for each row
+    prefix = np.zeros_like(bits)
+    suffix = np.zeros_like(bits)
+    for y in range(1, size):
+        prefix[:, y] = prefix[:, y - 1] | bits[:, y - 1]
+        suffix[:, size - 1 - y] = suffix[:, size - y] | bits[:, size - y]
+    others = prefix | suffix
+
+    valid = (others[:, 0] | bits[:, 0]) == full
+    base = int(np.count_nonzero(valid))
+    through = np.bincount(cells[valid].ravel(), minlength=size * size)
+
+    distinct = popcount[others] == size - 1
+    keys = cells[distinct] * size + region_of_bit[full ^ others[distinct]]
+    recolored = np.bincount(keys, minlength=size * size * size).reshape(size * size, size)
+    return base - through[:, None] + recolored
@@ -0,0 +1,123 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+from game.grid import Grid
+from model.grid_model import GridCellContent
+
+CONTENTS = (GridCellContent.EMPTY, GridCellContent.STAR, GridCellContent.CROSS)
+CONTENT_CODES = {content: code for code, content in enumerate(CONTENTS)}
+STAR = CONTENT_CODES[GridCellContent.STAR]
+# Content codes with the stars turned into empty cells
+_WITHOUT_STARS = bytes(CONTENT_CODES[GridCellContent.EMPTY] if code == STAR else code for code in range(256))
+
+
+@lru_cache(maxsize=None)
+def _neighbor_indexes(width: int, height: int) -> Tuple[Tuple[int, ...], ...]:
+    return tuple(
+        tuple(ny * width + nx
+              for ny in range(y - 1, y + 2) for nx in range(x - 1, x + 2)
+              if (nx, ny) != (x, y) and 0 <= nx < width and 0 <= ny < height)
+        for y in range(height) for x in range(width)
+    )
+
+
+class PlayerBoard():
+    """
+    The marks a player has put on a grid. Star counters per row, column and region, plus the number
+    of units holding the right count and of touching stars, make checking a win O(1) after each move.
+    `stars` is the bitmask of the starred cells, comparable with the grid's solution.
+    """
+    width: int
+    height: int
+    stars_per_unit: int
+    contents: bytearray
+    row_stars: List[int]
+    col_stars: List[int]
+    region_stars: List[int]
+    units: int
+    satisfied: int
+    conflicts: int
+    star_count: int
+    stars: int
+
+    def __init__(self, grid: Grid):
+        self.width = grid.width
+        self.height = grid.height
+        self.stars_per_unit = grid.stars_per_unit
+        self._regions = grid.board.regions
+        self._neighbors = _neighbor_indexes(self.width, self.height)
+        self.units = self.width + self.height + len(set(self._regions))
+        self.clear()
+
+    def clear(self):
+        self.contents = bytearray(self.width * self.height)
+        self.row_stars = [0] * self.height
+        self.col_stars = [0] * self.width
+        self.region_stars = [0] * 256
+        self.satisfied = 0
+        self.conflicts = 0
+        self.star_count = 0
+        self.stars = 0
+
+    def get(self, x: int, y: int) -> GridCellContent:
+        return CONTENTS[self.contents[y * self.width + x]]
+
+    def set(self, x: int, y: int, content: GridCellContent):
+        """
+        Applies a single move and updates the counters.
+        """
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise ValueError(f"Cell ({x}, {y}) is outside of the grid")
+
+        index = y * self.width + x
+        code = CONTENT_CODES[content]
+        previous = self.contents[index]
+        if previous == code:
+            return
+        self.contents[index] = code
+
+        if previous == STAR:
+            self._count(index, -1)
+        elif code == STAR:
+            self._count(index, 1)
+
+    def is_solved(self) -> bool:
+        return self.satisfied == self.units and self.conflicts == 0
+
+    def load_contents(self, contents: bytes):
+        """
+        Replaces the whole board from content codes (0 empty, 1 star, 2 cross), row by row.
+        """
+        if len(contents) != self.width * self.height:
+            raise ValueError("Grid size does not match")
+        contents = bytes(contents)
+        if contents and max(contents) >= len(CONTENTS):
+            raise ValueError("Invalid content code")
+        self.clear()
+        # Crosses and empty cells leave the counters alone, only the stars are counted one by one
+        self.contents = bytearray(contents.translate(_WITHOUT_STARS))
+        index = contents.find(STAR)
+        while index >= 0:
+            self.contents[index] = STAR
+            self._count(index, 1)
+            index = contents.find(STAR, index + 1)
+
+    def _count(self, index: int, delta: int):
+        y, x = divmod(index, self.width)
+        self.row_stars[y] = self._update_unit(self.row_stars[y], delta)
+        self.col_stars[x] = self._update_unit(self.col_stars[x], delta)
+        region = self._regions[index]
+        self.region_stars[region] = self._update_unit(self.region_stars[region], delta)
+
+        touching = sum(1 for neighbor in self._neighbors[index] if self.contents[neighbor] == STAR)
+        self.conflicts += delta * touching
+        self.star_count += delta
+        self.stars ^= 1 << index
+
+    def _update_unit(self, count: int, delta: int) -> int:
+        if count == self.stars_per_unit:
+            self.satisfied -= 1
+        count += delta
+        if count == self.stars_per_unit:
+            self.satisfied += 1
+        return count
@@ -0,0 +1,185 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, Optional
+
+from game import metrics, solver
+from game.grid import Grid
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationTimeout(TimeoutError):
+    """
+    Raised when no grid was generated before the deadline, with the stats of the generation so far.
+    """
+    def __init__(self, message: str, stats: Optional[Dict[str, float]] = None):
+        super().__init__(message)
+        self.stats = stats if stats is not None else {}
+
+
+def generate_unique_grid(size: int, deadline: Optional[float] = None, stats: Optional[Dict[str, float]] = None, difficulty: Optional[int] = None, stars_per_unit: int = 1, seed: Optional[int] = None) -> Grid:
+    """
+    Runs the generator until it produces a grid with exactly one solution, graded with game.deduction.
+    When `difficulty` is given, grids of another level are thrown away.
+    Each attempt gets its own seed drawn from `seed`: the same arguments give the same grid, and the
+    seed stored on the grid rebuilds it in a single attempt (see game.puzzles).
+    Grids with several stars per unit are not graded, their difficulty stays None.
+
+    Once `deadline` (a time.time() timestamp) is passed the closest grid so far is returned: a unique grid
+    of another difficulty, else the generator's best partial grid. GenerationTimeout is raised if there is none.
+    The solver calls, search nodes, attempts, failed and off target attempts and seconds it took are stored
+    in `stats` if given, and travel with GenerationTimeout: the metrics of a worker process are recorded
+    by the server from them.
+    """
+    from game.generator import Generator
+    if difficulty is not None and stars_per_unit != 1:
+        raise ValueError("Only grids with one star per unit are graded")
+    seeds = random.Random(seed if seed is not None else random.getrandbits(64))
+    start = time.perf_counter()
+    attempts = 0
+    failures = 0
+    off_target = 0
+    # Unique grid of another difficulty, served if the deadline passes first
+    closest: Optional[Grid] = None
+    partial = False
+    with solver.collect_stats() as collected:
+        while True:
+            if deadline is not None and time.time() > deadline:
+                grid, partial = closest, True
+                break
+            try:
+                generator = Generator(size=size, deadline=deadline, stars_per_unit=stars_per_unit, seed=seeds.getrandbits(64))
+            except TimeoutError:
+                grid, partial = closest, True
+                break
+            except Exception as e:
+                attempts += 1
+                failures += 1
+                logger.info("Generation failed, retrying", extra={'size': size, 'stars_per_unit': stars_per_unit, 'error': str(e)})
+                continue
+            attempts += generator.attempts
+            grid = generator.grid
+            if Grid().count_solutions(grid.board, limit=2) != 1:
+                continue
+            if stars_per_unit == 1:
+                grid.grade()
+            if not generator.complete:
+                # The deadline passed while growing the regions, a complete grid is closer to what was asked
+                grid, partial = closest if closest is not None else grid, True
+                break
+            if difficulty is None or grid.difficulty == difficulty:
+                break
+            off_target += 1
+            if closest is None:
+                closest = grid
+
+    collected.update(attempts=attempts, failures=failures, off_target=off_target, seconds=time.perf_counter() - start, partial=int(partial))
+    if stats is not None:
+        stats.update(collected)
+    if grid is None:
+        metrics.record_timeout(size, collected, stars_per_unit)
+        raise GenerationTimeout("Grid generation deadline exceeded", dict(collected))
+
+    metrics.record_generation(size, collected['seconds'], collected, stars_per_unit)
+    logger.debug("Unique grid generated", extra={'size': size, 'stars_per_unit': stars_per_unit, **collected})
+    return grid
+
+
+class PuzzlePool():
+    """
+    Keeps ready, uniqueness-verified grids for each size so that game creation does not wait for a generation.
+    Background workers top a size back up to `capacity` once it drops below `low_water_mark`.
+    Only the `sizes` given are pooled, the other sizes are generated on demand.
+    """
+    capacity: int
+    low_water_mark: int
+    hits: int
+    misses: int
+
+    def __init__(self, sizes: Iterable[int] = (10,), capacity: int = 8, low_water_mark: int = 4, workers: int = 1, generate: Callable[[int], Grid] = generate_unique_grid):
+        if not 0 <= low_water_mark <= capacity:
+            raise ValueError("low_water_mark must be between 0 and capacity")
+        self.capacity = capacity
+        self.low_water_mark = low_water_mark
+        self.hits = 0
+        self.misses = 0
+        self._generate = generate
+        self._grids: Dict[int, Deque[Grid]] = {size: deque() for size in sizes}
+        self._refilling: Dict[int, bool] = {size: True for size in sizes}
+        self._condition = threading.Condition()
+        self._workers = [threading.Thread(target=self._run, name=f"puzzle-pool-{i}", daemon=True) for i in range(workers)]
+        self._stopped = False
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.join()
+
+    def take(self, size: int) -> Optional[Grid]:
+        """
+        Takes a grid from the pool, returns None if none is ready for this size or the size is not pooled.
+        """
+        with self._condition:
+            grids = self._grids.get(size)
+            if grids is None:
+                return None
+            grid = grids.popleft() if grids else None
+            if grid is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if len(grids) < self.low_water_mark:
+                self._refilling[size] = True
+                self._condition.notify()
+        return grid
+
+    def stats(self) -> Dict[str, object]:
+        with self._condition:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'ready': {size: len(grids) for size, grids in self._grids.items()},
+            }
+
+    def _next_size(self) -> Optional[int]:
+        # Emptiest size first so a burst on one size does not starve the others
+        sizes = [size for size, refilling in self._refilling.items() if refilling]
+        if not sizes:
+            return None
+        return min(sizes, key=lambda size: len(self._grids[size]))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                size = self._next_size()
+                while size is None and not self._stopped:
+                    self._condition.wait()
+                    size = self._next_size()
+                if self._stopped:
+                    return
+
+            try:
+                grid = self._generate(size)
+            except Exception as e:
+                logger.warning("Puzzle pool generation failed", extra={'size': size, 'error': str(e)})
+                with self._condition:
+                    # Back off so a persistent failure does not spin the worker
+                    self._condition.wait(timeout=1.0)
+                continue
+
+            with self._condition:
+                grids = self._grids[size]
+                if len(grids) < self.capacity:
+                    grids.append(grid)
+                if len(grids) >= self.capacity:
+                    self._refilling[size] = False
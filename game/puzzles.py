@@ -0,0 +1,165 @@
+"""
+Seed-addressable puzzles.
+
+The generator draws everything from a `random.Random` seeded per attempt, so a puzzle is fully
+described by its size, its stars per unit and the seed of the attempt that produced it. That triple
+is the puzzle id players share, and sessions keep it rather than the grid: the grids live in a
+bounded LRU cache and an evicted grid is generated again, identically, the next time it is needed.
+
+A daily challenge is the first unique grid generated from a seed derived from the date, so every
+server serves the same puzzle on the same day without storing it.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from game.grid import MAX_STALLED_STEPS, Grid
+
+
+class Puzzle(NamedTuple):
+    size: int
+    stars_per_unit: int
+    seed: int
+
+    @property
+    def id(self) -> str:
+        return f"{self.size}-{self.stars_per_unit}-{self.seed:x}"
+
+    @classmethod
+    def parse(cls, puzzle_id: str) -> "Puzzle":
+        """
+        Reads a puzzle id ("<size>-<stars per unit>-<hexadecimal seed>"), raises ValueError when malformed.
+        """
+        try:
+            size, stars_per_unit, seed = puzzle_id.split("-")
+            puzzle = cls(int(size), int(stars_per_unit), int(seed, 16))
+        except ValueError:
+            raise ValueError(f"Invalid puzzle id {puzzle_id!r}")
+        if puzzle.size <= 0 or puzzle.stars_per_unit <= 0 or puzzle.seed < 0 or puzzle.seed >= 1 << 64:
+            raise ValueError(f"Invalid puzzle id {puzzle_id!r}")
+        return puzzle
+
+    @classmethod
+    def of(cls, grid: Grid) -> Optional["Puzzle"]:
+        """
+        The puzzle a grid was generated from, None for grids without a seed (catalog, hand made).
+        """
+        if grid.seed is None or grid.width != grid.height:
+            return None
+        return cls(grid.width, grid.stars_per_unit, grid.seed)
+
+
+def daily_seed(day: date, size: int, stars_per_unit: int = 1) -> int:
+    """
+    Seed of the daily challenge generation, the same on every server.
+    """
+    digest = hashlib.sha256(f"daily:{day.isoformat()}:{size}:{stars_per_unit}".encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def materialize(puzzle: Puzzle, deadline: Optional[float] = None) -> Grid:
+    """
+    Generates the grid of a puzzle again, with the single generation attempt the seed stands for.
+    Raises ValueError when the seed does not give a complete grid with a unique solution before
+    `deadline` (a time.time() timestamp), which only happens for ids that were not handed out by the server.
+    """
+    grid = Grid(width=puzzle.size, height=puzzle.size, stars_per_unit=puzzle.stars_per_unit, seed=puzzle.seed)
+    try:
+        complete = grid.new_generate(deadline=deadline, max_stalled_steps=MAX_STALLED_STEPS)
+    except Exception as e:
+        raise ValueError(f"Puzzle {puzzle.id} cannot be generated: {e}")
+    if not complete:
+        raise ValueError(f"Puzzle {puzzle.id} does not grow into a complete grid")
+    if Grid().count_solutions(grid.board, limit=2) != 1:
+        raise ValueError(f"Puzzle {puzzle.id} has no unique solution")
+    if puzzle.stars_per_unit == 1:
+        grid.grade()
+    return grid
+
+
+class PuzzleCache():
+    """
+    Materialized grids by puzzle, in least recently used order and bounded to `capacity` grids.
+    A miss generates the grid again, outside of the lock: two threads missing the same puzzle
+    both generate it, and get equal grids.
+
+    `get_async` generates missing grids with `materialize`, such as GenerationExecutor.materialize
+    which keeps them out of the server process and bounded in time. `get` generates them in the
+    calling thread, it is meant for grids that were just put in the cache.
+    """
+    capacity: int
+    hits: int
+    misses: int
+
+    def __init__(self, capacity: int = 1000, materialize: Optional[Callable[[Puzzle], Awaitable[Grid]]] = None):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._materialize = materialize
+        self._grids: "OrderedDict[Puzzle, Grid]" = OrderedDict()
+        # Puzzle of the daily challenge by (day, size, stars per unit), only today's are kept
+        self._daily: Dict[Tuple[date, int, int], Puzzle] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._grids)
+
+    def __contains__(self, puzzle: Puzzle) -> bool:
+        return puzzle in self._grids
+
+    def get(self, puzzle: Puzzle) -> Grid:
+        """
+        Returns the grid of a puzzle, generating it if it is not cached. Raises ValueError for invalid puzzles.
+        """
+        grid = self._lookup(puzzle)
+        if grid is None:
+            grid = materialize(puzzle)
+            self.put(puzzle, grid)
+        return grid
+
+    async def get_async(self, puzzle: Puzzle) -> Grid:
+        """
+        Returns the grid of a puzzle, generating it with `materialize` if it is not cached.
+        Raises ValueError for invalid puzzles and for puzzles that could not be generated in time.
+        """
+        grid = self._lookup(puzzle)
+        if grid is None:
+            grid = await self._materialize(puzzle) if self._materialize is not None else await run_in_threadpool(materialize, puzzle)
+            self.put(puzzle, grid)
+        return grid
+
+    def _lookup(self, puzzle: Puzzle) -> Optional[Grid]:
+        with self._lock:
+            grid = self._grids.get(puzzle)
+            if grid is not None:
+                self.hits += 1
+                self._grids.move_to_end(puzzle)
+            else:
+                self.misses += 1
+            return grid
+
+    def put(self, puzzle: Puzzle, grid: Grid):
+        with self._lock:
+            self._grids[puzzle] = grid
+            self._grids.move_to_end(puzzle)
+            while len(self._grids) > self.capacity:
+                self._grids.popitem(last=False)
+
+    def daily(self, day: date, size: int, stars_per_unit: int = 1) -> Optional[Puzzle]:
+        """
+        The daily challenge puzzle if it was already generated here.
+        """
+        return self._daily.get((day, size, stars_per_unit))
+
+    def set_daily(self, day: date, puzzle: Puzzle):
+        with self._lock:
+            for key in [key for key in self._daily if key[0] != day]:
+                del self._daily[key]
+            self._daily[(day, puzzle.size, puzzle.stars_per_unit)] = puzzle
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'grids': len(self._grids), 'hits': self.hits, 'misses': self.misses}
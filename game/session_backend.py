@@ -0,0 +1,257 @@
+"""
+Where game sessions are shared between the server's worker processes.
+
+Websockets belong to the worker that accepted them, so every worker keeps its own GameSession objects
+(see game.session_store). A backend holds what the workers must agree on: the grid of every session,
+so that a websocket landing on another worker than /create-game finds its game, the winner, claimed
+once for all workers, and the game events, published by one worker and relayed by the others to their
+own connections. Players reserved by the matchmaking are shared too, to join on any worker.
+
+    MemorySessionBackend   a single worker, nothing to share
+    SqliteSessionBackend   the workers of one host, through a SQLite file in WAL mode. Events go
+                           through an append-only table that every worker polls.
+
+Pick one with open_backend("memory") or open_backend("sqlite:/var/lib/star-battle/sessions.db").
+"""
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from game.grid import Grid
+
+
+class SharedSession(NamedTuple):
+    grid: Grid
+    winner: Optional[str]
+    # Hashes of the tokens of the player ids reserved by the matchmaking, and when their game starts
+    reserved: Dict[str, str]
+    starts_at: Optional[float]
+
+
+class SessionBackend(ABC):
+    """
+    Shared state of the game sessions. Calls are blocking and meant for a thread (see SessionStore),
+    but for `publish` which only buffers. `shared` is False when there is nothing to share: the calls
+    do nothing and can be skipped.
+    """
+    shared: bool = True
+
+    @abstractmethod
+    def add(self, game_id: str, grid: Grid, reserved: Optional[Dict[str, str]] = None, starts_at: Optional[float] = None):
+        """
+        Shares a session, with the players reserved for it (see GameSession.reserve).
+        """
+
+    @abstractmethod
+    def get(self, game_id: str) -> Optional[SharedSession]:
+        """
+        A session created by any worker, None if there is no such session.
+        """
+
+    @abstractmethod
+    def remove(self, game_id: str):
+        pass
+
+    @abstractmethod
+    def claim_win(self, game_id: str, player_id: str) -> bool:
+        """
+        Records `player_id` as the winner unless someone won first, returns whether they did.
+        """
+
+    @abstractmethod
+    def publish(self, game_id: str, message: Dict, coalesce_key: Optional[Hashable] = None):
+        """
+        Sends a message to the connections of the session on the other workers. Pending messages with
+        the same `coalesce_key` are replaced, as in Connection.send.
+        """
+
+    @abstractmethod
+    def poll(self) -> List[Tuple[str, Dict]]:
+        """
+        Sends the pending messages, returns the (game id, message) published by the other workers since the last poll.
+        """
+
+    @abstractmethod
+    def expire(self, idle_ttl: float) -> int:
+        """
+        Drops the sessions nobody played in for `idle_ttl` seconds, returns how many.
+        """
+
+    def close(self):
+        pass
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    Single worker backend: the worker's own SessionStore already has every session and decides its winners.
+    """
+    shared = False
+
+    def add(self, game_id: str, grid: Grid, reserved: Optional[Dict[str, str]] = None, starts_at: Optional[float] = None):
+        pass
+
+    def get(self, game_id: str) -> Optional[SharedSession]:
+        return None
+
+    def remove(self, game_id: str):
+        pass
+
+    def claim_win(self, game_id: str, player_id: str) -> bool:
+        return True
+
+    def publish(self, game_id: str, message: Dict, coalesce_key: Optional[Hashable] = None):
+        pass
+
+    def poll(self) -> List[Tuple[str, Dict]]:
+        return []
+
+    def expire(self, idle_ttl: float) -> int:
+        return 0
+
+
+class SqliteSessionBackend(SessionBackend):
+    """
+    Sessions and events in a SQLite database shared by the workers of a host.
+
+    WAL mode lets the workers read while one of them writes. Published messages are buffered and written
+    in one transaction by `poll`, which also reads the events of the other workers: the latency across
+    workers is the polling interval. Events older than `event_ttl` seconds are deleted by `expire`.
+    """
+    path: str
+    origin: str
+    event_ttl: float
+
+    def __init__(self, path: str, event_ttl: float = 300.0):
+        self.path = path
+        self.event_ttl = event_ttl
+        # Id of this worker, its own events are not relayed back to it
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        # Publishing only takes this one, never waiting for the database
+        self._pending_lock = threading.Lock()
+        self._pending: "OrderedDict[Hashable, Tuple[str, Dict]]" = OrderedDict()
+        self._ids = 0
+        self._db = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                game_id TEXT PRIMARY KEY,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                stars_per_unit INTEGER NOT NULL,
+                palette TEXT NOT NULL,
+                regions BLOB NOT NULL,
+                stars TEXT NOT NULL,
+                difficulty INTEGER,
+                seed TEXT,
+                winner TEXT,
+                reserved TEXT,
+                starts_at REAL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                game_id TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+        """)
+        # Only the events published from now on are relayed
+        self._last_event = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def add(self, game_id: str, grid: Grid, reserved: Optional[Dict[str, str]] = None, starts_at: Optional[float] = None):
+        width, height, palette, regions, stars, stars_per_unit = grid.to_compact()
+        # Star bitmasks and seeds go past SQLite's 64 bit integers, they are stored as hexadecimal text
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, ?)",
+                (game_id, width, height, stars_per_unit, json.dumps(palette), bytes(regions), f"{stars:x}",
+                 grid.difficulty, f"{grid.seed:x}" if grid.seed is not None else None,
+                 json.dumps(reserved) if reserved else None, starts_at, time.time()),
+            )
+
+    def get(self, game_id: str) -> Optional[SharedSession]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT width, height, stars_per_unit, palette, regions, stars, difficulty, seed, winner, reserved, starts_at FROM sessions WHERE game_id = ?",
+                (game_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        width, height, stars_per_unit, palette, regions, stars, difficulty, seed, winner, reserved, starts_at = row
+        grid = Grid.from_compact((width, height, tuple(json.loads(palette)), bytearray(regions), int(stars, 16), stars_per_unit))
+        grid.difficulty = difficulty
+        grid.seed = int(seed, 16) if seed is not None else None
+        return SharedSession(grid, winner, json.loads(reserved) if reserved else {}, starts_at)
+
+    def remove(self, game_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM sessions WHERE game_id = ?", (game_id,))
+
+    def claim_win(self, game_id: str, player_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute("UPDATE sessions SET winner = ? WHERE game_id = ? AND winner IS NULL", (player_id, game_id))
+            if cursor.rowcount:
+                return True
+            # Sessions unknown to the database, added before the backend was set up, are won locally
+            row = self._db.execute("SELECT winner FROM sessions WHERE game_id = ?", (game_id,)).fetchone()
+        return row is None or row[0] == player_id
+
+    def publish(self, game_id: str, message: Dict, coalesce_key: Optional[Hashable] = None):
+        with self._pending_lock:
+            if coalesce_key is None:
+                self._ids += 1
+                coalesce_key = ("message", self._ids)
+            self._pending[(game_id, coalesce_key)] = (game_id, message)
+
+    def poll(self) -> List[Tuple[str, Dict]]:
+        now = time.time()
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        with self._lock:
+            if pending:
+                self._db.execute("BEGIN")
+                try:
+                    self._db.executemany(
+                        "INSERT INTO events (game_id, origin, payload, created) VALUES (?, ?, ?, ?)",
+                        [(game_id, self.origin, json.dumps(message), now) for game_id, message in pending],
+                    )
+                    # Sessions with events are being played, keep them from expiring
+                    self._db.executemany("UPDATE sessions SET updated = ? WHERE game_id = ?", [(now, game_id) for game_id in {game_id for game_id, _ in pending}])
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+            rows = self._db.execute("SELECT id, game_id, origin, payload FROM events WHERE id > ? ORDER BY id", (self._last_event,)).fetchall()
+        if rows:
+            self._last_event = rows[-1][0]
+        return [(game_id, json.loads(payload)) for _, game_id, origin, payload in rows if origin != self.origin]
+
+    def expire(self, idle_ttl: float) -> int:
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM events WHERE created < ?", (now - self.event_ttl,))
+            return self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - idle_ttl,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_backend(url: str) -> SessionBackend:
+    """
+    "memory", or "sqlite:<path>" for a database shared by the workers.
+    """
+    if url == "memory":
+        return MemorySessionBackend()
+    if url.startswith("sqlite:"):
+        return SqliteSessionBackend(url[len("sqlite:"):])
+    raise ValueError(f"Unknown session backend {url!r}")
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from game.game_session import GameSession
+from game.move_log import MoveLog, grid_event, grid_from_event
+from game.puzzles import PuzzleCache
+from game.session_backend import MemorySessionBackend, SessionBackend
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore():
+    """
+    Game sessions by id, bounded in size and in idle time.
+
+    Sessions are kept in least recently used order. Adding a session beyond `max_sessions` evicts the
+    least recently used one, and `evict_expired` drops sessions idle for more than `idle_ttl` seconds
+    as well as finished games nobody is connected to anymore. Evicted sessions have their sockets closed.
+
+    The store only holds this worker's copies of the sessions. Sessions are added to the `backend` too:
+    a session created by another worker is loaded from it on first use, and `relay` hands the events
+    the other workers publish to the local copies (see game.session_backend).
+
+    With a `move_log` the sessions log their grid and the actions of their players (see game.move_log),
+    `restore` rebuilds the games still in progress from it after a restart.
+    """
+    max_sessions: int
+    idle_ttl: float
+    evictions: int
+    backend: SessionBackend
+
+    def __init__(self, max_sessions: int = 10000, idle_ttl: float = 3600.0, backend: Optional[SessionBackend] = None, puzzle_cache: Optional[PuzzleCache] = None, move_log: Optional[MoveLog] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self.backend = backend if backend is not None else MemorySessionBackend()
+        self.puzzle_cache = puzzle_cache
+        self.move_log = move_log
+        self._sessions: "OrderedDict[str, GameSession]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, game_id: str) -> bool:
+        return game_id in self._sessions
+
+    async def add(self, session: GameSession, shared: bool = True):
+        """
+        Adds a session, and to the backend unless it comes from there. The backend is written in a thread.
+        """
+        if shared and self.backend.shared:
+            await run_in_threadpool(self.backend.add, session.game_id, session.grid, session.reserved, session.starts_at)
+        self._insert(session)
+
+    def _insert(self, session: GameSession, logged: bool = True):
+        session.backend = self.backend
+        session.move_log = self.move_log
+        if logged and self.move_log is not None:
+            # Sessions loaded from the backend are logged too, each worker may have its own log
+            self.move_log.append(session.game_id, None, grid_event(session.grid))
+            if session.reserved:
+                self.move_log.append(session.game_id, None, {'action': 'reserved', 'tokens': session.reserved, 'starts_at': session.starts_at})
+        self._sessions[session.game_id] = session
+        self._sessions.move_to_end(session.game_id)
+        while len(self._sessions) > self.max_sessions:
+            _, oldest = self._sessions.popitem(last=False)
+            self._evict(oldest)
+
+    async def get(self, game_id: str) -> Optional[GameSession]:
+        """
+        Returns the session, loading it from the backend, in a thread, if another worker created it.
+        """
+        session = self._sessions.get(game_id)
+        if session is not None:
+            session.touch()
+            self._sessions.move_to_end(game_id)
+            return session
+        if not self.backend.shared:
+            return None
+        shared = await run_in_threadpool(self.backend.get, game_id)
+        if shared is None:
+            return None
+        session = self._sessions.get(game_id)
+        if session is not None:
+            # Loaded by another connection while this one waited
+            return session
+        session = GameSession(game_id, shared.grid, puzzle_cache=self.puzzle_cache)
+        session.winner = shared.winner
+        if shared.reserved:
+            # Matched players may land on any worker, with the same start
+            session.reserve(shared.reserved, shared.starts_at)
+        self._insert(session)
+        return session
+
+    async def remove(self, game_id: str) -> Optional[GameSession]:
+        await run_in_threadpool(self.backend.remove, game_id)
+        session = self._sessions.pop(game_id, None)
+        if session is not None:
+            self._evict(session)
+        return session
+
+    def evict_expired(self) -> List[GameSession]:
+        now = time.monotonic()
+        expired = [
+            session for session in self._sessions.values()
+            if now - session.last_active > self.idle_ttl or (session.winner is not None and not session.connections)
+        ]
+        for session in expired:
+            del self._sessions[session.game_id]
+            self._evict(session)
+        return expired
+
+    async def sweep(self, interval: float = 60.0):
+        """
+        Evicts expired sessions every `interval` seconds, and drops the finished and idle games from the move log.
+        Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_expired()
+            # The other workers' sessions expire in the backend, whichever worker sweeps first
+            await run_in_threadpool(self.backend.expire, self.idle_ttl)
+            if self.move_log is not None:
+                try:
+                    await run_in_threadpool(self.move_log.compact, time.time() - self.idle_ttl)
+                except Exception as e:
+                    logger.warning("Move log compaction failed", extra={'error': repr(e)})
+
+    async def relay(self, interval: float = 0.05):
+        """
+        Publishes this worker's events and delivers the other workers' ones every `interval` seconds, runs until cancelled.
+        Events of sessions this worker does not hold are only for the other workers.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                events = await run_in_threadpool(self.backend.poll)
+            except Exception as e:
+                logger.warning("Session events poll failed", extra={'error': repr(e)})
+                continue
+            for game_id, event in events:
+                session = self._sessions.get(game_id)
+                if session is not None:
+                    session.deliver(event)
+
+    def restore(self, move_log: MoveLog) -> int:
+        """
+        Rebuilds the sessions of a move log that are still in progress: not won and active within `idle_ttl`.
+        Players get their boards back by connecting with their player id. Returns how many sessions were restored.
+        Meant for startup, before the server accepts connections. The grids come from the log: each session
+        holds its own while its players' boards are replayed, and only then hands it over to the puzzle cache.
+        """
+        sessions: Dict[str, GameSession] = {}
+        last_entry: Dict[str, float] = {}
+        # The log filters out the finished and idle games before any of them is built
+        for timestamp, game_id, player_id, event in move_log.read(active_since=time.time() - self.idle_ttl):
+            action = event.get('action')
+            session = sessions.get(game_id)
+            if action == 'created':
+                if session is None:
+                    try:
+                        sessions[game_id] = GameSession(game_id, grid_from_event(event))
+                    except (KeyError, TypeError, ValueError) as e:
+                        logger.warning("Unreadable session in the move log", extra={'game_id': game_id, 'error': repr(e)})
+                        continue
+            elif session is None:
+                # Created before the log was started, or by a worker logging elsewhere
+                continue
+            elif action == 'reserved':
+                session.reserve(event['tokens'], event.get('starts_at'))
+            elif action == 'won':
+                session.winner = player_id
+            elif player_id is not None:
+                session.replay(player_id, event)
+            last_entry[game_id] = timestamp
+
+        now = time.time()
+        restored = [session for game_id, session in sessions.items() if session.winner is None and now - last_entry[game_id] <= self.idle_ttl]
+        for session in restored:
+            # Startup, nothing waits on the event loop yet
+            self.backend.add(session.game_id, session.grid, session.reserved, session.starts_at)
+            if self.puzzle_cache is not None:
+                session.cache_grid(self.puzzle_cache)
+            self._insert(session, logged=False)
+        logger.info("Sessions restored from the move log", extra={'sessions': len(restored), 'logged': len(sessions)})
+        return len(restored)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'sessions': len(self._sessions),
+            'connections': sum(len(session.connections) for session in self._sessions.values()),
+            'memory_bytes': sum(session.memory_estimate() for session in self._sessions.values()),
+            'evictions': self.evictions,
+        }
+
+    def _evict(self, session: GameSession):
+        self.evictions += 1
+        session.close(code=1001, reason="Game session expired")
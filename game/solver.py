@@ -0,0 +1,242 @@
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+_collector = threading.local()
+
+
+class SearchLimitReached(Exception):
+    """
+    Raised when a search explores more than its `max_nodes` nodes.
+    """
+
+
+@contextmanager
+def collect_stats() -> Iterator[Dict[str, int]]:
+    """
+    Counts the solver runs ('calls') and search nodes ('nodes') made by the current thread inside the block.
+    """
+    stats = {'calls': 0, 'nodes': 0}
+    previous = getattr(_collector, 'stats', None)
+    _collector.stats = stats
+    try:
+        yield stats
+    finally:
+        _collector.stats = previous
+
+
+@lru_cache(maxsize=None)
+def blocking_masks(width: int, height: int) -> Tuple[int, ...]:
+    """
+    For every cell index (y * width + x), the bitmask of cells that can no longer
+    hold a star once a star is placed there: its row, its column and its 8 neighbours.
+    """
+    row_masks = [((1 << width) - 1) << (y * width) for y in range(height)]
+    col_masks = [sum(1 << (y * width + x) for y in range(height)) for x in range(width)]
+
+    masks = []
+    for y in range(height):
+        for x in range(width):
+            mask = row_masks[y] | col_masks[x]
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    ny, nx = y + dy, x + dx
+                    if 0 <= ny < height and 0 <= nx < width:
+                        mask |= 1 << (ny * width + nx)
+            masks.append(mask)
+    return tuple(masks)
+
+
+@lru_cache(maxsize=None)
+def neighbour_masks(width: int, height: int) -> Tuple[int, ...]:
+    """
+    For every cell index, the bitmask of the cell and its 8 neighbours.
+    """
+    masks = []
+    for y in range(height):
+        for x in range(width):
+            mask = 0
+            for ny in range(max(0, y - 1), min(height, y + 2)):
+                for nx in range(max(0, x - 1), min(width, x + 2)):
+                    mask |= 1 << (ny * width + nx)
+            masks.append(mask)
+    return tuple(masks)
+
+
+def find_solutions(width: int, height: int, regions: Sequence[int], limit: Optional[int] = None, blocked: int = 0, stars: int = 0, stats: Optional[Dict[str, int]] = None, stars_per_unit: int = 1, max_nodes: Optional[int] = None) -> List[int]:
+    """
+    Returns the star layouts (as cell bitmasks) placing `stars_per_unit` stars per region, with at most
+    that many stars per row and column and no two stars touching, stopping after `limit` layouts.
+
+    `regions` are cell bitmasks. `blocked` and `stars` allow the search to start from
+    pinned stars that were already placed by the caller. The number of search nodes
+    is added to `stats['nodes']` when a dict is given. SearchLimitReached is raised once
+    the search goes past `max_nodes` nodes.
+    """
+    if stars_per_unit != 1:
+        nodes = [0]
+        try:
+            return _find_multi(width, height, regions, limit, blocked, stars, stars_per_unit, max_nodes, nodes)
+        finally:
+            _record(stats, nodes[0])
+
+    kill = blocking_masks(width, height)
+    found: List[int] = []
+    nodes = [0]
+
+    def backtrack(remaining: Tuple[int, ...], blocked: int, stars: int):
+        nodes[0] += 1
+        if max_nodes is not None and nodes[0] > max_nodes:
+            raise SearchLimitReached()
+        if not remaining:
+            found.append(stars)
+            return
+
+        # Most constrained region first
+        best_index = -1
+        best_avail = 0
+        best_count = 0
+        for index, mask in enumerate(remaining):
+            avail = mask & ~blocked
+            if not avail:
+                return
+            count = avail.bit_count()
+            if best_index < 0 or count < best_count:
+                best_index, best_avail, best_count = index, avail, count
+                if count == 1:
+                    break
+
+        rest = remaining[:best_index] + remaining[best_index + 1:]
+        avail = best_avail
+        while avail:
+            low = avail & -avail
+            backtrack(rest, blocked | kill[low.bit_length() - 1], stars | low)
+            if limit is not None and len(found) >= limit:
+                return
+            avail ^= low
+
+    try:
+        if limit is None or limit > 0:
+            backtrack(tuple(regions), blocked, stars)
+    finally:
+        _record(stats, nodes[0])
+    return found
+
+
+def _record(stats: Optional[Dict[str, int]], nodes: int):
+    if stats is not None:
+        stats['nodes'] = stats.get('nodes', 0) + nodes
+    collected = getattr(_collector, 'stats', None)
+    if collected is not None:
+        collected['calls'] += 1
+        collected['nodes'] += nodes
+
+
+def _find_multi(width: int, height: int, regions: Sequence[int], limit: Optional[int], blocked: int, stars: int, per_unit: int, max_nodes: Optional[int], nodes: List[int]) -> List[int]:
+    """
+    Search for several stars per unit. Units are the regions, rows and columns, each with the
+    number of stars it still needs. The unit with the least slack is branched on: its first free
+    cell either gets a star or is ruled out, and a unit with no slack gets all its free cells at once.
+
+    When there are as many regions as lines every line needs exactly `per_unit` stars, otherwise
+    lines only cap the stars they hold, as in the single star search.
+    """
+    around = neighbour_masks(width, height)
+    rows = [((1 << width) - 1) << (y * width) for y in range(height)]
+    cols = [sum(1 << (y * width + x) for y in range(height)) for x in range(width)]
+    exact = len(regions) == width == height
+
+    units = list(regions) + rows + cols
+    # Stars that fit in a line without touching, counted greedily, per line unit
+    steps = [0] * len(regions) + [1] * height + [width] * width
+    unit_of_cell: List[Tuple[int, ...]] = []
+    for cell in range(width * height):
+        y, x = divmod(cell, width)
+        owners = tuple(i for i, mask in enumerate(regions) if mask >> cell & 1)
+        unit_of_cell.append(owners + (len(regions) + y, len(regions) + height + x))
+    # Units that must reach their count, the others are only capped
+    checked = range(len(units)) if exact else range(len(regions))
+
+    found: List[int] = []
+
+    def fits(avail: int, step: int, need: int) -> bool:
+        count = 0
+        while avail:
+            count += 1
+            if count >= need:
+                return True
+            low = avail & -avail
+            avail &= ~(low | low << step)
+        return False
+
+    def place(cell: int, blocked: int, needs: List[int]) -> int:
+        blocked |= around[cell]
+        for unit in unit_of_cell[cell]:
+            needs[unit] -= 1
+            if not needs[unit]:
+                blocked |= units[unit]
+        return blocked
+
+    def backtrack(blocked: int, stars: int, needs: List[int]):
+        nodes[0] += 1
+        if max_nodes is not None and nodes[0] > max_nodes:
+            raise SearchLimitReached()
+        best = -1
+        best_avail = 0
+        best_slack = 0
+        for unit in checked:
+            need = needs[unit]
+            if not need:
+                continue
+            avail = units[unit] & ~blocked
+            slack = avail.bit_count() - need
+            if slack < 0 or (need > 1 and steps[unit] and not fits(avail, steps[unit], need)):
+                return
+            if best < 0 or slack < best_slack:
+                best, best_avail, best_slack = unit, avail, slack
+        if best < 0:
+            found.append(stars)
+            return
+
+        if best_slack == 0:
+            # Every free cell of the unit is a star
+            needs = needs[:]
+            cells = best_avail
+            while cells:
+                low = cells & -cells
+                if blocked & low:
+                    return
+                blocked = place(low.bit_length() - 1, blocked, needs)
+                stars |= low
+                cells ^= low
+            backtrack(blocked, stars, needs)
+            return
+
+        low = best_avail & -best_avail
+        next_needs = needs[:]
+        backtrack(place(low.bit_length() - 1, blocked, next_needs), stars | low, next_needs)
+        if limit is not None and len(found) >= limit:
+            return
+        backtrack(blocked | low, stars, needs)
+
+    needs = [per_unit] * len(units)
+    cells = stars
+    while cells:
+        low = cells & -cells
+        if blocked & low:
+            # Pinned stars touching each other or beyond the count of a unit
+            return found
+        blocked = place(low.bit_length() - 1, blocked, needs)
+        cells ^= low
+    if limit is None or limit > 0:
+        if min(needs) >= 0:
+            backtrack(blocked, stars, needs)
+    return found
+
+
+def count_solutions(width: int, height: int, regions: Sequence[int], limit: Optional[int] = None, blocked: int = 0, stats: Optional[Dict[str, int]] = None, stars_per_unit: int = 1) -> int:
+    """
+    Counts the valid star layouts, stopping once `limit` is reached.
+    """
+    return len(find_solutions(width, height, regions, limit=limit, blocked=blocked, stats=stats, stars_per_unit=stars_per_unit))
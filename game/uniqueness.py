@@ -0,0 +1,173 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from game import solver
+from game.board import Board
+
+
+class UniquenessState():
+    """
+    Keeps track of the solutions of a grid while its regions are recoloured one cell at a time.
+
+    While the grid has a single solution S, recolouring a non-star cell c into region R keeps
+    every solution that does not use c (S among them) and can only add layouts where c is the
+    star of R. Checking a candidate is therefore a search with c pinned as a star, which is a
+    fraction of a full re-solve. Found layouts are kept as witnesses against their candidate and
+    stay valid until one of their stars is recoloured. All of this holds with several stars per unit.
+    """
+    width: int
+    height: int
+    stars_per_unit: int
+    max_nodes: Optional[int]
+    cell_colors: List[int]
+    regions: Dict[int, int]
+    solutions: List[int]
+
+    def __init__(self, board: Board, max_nodes: Optional[int] = None):
+        self.height = board.height
+        self.width = board.width
+        self.stars_per_unit = board.stars_per_unit
+        self.cell_colors = list(board.regions)
+        self.regions = board.region_masks()
+        # Node budget of a candidate check, past it the recolouring is turned down
+        self.max_nodes = max_nodes
+
+        self._kill = solver.blocking_masks(self.width, self.height)
+        # (cell, color) -> star layout proving the recolouring breaks uniqueness
+        self._witnesses: Dict[Tuple[int, int], int] = {}
+        # (cell, color) recolourings known to keep the grid unique, with the number of
+        # cells recoloured when they were checked
+        self._safe: Dict[Tuple[int, int], int] = {}
+        # Cells recoloured since the verdicts were last cleared
+        self._recolored: List[int] = []
+        self.solutions = self._solve()
+
+    def is_unique(self) -> bool:
+        return len(self.solutions) == 1
+
+    def can_recolor(self, y: int, x: int, color: int) -> bool:
+        """
+        Returns True if moving cell (x, y) into the region id `color` leaves exactly one solution.
+        False is also returned when proving it would take more than `max_nodes` search nodes.
+        """
+        cell = y * self.width + x
+        if self.cell_colors[cell] == color:
+            return self.is_unique()
+        if not self._is_incremental(cell, color):
+            return len(self._solve(recolors=[(cell, color)])) == 1
+
+        try:
+            return self._check(cell, color)
+        except solver.SearchLimitReached:
+            # No witness is kept, the candidate is searched again if it is asked for later
+            self._safe.pop((cell, color), None)
+            return False
+
+    def _check(self, cell: int, color: int) -> bool:
+        key = (cell, color)
+        if key in self._witnesses:
+            return False
+        if key in self._safe:
+            # A recolouring that was safe can only be broken by a layout using a cell recoloured since
+            for other in self._recolored[self._safe[key]:]:
+                witness = self._search(recolors=[key], pins=[cell, other])
+                if witness is not None:
+                    del self._safe[key]
+                    self._witnesses[key] = witness
+                    return False
+            self._safe[key] = len(self._recolored)
+            return True
+
+        witness = self._search(recolors=[(cell, color)], pins=[cell])
+        if witness is None:
+            self._safe[key] = len(self._recolored)
+            return True
+        self._witnesses[key] = witness
+        return False
+
+    def recolor(self, y: int, x: int, color: int):
+        """
+        Moves cell (x, y) into the region id `color` and updates the known solutions.
+        """
+        cell = y * self.width + x
+        old_color = self.cell_colors[cell]
+        if old_color == color:
+            return
+
+        incremental = self._is_incremental(cell, color)
+        unique = self.can_recolor(y, x, color)
+        witness = self._witnesses.get((cell, color))
+
+        bit = 1 << cell
+        self.regions[old_color] &= ~bit
+        if not self.regions[old_color]:
+            del self.regions[old_color]
+        self.regions[color] = self.regions.get(color, 0) | bit
+        self.cell_colors[cell] = color
+
+        if incremental and unique:
+            self._update_verdicts(cell)
+        elif incremental and witness is not None:
+            self.solutions = [self.solutions[0], witness]
+            self._clear_verdicts()
+        else:
+            self.solutions = self._solve()
+            self._clear_verdicts()
+
+    def _is_incremental(self, cell: int, color: int) -> bool:
+        # The unique solution survives moving a non-star cell into an existing region
+        return self.is_unique() and not self.solutions[0] >> cell & 1 and color in self.regions
+
+    def _update_verdicts(self, cell: int):
+        bit = 1 << cell
+        self._witnesses = {
+            key: witness for key, witness in self._witnesses.items()
+            if key[0] != cell and not witness & bit
+        }
+        # Safe verdicts are checked against the recoloured cell when they are asked for again
+        self._safe = {key: checked for key, checked in self._safe.items() if key[0] != cell}
+        self._recolored.append(cell)
+
+    def _clear_verdicts(self):
+        self._witnesses = {}
+        self._safe = {}
+        self._recolored = []
+
+    def _region_masks(self, recolors: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+        regions = dict(self.regions)
+        for cell, color in recolors:
+            bit = 1 << cell
+            old_color = self.cell_colors[cell]
+            regions[old_color] &= ~bit
+            regions[color] = regions.get(color, 0) | bit
+        return {color: mask for color, mask in regions.items() if mask}
+
+    def _solve(self, recolors: Iterable[Tuple[int, int]] = ()) -> List[int]:
+        regions = self._region_masks(recolors)
+        return solver.find_solutions(self.width, self.height, list(regions.values()), limit=2, stars_per_unit=self.stars_per_unit)
+
+    def _search(self, recolors: List[Tuple[int, int]], pins: List[int]) -> Optional[int]:
+        """
+        Returns a solution of the recoloured grid with a star on every pinned cell, if any.
+        """
+        regions = self._region_masks(recolors)
+        colors = dict(recolors)
+        if self.stars_per_unit != 1:
+            # The search checks the pinned stars against the units itself
+            stars = sum(1 << cell for cell in pins)
+            solutions = solver.find_solutions(self.width, self.height, list(regions.values()), limit=1, stars=stars, stars_per_unit=self.stars_per_unit, max_nodes=self.max_nodes)
+            return solutions[0] if solutions else None
+
+        blocked = 0
+        stars = 0
+        for cell in pins:
+            bit = 1 << cell
+            color = colors.get(cell, self.cell_colors[cell])
+            if blocked & bit or color not in regions:
+                return None
+            blocked |= self._kill[cell]
+            stars |= bit
+            # Pinned regions are satisfied, each one can only take a single star
+            del regions[color]
+
+        solutions = solver.find_solutions(self.width, self.height, list(regions.values()), limit=1, blocked=blocked, stars=stars, max_nodes=self.max_nodes)
+        return solutions[0] if solutions else None
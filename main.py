@@ -1,12 +1,95 @@
-from typing import Dict
-from fastapi import FastAPI, WebSocket
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional, Union
+from fastapi import FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from game import codec, metrics
+from game.catalog import PuzzleCatalog
+from game.deduction import DIFFICULTY_NAMES
 from game.game_service import GameService
+from game.generation_executor import GenerationExecutor
+from game.matchmaking import Matchmaker
+from game.move_log import open_move_log
+from game.puzzle_pool import PuzzlePool
+from game.puzzles import Puzzle, PuzzleCache
 from game.grid import Grid
 from game.game_session import GameSession
-from model.game_session_model import GameSessionModel
+from game.log import configure_logging
+from game.session_backend import open_backend
+from game.session_store import SessionStore
+from model.game_session_model import CompactGameSessionModel, GameSessionModel, PackedGameSessionModel
+from model.grid_model import GridFormat
 import uuid
 
-app = FastAPI()
+configure_logging(os.environ.get("LOG_LEVEL", "INFO"))
+logger = logging.getLogger("main")
+
+# Pre-generated puzzles, built with `python -m game.catalog`
+puzzle_catalog = PuzzleCatalog(os.environ["PUZZLE_CATALOG"]) if os.environ.get("PUZZLE_CATALOG") else None
+generation_executor = GenerationExecutor(timeout=10.0)
+# Only sizes missing from the catalog need generating in the background
+pool_sizes = tuple(size for size in (10,) if puzzle_catalog is None or not puzzle_catalog.has(size))
+puzzle_pool = PuzzlePool(sizes=pool_sizes, capacity=8, low_water_mark=4, workers=2, generate=generation_executor.generate_sync)
+# Generated grids by puzzle id, sessions keep the id and evicted grids are generated again
+puzzle_cache = PuzzleCache(capacity=int(os.environ.get("PUZZLE_CACHE_SIZE", "2000")), materialize=generation_executor.materialize)
+# "sqlite:<path>" shares the sessions between the workers of the host (uvicorn --workers)
+# "file:<path>" or "sqlite:<path>" logs the games, they are restored from it on restart
+move_log = open_move_log(os.environ["MOVE_LOG"]) if os.environ.get("MOVE_LOG") else None
+session_store = SessionStore(max_sessions=10000, idle_ttl=3600.0, backend=open_backend(os.environ.get("SESSION_BACKEND", "memory")), puzzle_cache=puzzle_cache, move_log=move_log)
+
+# Largest boards served, and the stars per unit they are played with
+MAX_GRID_SIZE = 14
+MAX_STARS_PER_UNIT = 2
+# Stars of a row cannot be placed without touching those of the next rows on smaller boards
+MIN_GRID_SIZE_PER_STAR = 4
+
+# Actions used as label values, anything else a client sends is counted as "other"
+WS_ACTIONS = ('move', 'get_grid', 'update_grid', 'end_game', 'ping', 'pong')
+# A silent client is pinged every HEARTBEAT_INTERVAL seconds and dropped after HEARTBEAT_TIMEOUT seconds
+HEARTBEAT_INTERVAL = 20.0
+HEARTBEAT_TIMEOUT = 90.0
+
+metrics.registry.register(metrics.Gauge("active_sessions", "Game sessions in the store", lambda: len(session_store)))
+metrics.registry.register(metrics.Gauge("active_connections", "Open websocket connections", lambda: session_store.stats()['connections']))
+metrics.registry.register(metrics.CallbackCounter("session_evictions_total", "Sessions evicted from the store", lambda: session_store.evictions))
+metrics.registry.register(metrics.CallbackCounter("puzzle_pool_hits_total", "Games served from the puzzle pool", lambda: puzzle_pool.hits))
+metrics.registry.register(metrics.CallbackCounter("puzzle_pool_misses_total", "Games that found the puzzle pool empty", lambda: puzzle_pool.misses))
+metrics.registry.register(metrics.Gauge("puzzle_pool_ready", "Puzzles waiting in the pool", lambda: sum(puzzle_pool.stats()['ready'].values())))
+metrics.registry.register(metrics.Gauge("matchmaking_waiting", "Players waiting for an opponent", lambda: len(matchmaker)))
+metrics.registry.register(metrics.CallbackCounter("matchmaking_matches_total", "Pairs of players matched", lambda: matchmaker.matches))
+metrics.registry.register(metrics.Gauge("puzzle_cache_grids", "Grids held by the puzzle cache", lambda: len(puzzle_cache)))
+metrics.registry.register(metrics.CallbackCounter("puzzle_cache_misses_total", "Grids generated again after leaving the puzzle cache", lambda: puzzle_cache.misses))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if move_log is not None:
+        session_store.restore(move_log)
+        move_log.compact(time.time() - session_store.idle_ttl)
+        move_log.start()
+    puzzle_pool.start()
+    sweeper = asyncio.create_task(session_store.sweep(interval=60.0))
+    relay = asyncio.create_task(session_store.relay(interval=0.05)) if session_store.backend.shared else None
+    pairing = asyncio.create_task(matchmaker.run(interval=0.1))
+    yield
+    pairing.cancel()
+    sweeper.cancel()
+    if relay is not None:
+        relay.cancel()
+    puzzle_pool.stop()
+    generation_executor.shutdown()
+    session_store.backend.close()
+    if move_log is not None:
+        move_log.stop()
+        move_log.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -24,36 +107,194 @@ app.add_middleware(
 )
 
 
-game_sessions: Dict[str, GameSession] = {}
+def check_grid_size(size: int, stars: int):
+    if not MIN_GRID_SIZE_PER_STAR <= size <= MAX_GRID_SIZE or not 1 <= stars <= MAX_STARS_PER_UNIT:
+        raise HTTPException(status_code=422, detail=f"Grids are {MIN_GRID_SIZE_PER_STAR} to {MAX_GRID_SIZE} cells wide with 1 to {MAX_STARS_PER_UNIT} stars per unit")
+    if size < MIN_GRID_SIZE_PER_STAR * stars:
+        raise HTTPException(status_code=422, detail=f"{stars} stars per unit need a grid of at least {MIN_GRID_SIZE_PER_STAR * stars}x{MIN_GRID_SIZE_PER_STAR * stars}")
 
-@app.get("/create-game", response_model=GameSessionModel)
-def create_game() -> GameSessionModel:
 
-    grid: Grid = GameService().create_game()
+async def open_session(grid: Grid, reserved: Optional[Dict[str, str]] = None, starts_at: Optional[float] = None) -> GameSession:
     if not grid:
         raise ValueError("Grid is not initialized")
-    game_session = GameSession(game_id=str(uuid.uuid4()), grid=grid)
+    game_session = GameSession(game_id=str(uuid.uuid4()), grid=grid, puzzle_cache=puzzle_cache)
+    if reserved:
+        # Before the session is shared, the other workers get the reservation with it
+        game_session.reserve(reserved, starts_at)
+
+    await session_store.add(game_session)
+    return game_session
+
+
+async def start_session(grid: Grid, format: GridFormat) -> Union[GameSessionModel, CompactGameSessionModel, PackedGameSessionModel]:
+    return (await open_session(grid)).to_dto(format)
+
+
+async def match_grid(size: int, stars: int) -> Grid:
+    return await GameService(puzzle_pool, generation_executor, puzzle_catalog, puzzle_cache).create_game_async(size=size, stars_per_unit=stars)
+
+
+# Players looking for an opponent, paired by size and skill onto shared puzzles
+matchmaker = Matchmaker(get_grid=match_grid, open_session=open_session, bucket_width=200, widen_after=10.0, countdown=3.0)
+
+
+@app.get("/create-game", response_model=Union[GameSessionModel, CompactGameSessionModel, PackedGameSessionModel])
+async def create_game(format: GridFormat = GridFormat.VERBOSE, difficulty: Optional[int] = Query(None, ge=0, lt=len(DIFFICULTY_NAMES)),
+                      size: int = Query(10, ge=MIN_GRID_SIZE_PER_STAR, le=MAX_GRID_SIZE), stars: int = Query(1, ge=1, le=MAX_STARS_PER_UNIT),
+                      puzzle_id: Optional[str] = None) -> Union[GameSessionModel, CompactGameSessionModel, PackedGameSessionModel]:
+    """
+    Starts a game on a new puzzle, or on a shared one when `puzzle_id` is given (size and stars then come from the id).
+    """
+    service = GameService(puzzle_pool, generation_executor, puzzle_catalog, puzzle_cache)
 
-    game_sessions[game_session.game_id] = game_session
+    if puzzle_id is not None:
+        try:
+            puzzle = Puzzle.parse(puzzle_id)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        check_grid_size(puzzle.size, puzzle.stars_per_unit)
+        start = time.perf_counter()
+        try:
+            grid = await service.get_puzzle_async(puzzle)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Puzzle not found")
+        except BrokenProcessPool:
+            logger.warning("Puzzle generation workers failed")
+            raise HTTPException(status_code=503, detail="Grid generation unavailable")
+        finally:
+            metrics.create_game_seconds.observe(time.perf_counter() - start, "puzzle")
+        return await start_session(grid, format)
 
-    return game_session.to_dto()
+    check_grid_size(size, stars)
+    if difficulty is not None and stars != 1:
+        raise HTTPException(status_code=422, detail="Difficulty is only graded for grids with one star per unit")
+
+    start = time.perf_counter()
+    try:
+        grid: Grid = await service.create_game_async(size=size, difficulty=difficulty, stars_per_unit=stars)
+    except TimeoutError:
+        logger.warning("Grid generation timed out")
+        raise HTTPException(status_code=503, detail="Grid generation timed out")
+    except BrokenProcessPool:
+        logger.warning("Grid generation workers failed")
+        raise HTTPException(status_code=503, detail="Grid generation unavailable")
+    finally:
+        metrics.create_game_seconds.observe(time.perf_counter() - start, "new")
+    return await start_session(grid, format)
+
+
+@app.get("/daily", response_model=Union[GameSessionModel, CompactGameSessionModel, PackedGameSessionModel])
+async def daily_game(format: GridFormat = GridFormat.VERBOSE, size: int = Query(10, ge=MIN_GRID_SIZE_PER_STAR, le=MAX_GRID_SIZE),
+                     stars: int = Query(1, ge=1, le=MAX_STARS_PER_UNIT)) -> Union[GameSessionModel, CompactGameSessionModel, PackedGameSessionModel]:
+    """
+    Starts a game on the daily challenge, the same puzzle for everyone during a UTC day.
+    """
+    check_grid_size(size, stars)
+    day = datetime.now(timezone.utc).date()
+    start = time.perf_counter()
+    try:
+        grid = await GameService(puzzle_pool, generation_executor, puzzle_catalog, puzzle_cache).daily_game_async(day, size=size, stars_per_unit=stars)
+    except TimeoutError:
+        logger.warning("Daily grid generation timed out")
+        raise HTTPException(status_code=503, detail="Grid generation timed out")
+    except BrokenProcessPool:
+        logger.warning("Daily grid generation workers failed")
+        raise HTTPException(status_code=503, detail="Grid generation unavailable")
+    finally:
+        metrics.create_game_seconds.observe(time.perf_counter() - start, "daily")
+    return await start_session(grid, format)
+
+
+@app.websocket("/matchmaking")
+async def matchmaking_endpoint(websocket: WebSocket, size: int = 10, stars: int = 1, skill: int = 1000):
+    """
+    Waits for an opponent. Once paired the client gets the game to join on /ws/{game_id} with its player_id
+    and token, and the time.time() both players start at, then the socket is closed.
+    """
+    await websocket.accept()
+    if not MIN_GRID_SIZE_PER_STAR * stars <= size <= MAX_GRID_SIZE or not 1 <= stars <= MAX_STARS_PER_UNIT:
+        await websocket.close(code=1008, reason="Invalid grid size")
+        return
+
+    ticket = matchmaker.join(size, stars, skill)
+    # Leaving the queue is noticed through the socket, the client sends nothing else
+    receiving = asyncio.ensure_future(websocket.receive())
+    try:
+        await websocket.send_json({'action': 'queued', 'player_id': ticket.player_id, 'size': size, 'stars_per_unit': stars})
+        await asyncio.wait({ticket.match, receiving}, return_when=asyncio.FIRST_COMPLETED)
+        if ticket.match.done() and not ticket.match.cancelled():
+            match = ticket.match.result()
+            await websocket.send_json({
+                'action': 'matched',
+                'game_id': match.game_id,
+                'puzzle_id': match.puzzle_id,
+                'player_id': ticket.player_id,
+                'token': ticket.token,
+                'opponent_id': next(player_id for player_id in match.player_ids if player_id != ticket.player_id),
+                'starts_at': match.starts_at,
+            })
+            await websocket.close()
+    except Exception as e:
+        logger.info("Matchmaking socket closed", extra={'player_id': ticket.player_id, 'error': repr(e)})
+    finally:
+        receiving.cancel()
+        matchmaker.leave(ticket)
 
 
 @app.websocket("/ws/{game_id}")
-async def websocket_endpoint(websocket: WebSocket, game_id: str):
+async def websocket_endpoint(websocket: WebSocket, game_id: str, format: GridFormat = GridFormat.VERBOSE, player_id: Optional[str] = None, token: Optional[str] = None):
+    """
+    Plays a game. A client that lost its connection passes its `player_id` and the `token` it got
+    when joining to get its board back.
+    """
     await websocket.accept()
-    if game_id not in game_sessions:
-        print(f"Game session {game_id} not found", game_sessions)
+    game_session = await session_store.get(game_id)
+    if game_session is None:
+        logger.info("Game session not found", extra={'game_id': game_id})
         await websocket.close(code=1008, reason="Game session not found")
         return
-    
-    game_session = game_sessions[game_id]
-    game_session.connect(websocket)
 
+    try:
+        await game_session.load()
+    except (ValueError, BrokenProcessPool) as e:
+        logger.warning("Game session grid unavailable", extra={'game_id': game_id, 'error': repr(e)})
+        await websocket.close(code=1011, reason="Grid unavailable")
+        return
+    connection = game_session.connect(websocket, format, player_id, token)
+    if connection is None:
+        logger.info("Game session full", extra={'game_id': game_id})
+        await websocket.close(code=1008, reason="Game session is full")
+        return
 
+    reason = "closed"
     try:
         while True:
-            data = await websocket.receive_json()
+            try:
+                text = await asyncio.wait_for(websocket.receive_text(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                if connection.idle_for() > HEARTBEAT_TIMEOUT:
+                    reason = "heartbeat"
+                    connection.close(code=1001, reason="Heartbeat timeout")
+                    break
+                connection.send({'game_id': game_id, 'action': 'ping'}, coalesce_key='ping')
+                continue
+            data = codec.loads(text)
+            start = time.perf_counter()
             await game_session.handle_message(websocket, data)
+            action = data.get('action') if isinstance(data, dict) else None
+            metrics.ws_message_seconds.observe(time.perf_counter() - start, action if action in WS_ACTIONS else "other")
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        reason = "error"
+        logger.info("Websocket failed", extra={'game_id': game_id, 'error': repr(e)})
+    finally:
+        # Removed whatever ended the loop, so that nothing is written to a dead socket again
+        game_session.disconnect(websocket)
+        metrics.ws_disconnects.inc(reason)
+        logger.info("Websocket closed", extra={'game_id': game_id, 'player_id': connection.player_id, 'reason': reason})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
\ No newline at end of file
@@ -1,7 +1,28 @@
+from typing import Optional
+
 from pydantic import BaseModel
-from model.grid_model import GridModel
+from model.grid_model import CompactGridModel, GridModel, PackedGridModel
 
 
 class GameSessionModel(BaseModel):
     game_id: str
-    grid: GridModel
\ No newline at end of file
+    grid: GridModel
+    difficulty: Optional[int] = None
+    stars_per_unit: int = 1
+    puzzle_id: Optional[str] = None
+
+
+class CompactGameSessionModel(BaseModel):
+    game_id: str
+    grid: CompactGridModel
+    difficulty: Optional[int] = None
+    stars_per_unit: int = 1
+    puzzle_id: Optional[str] = None
+
+
+class PackedGameSessionModel(BaseModel):
+    game_id: str
+    grid: PackedGridModel
+    difficulty: Optional[int] = None
+    stars_per_unit: int = 1
+    puzzle_id: Optional[str] = None
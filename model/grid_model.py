@@ -1,12 +1,18 @@
 from enum import Enum
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
+from typing_extensions import TypedDict
 
 class GridCellContent(Enum):
     STAR = "star"
     CROSS = "cross"
     EMPTY = "empty"
 
+class GridFormat(Enum):
+    VERBOSE = "verbose"
+    COMPACT = "compact"
+    PACKED = "packed"
+
 class GridCellModel(BaseModel):
     content: GridCellContent = GridCellContent.EMPTY
     region_color: str
@@ -18,3 +24,42 @@ class GridModel(BaseModel):
     width: int
     height: int
     cells: List[List[GridCellModel]]
+
+
+class CompactGridModel(BaseModel):
+    """
+    Region id of every cell, row by row, the colors are looked up in the palette.
+    """
+    width: int
+    height: int
+    palette: List[str]
+    regions: List[int]
+
+
+class PackedGridModel(BaseModel):
+    """
+    Same as CompactGridModel with the region ids as base64 encoded bytes.
+    """
+    width: int
+    height: int
+    palette: List[str]
+    regions: str
+
+
+class GridUpdateCellPayload(TypedDict):
+    content: GridCellContent
+    regionColor: str
+
+
+class GridUpdatePayload(TypedDict):
+    """
+    Grid of an update_grid message, as sent by the client. Only what the server reads is validated,
+    plain dicts are much cheaper than a GridModel with one GridCellModel per cell.
+    """
+    width: int
+    height: int
+    cells: List[List[GridUpdateCellPayload]]
+
+
+# Built once, building the validator is the costly part
+grid_update_adapter: TypeAdapter = TypeAdapter(GridUpdatePayload)
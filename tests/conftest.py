@@ -0,0 +1,28 @@
+import pytest
+
+from game import connection, game_session, matchmaking, session_backend, session_store
+
+
+class FakeClock():
+    """
+    Stands in for the time module of the game modules: time.time() and time.monotonic() only move with `advance`.
+    """
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    fake = FakeClock()
+    for module in (connection, game_session, matchmaking, session_backend, session_store):
+        monkeypatch.setattr(module, "time", fake)
+    return fake
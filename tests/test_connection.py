@@ -0,0 +1,121 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from game.connection import Connection
+from game.game_session import GameSession
+from game.generator import Generator
+from game.player_board import PlayerBoard
+
+
+class StallingSocket():
+    """
+    A websocket whose client reads nothing until `release`, so messages pile up in the connection's queue.
+    """
+    def __init__(self):
+        self.sent: List[Dict] = []
+        self.closed_with: Optional[int] = None
+        self._flowing = asyncio.Event()
+
+    def release(self):
+        self._flowing.set()
+
+    async def send_json(self, message: Dict):
+        await self._flowing.wait()
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        self.closed_with = code
+
+
+async def settle():
+    # Lets the writer and closing tasks run until they block
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def new_connection(socket: StallingSocket, max_queue: int = 32) -> Connection:
+    return Connection(socket, PlayerBoard(Generator(5, seed=0).grid), max_queue=max_queue)
+
+
+def test_progress_updates_are_coalesced():
+    async def scenario():
+        socket = StallingSocket()
+        connection = new_connection(socket)
+        connection.send({'action': 'started'})
+        await settle()
+        for stars in range(5):
+            assert connection.send({'action': 'opponent_progress', 'player_id': 'other', 'stars': stars}, coalesce_key='progress:other')
+        connection.send({'action': 'opponent_progress', 'player_id': 'third', 'stars': 1}, coalesce_key='progress:third')
+        socket.release()
+        await settle()
+        assert socket.sent == [
+            {'action': 'started'},
+            {'action': 'opponent_progress', 'player_id': 'other', 'stars': 4},
+            {'action': 'opponent_progress', 'player_id': 'third', 'stars': 1},
+        ]
+        assert connection.dropped == 0
+    asyncio.run(scenario())
+
+
+def test_full_queue_drops_the_oldest_droppable_message():
+    async def scenario():
+        socket = StallingSocket()
+        connection = new_connection(socket, max_queue=3)
+        connection.send({'n': 0})
+        await settle()
+        connection.send({'n': 1})
+        connection.send({'n': 2}, critical=True)
+        connection.send({'n': 3})
+        assert connection.send({'n': 4}, critical=True)
+        assert connection.dropped == 1
+        assert connection.send({'n': 5})
+        assert connection.dropped == 2
+        assert not connection.closed
+        socket.release()
+        await settle()
+        assert [message['n'] for message in socket.sent] == [0, 2, 4, 5]
+    asyncio.run(scenario())
+
+
+def test_slow_consumer_is_closed_when_only_critical_messages_are_pending():
+    async def scenario():
+        socket = StallingSocket()
+        connection = new_connection(socket, max_queue=2)
+        connection.send({'n': 0}, critical=True)
+        await settle()
+        assert connection.send({'n': 1}, critical=True)
+        assert connection.send({'n': 2}, critical=True)
+        assert not connection.send({'n': 3}, critical=True)
+        assert connection.closed
+        await settle()
+        assert socket.closed_with == 1008
+        # Nothing more is queued or written once closed
+        assert not connection.send({'n': 4})
+        socket.release()
+        await settle()
+        assert socket.sent == []
+    asyncio.run(scenario())
+
+
+def test_heartbeat_idle_time_resets_on_any_message(clock):
+    async def scenario():
+        grid = Generator(5, seed=0).grid
+        session = GameSession("game", grid)
+        socket = StallingSocket()
+        socket.release()
+        connection = session.connect(socket)
+        assert connection.idle_for() == 0
+
+        clock.advance(30.0)
+        assert connection.idle_for() == 30.0
+        await session.handle_message(socket, {'action': 'pong'})
+        assert connection.idle_for() == 0
+
+        clock.advance(45.0)
+        await session.handle_message(socket, {'action': 'move', 'x': 0, 'y': 0, 'content': 'cross'})
+        assert connection.idle_for() == 0
+        clock.advance(91.0)
+        assert connection.idle_for() == 91.0
+        session.close()
+        await settle()
+    asyncio.run(scenario())
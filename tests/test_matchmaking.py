@@ -0,0 +1,133 @@
+import asyncio
+import uuid
+
+import pytest
+
+from game.game_session import GameSession, hash_token
+from game.generator import Generator
+from game.matchmaking import Matchmaker
+
+
+@pytest.fixture(scope="module")
+def grid():
+    return Generator(5, seed=0).grid
+
+
+class Fakes():
+    """
+    Puzzle and session sources of a matchmaker, failing on demand.
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self.grid_error = None
+        self.session_error = None
+        self.sessions = []
+
+    async def get_grid(self, size, stars_per_unit):
+        if self.grid_error is not None:
+            raise self.grid_error
+        return self.grid
+
+    async def open_session(self, grid, tokens, starts_at):
+        if self.session_error is not None:
+            raise self.session_error
+        session = GameSession(uuid.uuid4().hex, grid)
+        session.reserve(tokens, starts_at)
+        self.sessions.append(session)
+        return session
+
+
+def waiting(matchmaker):
+    return {ticket.player_id for buckets in matchmaker._waiting.values() for tickets in buckets.values() for ticket in tickets.values()}
+
+
+async def pair(matchmaker):
+    await asyncio.gather(*matchmaker.pair())
+
+
+def test_players_of_a_bucket_are_paired_in_order(clock, grid):
+    async def scenario():
+        fakes = Fakes(grid)
+        matchmaker = Matchmaker(fakes.get_grid, fakes.open_session, bucket_width=100, countdown=3.0)
+        tickets = [matchmaker.join(8, skill=skill) for skill in (10, 20, 30, 40, 50)]
+        other_size = matchmaker.join(10, skill=10)
+        await pair(matchmaker)
+
+        first, second = tickets[0].match.result(), tickets[2].match.result()
+        assert first.player_ids == (tickets[0].player_id, tickets[1].player_id)
+        assert second.player_ids == (tickets[2].player_id, tickets[3].player_id)
+        assert first.game_id != second.game_id
+        assert first.starts_at == second.starts_at == clock.time() + 3.0
+        assert waiting(matchmaker) == {tickets[4].player_id, other_size.player_id}
+        assert matchmaker.matches == 2
+        # Only the matched players may join, with their own token
+        session = fakes.sessions[0]
+        assert session.reserved == {ticket.player_id: hash_token(ticket.token) for ticket in tickets[:2]}
+    asyncio.run(scenario())
+
+
+def test_window_widens_to_the_next_bucket_only(clock, grid):
+    async def scenario():
+        fakes = Fakes(grid)
+        matchmaker = Matchmaker(fakes.get_grid, fakes.open_session, bucket_width=100, widen_after=10.0)
+        low = matchmaker.join(8, skill=50)
+        far = matchmaker.join(8, skill=250)
+        await pair(matchmaker)
+        assert len(matchmaker) == 2
+
+        clock.advance(5.0)
+        high = matchmaker.join(8, skill=150)
+        await pair(matchmaker)
+        assert len(matchmaker) == 3
+
+        # The players left alone wait long enough, neighbouring buckets are paired, two apart never
+        clock.advance(6.0)
+        await pair(matchmaker)
+        assert low.match.result().player_ids == (low.player_id, high.player_id)
+        assert waiting(matchmaker) == {far.player_id}
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("failing", ["grid", "session"])
+def test_players_wait_again_when_a_start_fails(clock, grid, failing):
+    async def scenario():
+        fakes = Fakes(grid)
+        matchmaker = Matchmaker(fakes.get_grid, fakes.open_session)
+        if failing == "grid":
+            fakes.grid_error = ValueError("no puzzle")
+        else:
+            fakes.session_error = RuntimeError("backend down")
+        a, b = matchmaker.join(8), matchmaker.join(8)
+        joined = a.joined
+        await pair(matchmaker)
+        assert not a.match.done() and not b.match.done()
+        assert waiting(matchmaker) == {a.player_id, b.player_id}
+        # Back with their waiting time, they are not pushed to the end of the queue
+        assert a.joined == joined
+
+        fakes.grid_error = fakes.session_error = None
+        await pair(matchmaker)
+        assert a.match.result().player_ids == (a.player_id, b.player_id)
+        assert len(matchmaker) == 0
+    asyncio.run(scenario())
+
+
+def test_player_left_alone_when_the_other_leaves_during_the_start(clock, grid):
+    async def scenario():
+        fakes = Fakes(grid)
+        puzzle_ready = asyncio.Event()
+        async def slow_grid(size, stars_per_unit):
+            await puzzle_ready.wait()
+            return grid
+        matchmaker = Matchmaker(slow_grid, fakes.open_session)
+        a, b = matchmaker.join(8), matchmaker.join(8)
+        tasks = matchmaker.pair()
+        await asyncio.sleep(0)
+        matchmaker.leave(b)
+        puzzle_ready.set()
+        await asyncio.gather(*tasks)
+        assert b.match.cancelled()
+        assert not a.match.done()
+        assert waiting(matchmaker) == {a.player_id}
+        assert matchmaker.matches == 0
+    asyncio.run(scenario())
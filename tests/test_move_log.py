@@ -0,0 +1,185 @@
+import asyncio
+import multiprocessing
+import time
+from typing import Dict, List, Optional
+
+import pytest
+
+from game import move_log, puzzles
+from game.game_session import GameSession
+from game.move_log import FileMoveLog, MoveLog, SqliteMoveLog
+from game.puzzle_pool import generate_unique_grid
+from game.puzzles import PuzzleCache
+from game.session_store import SessionStore
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def log(request, tmp_path) -> MoveLog:
+    opened = FileMoveLog(str(tmp_path / "moves.jsonl")) if request.param == "file" else SqliteMoveLog(str(tmp_path / "moves.db"))
+    yield opened
+    opened.close()
+
+
+def write_games(log: MoveLog, now: float):
+    log._write([
+        (now - 5000, "idle", None, {'action': 'created'}),
+        (now - 5000, "resumed", None, {'action': 'created'}),
+        (now - 10, "won", None, {'action': 'created'}),
+        (now - 9, "live", None, {'action': 'created'}),
+        (now - 5, "won", "p", {'action': 'won'}),
+        (now - 4000, "idle", "p", {'action': 'move'}),
+        (now - 4, "live", "p", {'action': 'move'}),
+        (now - 3, "resumed", "p", {'action': 'move'}),
+    ])
+
+
+def test_read_active_since_keeps_the_games_in_progress(log):
+    now = time.time()
+    write_games(log, now)
+    assert [entry[1] for entry in log.read()] == ["idle", "resumed", "won", "live", "won", "idle", "live", "resumed"]
+    # A game counts as active from its last entry, its whole history is read
+    assert [(game_id, event['action']) for _, game_id, _, event in log.read(active_since=now - 3600)] == [
+        ("resumed", "created"), ("live", "created"), ("live", "move"), ("resumed", "move")
+    ]
+    assert {entry[1] for entry in log.read(active_since=now - 3.5)} == {"resumed"}
+    assert list(log.read(active_since=now)) == []
+
+
+def test_compact_drops_the_finished_and_idle_games(log):
+    now = time.time()
+    write_games(log, now)
+    assert log.compact(now - 3600) == 4
+    assert [entry[1] for entry in log.read()] == ["resumed", "live", "live", "resumed"]
+    # Still appendable after a compaction, and nothing left to drop
+    log._write([(now, "live", "p", {'action': 'move'})])
+    assert log.compact(now - 3600) == 0
+    assert len(list(log.read())) == 5
+    assert log.compact(now - 2) == 2
+    assert {entry[1] for entry in log.read()} == {"live"}
+
+
+class FlakyMoveLog(MoveLog):
+    def __init__(self):
+        super().__init__()
+        self.failing = True
+        self.entries: List = []
+
+    def _write(self, batch):
+        if self.failing:
+            raise OSError("disk full")
+        self.entries += batch
+
+    def read(self, active_since: Optional[float] = None):
+        return iter(self.entries)
+
+    def compact(self, active_since: float) -> int:
+        return 0
+
+
+def test_failed_batch_is_written_with_the_next_one():
+    log = FlakyMoveLog()
+    log.append("game", None, {'action': 'a'})
+    log.append("game", None, {'action': 'b'})
+    with pytest.raises(OSError):
+        log.flush()
+    log.append("game", None, {'action': 'c'})
+    log.failing = False
+    log.flush()
+    assert [event['action'] for _, _, _, event in log.entries] == ["a", "b", "c"]
+    assert log.written == 3
+
+
+def _append_from_worker(path: str, worker: int, count: int):
+    log = FileMoveLog(path)
+    for move in range(count):
+        log.append(f"worker-{worker}", None, {'action': 'move', 'n': move})
+        log.flush()
+
+
+@pytest.mark.skipif(move_log.fcntl is None or "fork" not in multiprocessing.get_all_start_methods(), reason="needs fcntl and fork")
+def test_compaction_keeps_the_lines_other_processes_append(tmp_path):
+    path = str(tmp_path / "moves.jsonl")
+    log = FileMoveLog(path)
+    log._write([(time.time() - 5000, f"old-{game}", None, {'action': 'created'}) for game in range(1000)])
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_append_from_worker, args=(path, worker, 300)) for worker in range(3)]
+    for worker in workers:
+        worker.start()
+    while any(worker.is_alive() for worker in workers):
+        log.compact(time.time() - 3600)
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    log.compact(time.time() - 3600)
+
+    moves: Dict[str, List[int]] = {}
+    for _, game_id, _, event in log.read():
+        moves.setdefault(game_id, []).append(event['n'])
+    assert moves == {f"worker-{worker}": list(range(300)) for worker in range(3)}
+
+
+class FakeSocket():
+    def __init__(self):
+        self.sent: List[Dict] = []
+
+    async def send_json(self, message: Dict):
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000, reason: Optional[str] = None):
+        pass
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_restore_replays_the_boards_of_the_games_in_progress(log, monkeypatch):
+    grids = [generate_unique_grid(5, seed=seed) for seed in range(3)]
+
+    async def play():
+        store = SessionStore(puzzle_cache=PuzzleCache(capacity=10), move_log=log)
+        sessions = [GameSession(f"game-{index}", grid, puzzle_cache=store.puzzle_cache) for index, grid in enumerate(grids)]
+        players = []
+        for session in sessions:
+            await store.add(session)
+            socket = FakeSocket()
+            connection = session.connect(socket)
+            await session.handle_message(socket, {'action': 'move', 'x': 0, 'y': 0, 'content': 'star'})
+            await session.handle_message(socket, {'action': 'move', 'x': 2, 'y': 1, 'content': 'cross'})
+            await settle()
+            players.append((connection.player_id, socket.sent[0]['token'], bytes(connection.player.contents)))
+        # Finished games are not brought back
+        log.append("game-2", players[2][0], {'action': 'won'})
+        log.flush()
+        return players
+    players = asyncio.run(play())
+
+    # Replaying never regenerates a grid, even when the cache cannot hold them all
+    def no_materialize(puzzle, deadline=None):
+        raise AssertionError("grid regenerated during restore")
+    monkeypatch.setattr(puzzles, "materialize", no_materialize)
+    store = SessionStore(puzzle_cache=PuzzleCache(capacity=1), move_log=log)
+    assert store.restore(log) == 2
+    assert "game-2" not in store
+    monkeypatch.undo()
+
+    async def resume():
+        for index in range(2):
+            player_id, token, contents = players[index]
+            session = await store.get(f"game-{index}")
+            await session.load()
+            stranger = session.connect(FakeSocket(), player_id=player_id, token="wrong")
+            assert stranger.player_id != player_id
+            assert bytes(stranger.player.contents) == bytes(len(contents))
+
+            socket = FakeSocket()
+            connection = session.connect(socket, player_id=player_id, token=token)
+            await settle()
+            assert socket.sent[0]['resumed']
+            assert connection.player_id == player_id
+            assert bytes(connection.player.contents) == contents
+            assert connection.player.star_count == 1
+            session.close()
+            await settle()
+    asyncio.run(resume())
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from bench.run import CORPUS_PATH
+from game import placements, solver
+from game.board import Board
+
+pytest.importorskip("numpy")
+
+with open(CORPUS_PATH) as corpus_file:
+    CORPUS = [entry for entry in json.load(corpus_file) if entry['size'] <= placements.MAX_TABLE_SIZE]
+
+
+def solver_count(size: int, regions: bytearray) -> int:
+    masks = Board(size, size, regions=regions).region_masks()
+    if len(masks) < size:
+        # A region emptied by a recolouring, no star can go there
+        return 0
+    return solver.count_solutions(size, size, list(masks.values()))
+
+
+@pytest.mark.parametrize("entry", CORPUS, ids=[entry['name'] for entry in CORPUS])
+def test_count_solutions_matches_the_solver(entry):
+    size = entry['size']
+    regions = bytearray.fromhex(entry['regions'])
+    expected = solver_count(size, regions)
+    assert placements.count_solutions(size, regions) == expected
+    assert placements.count_solutions(size, regions, limit=2) == min(expected, 2)
+
+
+@pytest.mark.parametrize("entry", [entry for entry in CORPUS if entry['size'] <= 8], ids=lambda entry: entry['name'])
+def test_recolor_counts_match_the_solver(entry):
+    size = entry['size']
+    regions = bytearray.fromhex(entry['regions'])
+    counts = placements.recolor_counts(size, regions)
+    for cell in range(size * size):
+        for region in range(size):
+            recolored = bytearray(regions)
+            recolored[cell] = region
+            assert counts[cell, region] == solver_count(size, recolored), (cell, region)
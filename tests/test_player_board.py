@@ -0,0 +1,104 @@
+import random
+
+import pytest
+
+from game.generator import Generator
+from game.grid import Grid
+from game.player_board import CONTENT_CODES, CONTENTS, STAR, PlayerBoard
+from model.grid_model import GridCellContent
+
+
+def brute_force_counters(board: PlayerBoard, regions: bytearray):
+    """
+    The counters of a board recomputed from its contents: satisfied units, touching star pairs and the stars bitmask.
+    """
+    width, height = board.width, board.height
+    stars = [index for index, code in enumerate(board.contents) if code == STAR]
+    rows = [0] * height
+    cols = [0] * width
+    region_counts = {region: 0 for region in set(regions)}
+    for index in stars:
+        y, x = divmod(index, width)
+        rows[y] += 1
+        cols[x] += 1
+        region_counts[regions[index]] += 1
+    satisfied = sum(count == board.stars_per_unit for count in rows + cols + list(region_counts.values()))
+    starred = set(stars)
+    conflicts = sum(
+        1 for index in stars for other in starred
+        if other > index and abs(other // width - index // width) <= 1 and abs(other % width - index % width) <= 1
+    )
+    return satisfied, conflicts, sum(1 << index for index in stars)
+
+
+def assert_counters(board: PlayerBoard, regions: bytearray):
+    satisfied, conflicts, stars = brute_force_counters(board, regions)
+    assert board.satisfied == satisfied
+    assert board.conflicts == conflicts
+    assert board.stars == stars
+    assert board.star_count == bin(stars).count("1")
+    assert board.is_solved() == (satisfied == board.units and conflicts == 0)
+
+
+def solution_contents(grid: Grid) -> bytes:
+    return bytes(STAR if grid.board.stars >> index & 1 else CONTENT_CODES[GridCellContent.CROSS] for index in range(grid.width * grid.height))
+
+
+@pytest.mark.parametrize("size,stars_per_unit", [(5, 1), (8, 1), (8, 2)])
+@pytest.mark.parametrize("seed", range(4))
+def test_counters_follow_random_moves(size, stars_per_unit, seed):
+    grid = Generator(size, stars_per_unit=stars_per_unit, seed=seed).grid
+    regions = grid.board.regions
+    board = PlayerBoard(grid)
+    rng = random.Random(seed)
+    for _ in range(400):
+        x, y = rng.randrange(size), rng.randrange(size)
+        # Stars more often than the other contents so that units fill up and stars touch
+        board.set(x, y, rng.choice((GridCellContent.STAR, GridCellContent.STAR, GridCellContent.CROSS, GridCellContent.EMPTY)))
+        assert_counters(board, regions)
+
+
+@pytest.mark.parametrize("size,stars_per_unit", [(6, 1), (8, 2)])
+def test_solution_wins_until_a_star_is_removed(size, stars_per_unit):
+    grid = Generator(size, stars_per_unit=stars_per_unit, seed=1).grid
+    regions = grid.board.regions
+    board = PlayerBoard(grid)
+    board.load_contents(solution_contents(grid))
+    assert_counters(board, regions)
+    assert board.is_solved()
+    assert board.stars == grid.board.stars
+
+    index = (grid.board.stars & -grid.board.stars).bit_length() - 1
+    y, x = divmod(index, size)
+    board.set(x, y, GridCellContent.EMPTY)
+    assert_counters(board, regions)
+    assert not board.is_solved()
+
+    board.set(x, y, GridCellContent.STAR)
+    assert_counters(board, regions)
+    assert board.is_solved()
+
+
+def test_load_contents_replaces_the_counters():
+    grid = Generator(6, seed=2).grid
+    regions = grid.board.regions
+    board = PlayerBoard(grid)
+    rng = random.Random(2)
+    for _ in range(5):
+        contents = bytes(rng.randrange(len(CONTENTS)) for _ in range(36))
+        board.load_contents(contents)
+        assert bytes(board.contents) == contents
+        assert_counters(board, regions)
+    board.load_contents(solution_contents(grid))
+    assert board.is_solved()
+    board.load_contents(bytes(36))
+    assert_counters(board, regions)
+    assert board.stars == 0 and not board.is_solved()
+
+
+def test_load_contents_rejects_invalid_boards():
+    board = PlayerBoard(Generator(5, seed=0).grid)
+    with pytest.raises(ValueError):
+        board.load_contents(bytes(24))
+    with pytest.raises(ValueError):
+        board.load_contents(bytes([3] * 25))
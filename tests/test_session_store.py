@@ -0,0 +1,78 @@
+import asyncio
+import uuid
+
+import pytest
+
+from game.game_session import GameSession
+from game.generator import Generator
+from game.session_backend import SqliteSessionBackend
+from game.session_store import SessionStore
+
+
+@pytest.fixture(scope="module")
+def grid():
+    return Generator(5, seed=0).grid
+
+
+def new_session(grid) -> GameSession:
+    return GameSession(uuid.uuid4().hex, grid)
+
+
+def test_least_recently_used_session_is_evicted(clock, grid):
+    store = SessionStore(max_sessions=3, idle_ttl=100.0)
+    sessions = [new_session(grid) for _ in range(3)]
+    for session in sessions:
+        asyncio.run(store.add(session))
+    # Using the oldest session makes the second one the least recently used
+    assert asyncio.run(store.get(sessions[0].game_id)) is sessions[0]
+
+    asyncio.run(store.add(new_session(grid)))
+    assert len(store) == 3
+    assert store.evictions == 1
+    assert sessions[0].game_id in store
+    assert sessions[1].game_id not in store
+    assert asyncio.run(store.get(sessions[1].game_id)) is None
+
+
+def test_idle_and_finished_sessions_expire(clock, grid):
+    store = SessionStore(max_sessions=10, idle_ttl=100.0)
+    idle, active, won = new_session(grid), new_session(grid), new_session(grid)
+    for session in (idle, active, won):
+        asyncio.run(store.add(session))
+    won.winner = "someone"
+
+    clock.advance(60.0)
+    active.touch()
+    assert store.evict_expired() == [won]
+
+    clock.advance(60.0)
+    assert store.evict_expired() == [idle]
+    assert active.game_id in store
+    assert store.evictions == 2
+
+    clock.advance(101.0)
+    assert store.evict_expired() == [active]
+    assert len(store) == 0
+
+
+def test_backend_expires_the_sessions_of_every_worker(clock, grid, tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first = SessionStore(idle_ttl=100.0, backend=SqliteSessionBackend(path))
+    second = SessionStore(idle_ttl=100.0, backend=SqliteSessionBackend(path))
+    session = new_session(grid)
+    asyncio.run(first.add(session))
+    assert asyncio.run(second.get(session.game_id)).solution_stars == session.solution_stars
+
+    # Local eviction only drops the worker's copy, the backend still shares the session
+    clock.advance(101.0)
+    assert first.evict_expired() == [session]
+    assert second.backend.get(session.game_id) is not None
+
+    # Expiring in the backend leaves the local copies to each worker's own sweep
+    assert first.backend.expire(100.0) == 1
+    assert asyncio.run(first.get(session.game_id)) is None
+    assert session.game_id in second
+    assert len(second.evict_expired()) == 1
+    assert asyncio.run(second.get(session.game_id)) is None
+    first.backend.close()
+    second.backend.close()
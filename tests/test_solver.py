@@ -0,0 +1,128 @@
+import itertools
+import random
+from typing import List, Set
+
+import pytest
+
+from game import solver
+from game.board import Board
+from game.generator import Generator
+from game.uniqueness import UniquenessState
+
+
+def random_regions(size: int, rng: random.Random) -> bytearray:
+    """
+    Splits a size x size grid into `size` orthogonally connected regions grown from random cells.
+    """
+    regions = bytearray([0xFF] * (size * size))
+    for region, cell in enumerate(rng.sample(range(size * size), size)):
+        regions[cell] = region
+    while 0xFF in regions:
+        cell = rng.choice([index for index, region in enumerate(regions) if region == 0xFF])
+        y, x = divmod(cell, size)
+        neighbours = [ny * size + nx for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)) if 0 <= ny < size and 0 <= nx < size]
+        grown = [regions[neighbour] for neighbour in neighbours if regions[neighbour] != 0xFF]
+        if grown:
+            regions[cell] = rng.choice(grown)
+    return regions
+
+
+def puzzle_regions(size: int, stars_per_unit: int, seed: int) -> bytearray:
+    """
+    Regions of a generated puzzle for the even seeds, random regions with any number of solutions for the odd ones.
+    """
+    if seed % 2 == 0:
+        return bytearray(Generator(size, stars_per_unit=stars_per_unit, seed=seed).grid.board.regions)
+    return random_regions(size, random.Random(seed))
+
+
+def region_masks(regions: bytearray) -> List[int]:
+    masks = {}
+    for index, region in enumerate(regions):
+        masks[region] = masks.get(region, 0) | 1 << index
+    return list(masks.values())
+
+
+def brute_force(size: int, regions: bytearray, stars_per_unit: int) -> Set[int]:
+    """
+    Every layout with `stars_per_unit` stars per row, column and region and no touching stars, row by row.
+    """
+    rows = [
+        sum(1 << x for x in columns)
+        for columns in itertools.combinations(range(size), stars_per_unit)
+        if all(b - a > 1 for a, b in zip(columns, columns[1:]))
+    ]
+    found = set()
+
+    def place(y: int, previous: int, columns: List[int], stars: int):
+        if y == size:
+            counts = {}
+            for index in range(size * size):
+                if stars >> index & 1:
+                    counts[regions[index]] = counts.get(regions[index], 0) + 1
+            if all(count == stars_per_unit for count in columns) and len(counts) == size and all(count == stars_per_unit for count in counts.values()):
+                found.add(stars)
+            return
+        for row in rows:
+            if row & (previous | previous << 1 | previous >> 1):
+                continue
+            next_columns = [count + (row >> x & 1) for x, count in enumerate(columns)]
+            if max(next_columns) > stars_per_unit:
+                continue
+            place(y + 1, row, next_columns, stars | row << (y * size))
+
+    place(0, 0, [0] * size, 0)
+    return found
+
+
+@pytest.mark.parametrize("size, stars_per_unit", [(4, 1), (5, 1), (6, 1), (8, 2)])
+@pytest.mark.parametrize("seed", range(10))
+def test_find_solutions_matches_brute_force(size, stars_per_unit, seed):
+    regions = puzzle_regions(size, stars_per_unit, seed)
+    expected = brute_force(size, regions, stars_per_unit)
+
+    solutions = solver.find_solutions(size, size, region_masks(regions), stars_per_unit=stars_per_unit)
+
+    assert len(solutions) == len(set(solutions))
+    assert set(solutions) == expected
+    assert solver.count_solutions(size, size, region_masks(regions), limit=2, stars_per_unit=stars_per_unit) == min(len(expected), 2)
+
+
+@pytest.mark.parametrize("size, stars_per_unit", [(5, 1), (6, 1), (8, 2)])
+@pytest.mark.parametrize("seed", range(6))
+def test_uniqueness_state_follows_recolorings(size, stars_per_unit, seed):
+    rng = random.Random(seed)
+    regions = puzzle_regions(size, stars_per_unit, seed)
+    state = UniquenessState(Board(size, size, regions=bytearray(regions), stars_per_unit=stars_per_unit))
+    assert state.is_unique() == (len(brute_force(size, regions, stars_per_unit)) == 1)
+
+    for _ in range(30):
+        cell = rng.randrange(size * size)
+        if regions.count(regions[cell]) == 1:
+            # Emptying a region changes the number of regions, generation never does it
+            continue
+        y, x = divmod(cell, size)
+        color = rng.choice(sorted(set(regions)))
+        recolored = bytearray(regions)
+        recolored[cell] = color
+        expected = brute_force(size, recolored, stars_per_unit)
+
+        assert state.can_recolor(y, x, color) == (len(expected) == 1)
+
+        state.recolor(y, x, color)
+        regions = recolored
+        assert state.is_unique() == (len(expected) == 1)
+        assert set(state.solutions) <= expected
+        assert len(state.solutions) == min(len(expected), 2)
+
+
+def test_only_one_star_grids_are_graded():
+    grid = Generator(8, stars_per_unit=2, seed=0).grid
+    with pytest.raises(ValueError):
+        grid.grade()
+    assert grid.difficulty is None
+
+    grid = Generator(6, seed=0).grid
+    grade = grid.grade()
+    assert grade.solutions == 1
+    assert grid.difficulty == grade.difficulty